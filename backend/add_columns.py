@@ -11,6 +11,8 @@ def add_columns():
     with app.app_context():
         try:
             with db.engine.connect() as conn:
+                # Migrations may run longer than the app's per-statement timeout
+                conn.execute(text("SET statement_timeout = 0"))
                 # Check and add body_fat to user_profiles
                 print("Checking user_profiles table...")
                 if 'postgresql' in app.config['SQLALCHEMY_DATABASE_URI'] or 'postgres' in app.config['SQLALCHEMY_DATABASE_URI']:
@@ -77,6 +79,13 @@ def add_columns():
                         print("Adding ai_comment column to sessions table (PostgreSQL)...")
                         conn.execute(text("ALTER TABLE sessions ADD COLUMN ai_comment TEXT"))
                         print("Column added successfully.")
+
+                    # ai_status
+                    result = conn.execute(text("SELECT column_name FROM information_schema.columns WHERE table_name='sessions' AND column_name='ai_status'"))
+                    if not result.fetchone():
+                        print("Adding ai_status column to sessions table (PostgreSQL)...")
+                        conn.execute(text("ALTER TABLE sessions ADD COLUMN ai_status VARCHAR(20)"))
+                        print("Column added successfully.")
                 else:
                      # SQLite
                     result = conn.execute(text("PRAGMA table_info(sessions)"))
@@ -91,9 +100,95 @@ def add_columns():
                         print("Adding ai_comment column to sessions table (SQLite)...")
                         conn.execute(text("ALTER TABLE sessions ADD COLUMN ai_comment TEXT"))
                         print("Column added successfully.")
-                
+
+                    if 'ai_status' not in columns:
+                        print("Adding ai_status column to sessions table (SQLite)...")
+                        conn.execute(text("ALTER TABLE sessions ADD COLUMN ai_status VARCHAR(20)"))
+                        print("Column added successfully.")
+
+                # Replace the legacy tokens.token column with token_hash (SHA-256 digest, BYTEA).
+                # All existing tokens are deleted, so every existing login is invalidated.
+                print("Checking tokens table...")
+                result = conn.execute(text("SELECT data_type FROM information_schema.columns WHERE table_name='tokens' AND column_name='token'"))
+                row = result.fetchone()
+                if row:
+                    print("Replacing tokens.token with token_hash (all existing logins will be invalidated)...")
+                    conn.execute(text("DELETE FROM tokens"))
+                    conn.execute(text("ALTER TABLE tokens ALTER COLUMN token TYPE BYTEA USING token::bytea"))
+                    conn.execute(text("ALTER TABLE tokens RENAME COLUMN token TO token_hash"))
+                    print("Column replaced successfully.")
+
+                # Convert the legacy sessions.scores column from JSON text to JSONB
+                print("Checking sessions.scores type...")
+                result = conn.execute(text("SELECT data_type FROM information_schema.columns WHERE table_name='sessions' AND column_name='scores'"))
+                row = result.fetchone()
+                if row and row[0] != 'jsonb':
+                    print("Converting sessions.scores to JSONB...")
+                    conn.execute(text("ALTER TABLE sessions ALTER COLUMN scores TYPE JSONB USING NULLIF(scores, '')::jsonb"))
+                    print("Column converted successfully.")
+
+                # Store each session's duration so statistics can SUM it directly
+                print("Checking sessions.duration_seconds...")
+                result = conn.execute(text("SELECT column_name FROM information_schema.columns WHERE table_name='sessions' AND column_name='duration_seconds'"))
+                if not result.fetchone():
+                    print("Adding duration_seconds column to sessions table...")
+                    conn.execute(text("ALTER TABLE sessions ADD COLUMN duration_seconds FLOAT"))
+                    print("Column added successfully.")
+                result = conn.execute(text("UPDATE sessions SET duration_seconds = EXTRACT(EPOCH FROM end_time - start_time) WHERE duration_seconds IS NULL AND end_time IS NOT NULL"))
+                print(f"Backfilled duration_seconds for {result.rowcount} sessions.")
+
+                # Convert plans.daily_goals / plans.weekly_goals from JSON text to JSONB
+                for column in ('daily_goals', 'weekly_goals'):
+                    print(f"Checking plans.{column} type...")
+                    result = conn.execute(text(f"SELECT data_type FROM information_schema.columns WHERE table_name='plans' AND column_name='{column}'"))
+                    row = result.fetchone()
+                    if row and row[0] != 'jsonb':
+                        print(f"Converting plans.{column} to JSONB...")
+                        conn.execute(text(f"ALTER TABLE plans ALTER COLUMN {column} TYPE JSONB USING NULLIF({column}, '')::jsonb"))
+                        print("Column converted successfully.")
+
+                # Link session_scores to sessions (rows are removed together with their session)
+                print("Checking session_scores foreign key...")
+                result = conn.execute(text("SELECT to_regclass('session_scores')"))
+                if result.scalar() is not None:
+                    result = conn.execute(text("SELECT 1 FROM information_schema.table_constraints WHERE table_name='session_scores' AND constraint_name='session_scores_session_id_fkey'"))
+                    if not result.fetchone():
+                        print("Adding session_scores.session_id foreign key...")
+                        conn.execute(text("DELETE FROM session_scores WHERE session_id NOT IN (SELECT session_id FROM sessions)"))
+                        conn.execute(text("ALTER TABLE session_scores ADD CONSTRAINT session_scores_session_id_fkey FOREIGN KEY (session_id) REFERENCES sessions (session_id) ON DELETE CASCADE"))
+                        print("Foreign key added successfully.")
+
                 conn.commit()
-                print("Database migration completed.")
+
+            # Check and add indexes
+            # CREATE INDEX CONCURRENTLY and VACUUM cannot run inside a transaction block,
+            # so they use a separate autocommit connection and do not block writes to live tables
+            with db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                conn.execute(text("SET statement_timeout = 0"))
+                print("Checking indexes...")
+                indexes = {
+                    "ix_tokens_expire_time": "tokens (expire_time)",
+                    "idx_user_status_time": "sessions (user_id, status, start_time) INCLUDE (exercise_type, total_count, correct_count, duration_seconds)",
+                    "idx_sessions_user_start": "sessions (user_id, start_time) INCLUDE (total_count, duration_seconds)",
+                    "idx_sessions_user_type": "sessions (user_id, exercise_type) INCLUDE (total_count)",
+                    "idx_sessions_status_start": "sessions (status, start_time) INCLUDE (user_id, total_count, duration_seconds)",
+                }
+                # Indexes created before duration_seconds existed covered end_time (or nothing) instead; rebuild them
+                for name in ("idx_user_status_time", "idx_sessions_user_start", "idx_sessions_status_start"):
+                    result = conn.execute(text("SELECT indexdef FROM pg_indexes WHERE indexname = :name"), {"name": name})
+                    row = result.fetchone()
+                    if row and 'duration_seconds' not in row[0]:
+                        print(f"Rebuilding index {name}...")
+                        conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+                for name, definition in indexes.items():
+                    conn.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {definition}"))
+                    print(f"Index {name} is in place.")
+
+                # Refresh planner statistics so the new indexes are picked up
+                conn.execute(text("VACUUM ANALYZE sessions"))
+                print("Sessions table analyzed.")
+
+            print("Database migration completed.")
                         
         except Exception as e:
             print(f"Error migrating database: {e}")
@@ -4,24 +4,42 @@ import json
 from datetime import datetime, timedelta, date
 import os
 import hashlib
+import hmac
 import secrets
-from functools import wraps
+from functools import wraps, lru_cache
 import math
+import bisect
+import numpy as np
+import re
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import orjson
 from dotenv import load_dotenv
 import logging
+from sqlalchemy import func, update, cast, Text, text
 from sqlalchemy.exc import SQLAlchemyError, IntegrityError
 try:
     from zhipuai import ZhipuAI
 except ImportError:
     ZhipuAI = None
     print("[Warning] zhipuai library not found. Please install it via 'pip install zhipuai'")
+try:
+    from argon2 import PasswordHasher
+    from argon2.exceptions import VerifyMismatchError, VerificationError, InvalidHashError
+except ImportError:
+    PasswordHasher = None
+    print("[Warning] argon2-cffi library not found. Please install it via 'pip install argon2-cffi'")
+try:
+    from numba import njit
+except ImportError:
+    njit = None
 
 from utils import (
     validate_email, validate_username, validate_password,
     validate_height, validate_weight, validate_age,
     sanitize_input, db_transaction, handle_db_error,
-    validate_exercise_type
+    validate_exercise_type, OrjsonProvider
 )
 
 # 配置日志
@@ -46,15 +64,25 @@ else:
     print("[Config] ZHIPU_API_KEY not found in environment variables")
 
 app = Flask(__name__)
+# 使用 orjson 序列化JSON（始终紧凑输出，debug 模式下也不缩进）
+app.json = OrjsonProvider(app)
 # 配置 CORS，允许所有来源和所有方法（开发环境）
+# 预检结果允许浏览器缓存一天，同一接口不必每次请求前都发送 OPTIONS
 CORS(app, resources={
     r"/api/*": {
         "origins": "*",
         "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-        "allow_headers": ["Content-Type", "Authorization"]
+        "allow_headers": ["Content-Type", "Authorization"],
+        "max_age": 86400
     }
 })
 
+@app.before_request
+def answer_preflight():
+    """OPTIONS 预检请求直接返回空响应，不进入视图和认证；CORS 响应头由 Flask-CORS 统一添加"""
+    if request.method == 'OPTIONS':
+        return app.response_class(status=200)
+
 # 数据库配置
 # 必须使用PostgreSQL，不支持SQLite
 # PostgreSQL连接字符串格式: postgresql://用户名:密码@主机:端口/数据库名
@@ -92,36 +120,70 @@ app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
 # PostgreSQL 连接池配置
 # 对于云数据库（如 Neon），需要特殊配置
+# 连接池大小可通过环境变量调整（云数据库建议较小，自建数据库可以适当调大）
+is_neon = 'neon.tech' in database_url.lower()
+# Neon 的 -pooler 地址由 PgBouncer（事务模式）汇聚连接，应用端每个进程只需保留很少的连接
+is_pooled = '-pooler' in database_url.lower()
+default_pool_size, default_max_overflow = (2, 3) if is_pooled else (20, 40)
+
+connect_args = {
+    'connect_timeout': int(os.getenv('DB_CONNECT_TIMEOUT', 10)),  # 建立连接超时（秒）
+}
+if not is_pooled:
+    # PgBouncer 不支持 options 启动参数，只有直连时才能设置语句超时
+    connect_args['options'] = f"-c statement_timeout={int(os.getenv('DB_STATEMENT_TIMEOUT_MS', 10000))}"
+
 engine_options = {
     'pool_pre_ping': True,  # 自动重连
     'pool_recycle': 300,    # 连接回收时间（5分钟）
-    'pool_size': 5,         # 连接池大小（云数据库建议较小）
-    'max_overflow': 10,     # 最大溢出连接数
+    'pool_size': int(os.getenv('DB_POOL_SIZE', default_pool_size)),              # 连接池大小
+    'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', default_max_overflow)),     # 最大溢出连接数
+    'pool_timeout': int(os.getenv('DB_POOL_TIMEOUT', 10)),  # 连接池耗尽时最多等待（秒），超时快速失败
+    'query_cache_size': 1200,  # SQL编译缓存，鉴权等热点查询不必重复编译
+    'connect_args': connect_args,
 }
 
-# 如果是云数据库（Neon等），可能需要 SSL 配置
-if 'neon.tech' in database_url.lower() or 'pooler' in database_url.lower():
-    # Neon 数据库通常需要 SSL，连接字符串中应该已经包含
-    # 如果连接失败，可能需要添加 ?sslmode=require
-    if '?sslmode=' not in database_url and '?ssl=' not in database_url:
-        logger.info("💡 检测到 Neon 数据库，建议在连接字符串中添加 SSL 参数")
-        logger.info("💡 如果连接失败，尝试添加 ?sslmode=require 到连接字符串末尾")
+# 驱动相关配置
+# psycopg 3（postgresql+psycopg://）：同一语句执行多次后自动改用服务端预备语句，省去重复解析和规划
+# psycopg2（默认 postgresql://）：不支持预备语句，批量插入使用 VALUES 合并 + execute_batch
+if database_url.lower().startswith('postgresql+psycopg://'):
+    connect_args['prepare_threshold'] = int(os.getenv('DB_PREPARE_THRESHOLD', 5))
+else:
+    engine_options['executemany_mode'] = 'values_plus_batch'
+engine_options['isolation_level'] = 'READ COMMITTED'
+
+# 云数据库（Neon）需要 SSL
+if is_neon:
+    if 'sslmode=' not in database_url and 'ssl=' not in database_url:
+        connect_args['sslmode'] = 'require'
+    if not is_pooled:
+        # 直连地址的连接数受计算规格限制（0.25 CU 约 100 个），多进程部署时容易耗尽
+        logger.info("💡 检测到 Neon 直连地址，多进程部署时建议改用 -pooler 地址（如 ep-xxx-pooler.region.aws.neon.tech）")
 
 app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options
 
 # 初始化数据库
-from database import db, init_db, Session, User, UserProfile, Plan, UserAchievement, Checkin, ChallengeCompletion, Token
+from database import db, init_db, TOKEN_BYTES, Session, SessionScore, User, UserProfile, Plan, UserAchievement, Checkin, ChallengeCompletion, Token
 db.init_app(app)
 
 # 导入数据库适配层
 from db_adapter import (
-    load_users, get_user_by_id, get_user_by_username, create_user, update_user,
-    load_tokens, save_token, delete_token, get_token,
+    load_users, get_user_by_id, get_user_with_profile, get_user_credentials, get_user_names, get_user_by_username, get_user_body_metrics, get_user_weight, create_user, update_user,
+    load_tokens, save_token, delete_token, get_token, parse_token, purge_expired_tokens,
+    create_ai_plan_job, finish_ai_plan_job, get_ai_plan_job, purge_expired_ai_plan_jobs,
+    expire_stale_ai_plan_job, AI_PLAN_JOB_TIMEOUT,
     load_plans, get_user_plan, save_user_plan,
-    load_sessions, get_session, create_session, update_session, get_user_sessions,
+    load_sessions, get_session, create_session, update_session, get_user_sessions, get_user_session_history,
+    get_session_totals_by_type,
     load_achievements, get_user_achievements, unlock_achievement,
-    get_user_checkin_stats, add_checkin, get_checkin_calendar,
-    get_challenge_completions, complete_challenge
+    get_user_checkin_stats, get_streak_leaderboard_rows, add_checkin, get_checkin_calendar,
+    get_challenge_completions, get_challenge_completion_dates, get_achievement_activity_counts, complete_challenge
+)
+
+# 导入缓存层（Redis，未配置时自动退化为直接查库）
+from cache import (
+    cache_get, cache_set, cache_delete, token_key, user_key, ai_plan_key, chat_reply_key, checkin_stats_key, local_token_cache, ai_plan_local_cache, LocalTTLCache,
+    USER_CACHE_TTL, AI_PLAN_CACHE_TTL, CHAT_REPLY_CACHE_TTL, CHECKIN_STATS_CACHE_TTL
 )
 
 # 数据存储（已迁移到数据库）
@@ -129,6 +191,9 @@ exercise_data = {}
 
 # 数据库初始化（应用启动时）
 # 使用延迟初始化，避免启动时因数据库连接问题阻塞
+# 数据库初始化的 advisory lock 名称（所有进程共用）
+DB_INIT_LOCK_NAME = 'fitnessai_bootstrap'
+
 def init_database():
     """延迟初始化数据库，避免启动时阻塞"""
     import time
@@ -138,22 +203,33 @@ def init_database():
     for attempt in range(max_retries):
         try:
             with app.app_context():
-                # 确保数据库表存在
-                db.create_all()
-                print("✅ 数据库连接成功")
-                
-                # 检查是否需要迁移JSON数据（仅在首次运行时）
-                from database import User
-                user_count = User.query.count()
-                if user_count == 0:
-                    print("📥 检测到空数据库，尝试迁移JSON数据...")
-                    try:
-                        from database import migrate_from_json
-                        migrate_from_json(app)
-                    except Exception as e:
-                        print(f"⚠️  数据迁移失败（可能是首次运行）: {e}")
-                else:
-                    print(f"✅ 数据库已包含 {user_count} 个用户")
+                # 多个 gunicorn 进程同时启动时，只有拿到 advisory lock 的进程执行建表和迁移
+                # 使用事务级锁：锁在 lock_conn 的事务结束时自动释放。PgBouncer/Neon 连接池的事务模式下
+                # 同一事务固定在一个后端连接上，不会出现加锁和解锁落到不同后端、锁永远不释放的情况
+                with db.engine.connect() as lock_conn, lock_conn.begin():
+                    locked = lock_conn.execute(
+                        text("SELECT pg_try_advisory_xact_lock(hashtext(:name))"), {"name": DB_INIT_LOCK_NAME}
+                    ).scalar()
+                    if not locked:
+                        print("✅ 数据库连接成功（其他进程正在初始化数据库，跳过）")
+                        return
+                    
+                    # 确保数据库表存在
+                    db.create_all()
+                    print("✅ 数据库连接成功")
+                    
+                    # 检查是否需要迁移JSON数据（仅在首次运行时）
+                    from database import User
+                    user_count = User.query.count()
+                    if user_count == 0:
+                        print("📥 检测到空数据库，尝试迁移JSON数据...")
+                        try:
+                            from database import migrate_from_json
+                            migrate_from_json(app)
+                        except Exception as e:
+                            print(f"⚠️  数据迁移失败（可能是首次运行）: {e}")
+                    else:
+                        print(f"✅ 数据库已包含 {user_count} 个用户")
                 return  # 成功则返回
         except Exception as e:
             if attempt < max_retries - 1:
@@ -180,22 +256,266 @@ def init_database():
                 # 不抛出异常，允许应用启动（数据库连接会在实际使用时重试）
 
 # 在后台线程中初始化数据库，避免阻塞启动
+# 生产环境可设置 DB_INIT_ON_STARTUP=0，改为部署时先运行一次 python init_database.py
 import threading
-db_init_thread = threading.Thread(target=init_database, daemon=True)
-db_init_thread.start()
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
+if os.getenv('DB_INIT_ON_STARTUP', '1') == '1':
+    db_init_thread = threading.Thread(target=init_database, daemon=True)
+    db_init_thread.start()
+
+# 过期token清理间隔（秒）
+TOKEN_SWEEP_INTERVAL = int(os.getenv('TOKEN_SWEEP_INTERVAL', 300))
+
+def sweep_expired_tokens():
+    """后台定期清理过期token和过期的AI计划任务，鉴权路径上只判断过期，不做删除"""
+    import time
+    while True:
+        time.sleep(TOKEN_SWEEP_INTERVAL)
+        try:
+            with app.app_context():
+                deleted = purge_expired_tokens()
+            if deleted:
+                logger.info(f"🧹 已清理过期token: {deleted}个")
+        except Exception as e:
+            logger.warning(f"清理过期token失败: {str(e)}")
+        try:
+            with app.app_context():
+                deleted = purge_expired_ai_plan_jobs()
+            if deleted:
+                logger.info(f"🧹 已清理过期AI计划任务: {deleted}个")
+        except Exception as e:
+            logger.warning(f"清理过期AI计划任务失败: {str(e)}")
+
+token_sweep_thread = threading.Thread(target=sweep_expired_tokens, daemon=True)
+token_sweep_thread.start()
+
+# 会话AI简评在后台线程池中生成，结束会话的请求不等待AI接口
+AI_COMMENT_WORKERS = int(os.getenv('AI_COMMENT_WORKERS', 4))
+ai_comment_executor = ThreadPoolExecutor(max_workers=AI_COMMENT_WORKERS, thread_name_prefix='ai-comment')
+DEFAULT_AI_COMMENT = "训练不错！注意保持动作节奏，期待您下次的表现。"
+
+# 简评超过这个时间（秒，从会话结束算起）仍未生成，视为后台任务已丢失（进程重启等），改用默认简评
+AI_COMMENT_TIMEOUT = 60
+
+# 同一时间窗口内结束的会话合并为一次AI请求（最多等待 50ms 或凑满 8 个）
+AI_COMMENT_BATCH_WINDOW = 0.05
+AI_COMMENT_BATCH_SIZE = 8
+
+SESSION_COMMENT_PROMPT = """
+            为用户生成30字以内的健身简评。
+            {data}
+            包含:肯定+1条改进建议。
+            """
+
+SESSION_COMMENT_BATCH_PROMPT = """为以下{count}位用户分别生成30字以内的健身简评，每条包含:肯定+1条改进建议。
+{lines}
+只返回一个JSON字符串数组，共{count}个元素，顺序与编号一致，不要输出其他内容。"""
+
+JSON_ARRAY_PATTERN = re.compile(r'\[.*\]', re.DOTALL)
+
+def save_session_comments(comments, status='done'):
+    """把生成的简评写回数据库，comments 为 (session_id, 简评) 列表"""
+    try:
+        with app.app_context():
+            for session_id, ai_comment in comments:
+                db.session.execute(
+                    update(Session)
+                    .where(Session.session_id == session_id)
+                    .values(ai_comment=ai_comment, ai_status=status)
+                )
+            db.session.commit()
+    except Exception as e:
+        logger.error(f"保存AI总结失败: {[session_id for session_id, _ in comments]} - {str(e)}")
+
+def request_session_comment(data):
+    """单独为一个会话生成简评，失败时返回默认简评"""
+    try:
+        ai_text, error = call_zhipu_ai_api(SESSION_COMMENT_PROMPT.format(data=data), max_retries=1)
+        return ai_text.strip() if ai_text else DEFAULT_AI_COMMENT
+    except Exception as e:
+        logger.error(f"AI 生成总结失败: {e}")
+        return DEFAULT_AI_COMMENT
+
+def request_session_comments_batch(batch):
+    """
+    用一次AI请求为多个会话生成简评
+    
+    Returns:
+        list: 与 batch 顺序一致的简评列表，AI返回格式不符时返回 None
+    """
+    lines = "\n".join(f"{i + 1}. {data}" for i, (_, data) in enumerate(batch))
+    prompt = SESSION_COMMENT_BATCH_PROMPT.format(count=len(batch), lines=lines)
+    try:
+        ai_text, error = call_zhipu_ai_api(prompt, max_retries=1)
+    except Exception as e:
+        logger.error(f"AI 批量生成总结失败: {e}")
+        return None
+    match = JSON_ARRAY_PATTERN.search(ai_text or "")
+    if not match:
+        return None
+    try:
+        comments = orjson.loads(match.group(0))
+    except orjson.JSONDecodeError:
+        return None
+    if len(comments) != len(batch) or not all(isinstance(c, str) and c.strip() for c in comments):
+        return None
+    return [c.strip() for c in comments]
+
+def generate_session_comments(batch):
+    """后台任务：为一批会话生成简评，batch 为 (session_id, 训练数据描述) 列表"""
+    try:
+        comments = request_session_comments_batch(batch) if len(batch) > 1 else None
+        if comments is None:
+            # 只有一个会话，或批量结果无法按编号拆分时，逐个生成
+            comments = [request_session_comment(data) for _, data in batch]
+    except Exception as e:
+        # 任何异常都要写回最终状态，否则客户端会一直看到 pending
+        logger.error(f"AI 生成总结失败: {[session_id for session_id, _ in batch]} - {str(e)}")
+        save_session_comments([(session_id, DEFAULT_AI_COMMENT) for session_id, _ in batch], status='failed')
+        return
+    save_session_comments([(session_id, comment) for (session_id, _), comment in zip(batch, comments)])
+
+class AICommentBatcher:
+    """
+    会话简评批处理器
+    收集短时间窗口内提交的简评请求，合并后交给线程池，多个会话共用一次AI调用
+    """
+
+    def __init__(self, executor, window, max_size):
+        self.executor = executor
+        self.window = window
+        self.max_size = max_size
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._collect, daemon=True, name='ai-comment-batcher')
+        self.thread.start()
+
+    def submit(self, session_id, data):
+        """提交一个会话的简评请求"""
+        self.queue.put((session_id, data))
+
+    def _collect(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self.executor.submit(generate_session_comments, batch)
+
+ai_comment_batcher = AICommentBatcher(ai_comment_executor, AI_COMMENT_BATCH_WINDOW, AI_COMMENT_BATCH_SIZE)
+
+# 新密码哈希带方案前缀；没有前缀的是旧版 sha256 十六进制摘要
+# 安装了 argon2-cffi 时使用 argon2id（加盐、抗暴力破解），旧哈希在登录成功后自动升级
+# 未安装 argon2-cffi 时使用标准库的 PBKDF2-HMAC-SHA256（加盐，迭代在 OpenSSL 内完成）
+ARGON2_PREFIX = '$argon2'
+PBKDF2_PREFIX = 'pbkdf2_sha256$'
+# argon2id 参数参考 OWASP 推荐值（m=46 MiB, t=1, p=1），单次校验在几十毫秒内
+ARGON2_MEMORY_COST = 47104  # KiB
+ARGON2_TIME_COST = 1
+ARGON2_PARALLELISM = 1
+password_hasher = PasswordHasher(
+    memory_cost=ARGON2_MEMORY_COST,
+    time_cost=ARGON2_TIME_COST,
+    parallelism=ARGON2_PARALLELISM,
+) if PasswordHasher is not None else None
+
+# PBKDF2 迭代次数与盐长度；迭代次数写在哈希中，调高后旧哈希会在登录时升级
+PBKDF2_ITERATIONS = 200_000
+PBKDF2_SALT_BYTES = 16
+
+def pbkdf2_hash(password, salt, iterations):
+    """PBKDF2-HMAC-SHA256 摘要（hex）"""
+    return hashlib.pbkdf2_hmac('sha256', password.encode(), salt, iterations).hex()
 
 def hash_password(password):
-    """密码哈希"""
-    return hashlib.sha256(password.encode()).hexdigest()
+    """密码哈希（优先 argon2id，未安装时使用 PBKDF2-HMAC-SHA256），格式：pbkdf2_sha256$迭代次数$盐$摘要"""
+    if password_hasher is not None:
+        return password_hasher.hash(password)
+    salt = secrets.token_bytes(PBKDF2_SALT_BYTES)
+    return f"{PBKDF2_PREFIX}{PBKDF2_ITERATIONS}${salt.hex()}${pbkdf2_hash(password, salt, PBKDF2_ITERATIONS)}"
+
+def verify_password(password, stored_hash):
+    """
+    校验密码，兼容旧版无盐的 sha256 哈希
+    
+    Returns:
+        tuple: (是否匹配, 是否需要用当前方案重新哈希)
+    """
+    if not stored_hash:
+        return False, False
+    if stored_hash.startswith(ARGON2_PREFIX):
+        if password_hasher is None:
+            logger.error("密码使用 argon2 哈希，但未安装 argon2-cffi 库")
+            return False, False
+        try:
+            password_hasher.verify(stored_hash, password)
+        except (VerifyMismatchError, VerificationError, InvalidHashError):
+            return False, False
+        # 哈希参数调整后，旧参数的哈希同样需要升级
+        return True, password_hasher.check_needs_rehash(stored_hash)
+    if stored_hash.startswith(PBKDF2_PREFIX):
+        try:
+            iterations, salt_hex, digest = stored_hash[len(PBKDF2_PREFIX):].split('$')
+            iterations, salt = int(iterations), bytes.fromhex(salt_hex)
+        except ValueError:
+            logger.error("密码哈希格式不合法（pbkdf2_sha256）")
+            return False, False
+        matched = hmac.compare_digest(pbkdf2_hash(password, salt, iterations).encode(), digest.encode())
+        return matched, matched and (password_hasher is not None or iterations < PBKDF2_ITERATIONS)
+    matched = hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest().encode(), stored_hash.encode())
+    return matched, matched
+
+# 用户体重缓存（卡路里估算用），体重很少变化，缓存5分钟；本进程修改资料时主动清除
+WEIGHT_CACHE_TTL = 300
+weight_cache = LocalTTLCache(maxsize=10000, ttl=WEIGHT_CACHE_TTL)
+
+def get_cached_user_weight(user_id):
+    """获取用户体重（优先读取缓存），未填写时返回 None"""
+    weight = weight_cache.get(user_id)
+    if weight is None:
+        # 未填写体重的用户同样缓存（记为0），避免每次都查询数据库
+        weight = get_user_weight(user_id) or 0.0
+        weight_cache.set(user_id, weight)
+    return weight or None
+
+# 用户不存在时也校验一次这个哈希，使两种登录失败的耗时一致，避免通过响应时间枚举用户名
+DUMMY_PASSWORD_HASH = hash_password(secrets.token_hex(16))
 
 def generate_token():
-    """生成token"""
-    return secrets.token_urlsafe(32)
+    """生成token（32字节随机值，以hex字符串返回给客户端）"""
+    return secrets.token_bytes(TOKEN_BYTES).hex()
 
 def verify_token(token):
-    """验证token"""
+    """验证token（依次读取进程内缓存、Redis缓存，都未命中再查询数据库）"""
+    token_hash = parse_token(token)
+    if token_hash is None:
+        return None
+    
+    user_id = local_token_cache.get(token_hash)
+    if user_id is not None:
+        return user_id
+    
+    now = datetime.now()
+    # Redis中保存 "user_id|过期时间戳"，进程内缓存据此计算剩余有效期
+    cached = cache_get(token_key(token_hash))
+    if cached is not None and b"|" in cached:
+        user_id, expire_ts = cached.decode().rsplit("|", 1)
+        local_token_cache.set(token_hash, user_id, float(expire_ts) - now.timestamp())
+        return user_id
+    
     token_obj = get_token(token)
-    if token_obj and datetime.now() < token_obj.expire_time:
+    if token_obj and now < token_obj.expire_time:
+        # token在过期前不会变化，缓存时间与剩余有效期一致（进程内缓存另有上限）
+        remaining = (token_obj.expire_time - now).total_seconds()
+        local_token_cache.set(token_hash, token_obj.user_id, remaining)
+        cache_set(token_key(token_hash), f"{token_obj.user_id}|{token_obj.expire_time.timestamp()}", remaining)
         return token_obj.user_id
     return None
 
@@ -203,18 +523,10 @@ def require_auth(f):
     """认证装饰器"""
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        # OPTIONS 预检请求不需要认证
-        if request.method == 'OPTIONS':
-            response = jsonify({})
-            # 显式添加CORS头，防止某些情况下CORS中间件未生效
-            response.headers.add('Access-Control-Allow-Origin', '*')
-            response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization')
-            response.headers.add('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE,OPTIONS')
-            return response, 200
-        
+        # OPTIONS 预检请求已在 answer_preflight 中直接返回，不会到达这里
         token = request.headers.get('Authorization')
         if not token:
-            print("❌ [Auth] 未提供认证token")
+            logger.warning("❌ [Auth] 未提供认证token")
             return jsonify({"error": "未提供认证token"}), 401
         
         # 移除 "Bearer " 前缀（如果存在）
@@ -223,7 +535,7 @@ def require_auth(f):
         
         user_id = verify_token(token)
         if not user_id:
-            print(f"❌ [Auth] 无效或过期的token: {token[:10]}...")
+            logger.warning("❌ [Auth] 无效或过期的token")
             return jsonify({"error": "无效或过期的token"}), 401
         
         request.user_id = user_id
@@ -239,6 +551,59 @@ def index():
         "status": "running"
     })
 
+# 支持的运动类型（静态数据，启动时序列化一次，请求时直接返回字节）
+EXERCISE_DEFINITIONS = [
+    {
+        "id": "squat",
+        "name": "深蹲",
+        "description": "训练大腿和臀部肌肉的经典动作",
+        "difficulty": "easy",
+        "target_muscles": ["大腿", "臀部", "核心"],
+        "instructions": [
+            "双脚与肩同宽站立",
+            "膝盖弯曲，臀部向后坐",
+            "保持背部挺直",
+            "大腿与地面平行时停止",
+            "缓慢回到起始位置"
+        ]
+    },
+    {
+        "id": "pushup",
+        "name": "俯卧撑",
+        "description": "上肢力量训练的基础动作",
+        "difficulty": "medium",
+        "target_muscles": ["胸部", "肩部", "三头肌"],
+        "instructions": [
+            "俯卧撑起始位置",
+            "手掌与肩同宽",
+            "身体保持一条直线",
+            "胸部贴近地面",
+            "推起回到起始位置"
+        ]
+    }
+]
+EXERCISES_JSON = orjson.dumps(EXERCISE_DEFINITIONS)
+
+# 静态JSON的浏览器/CDN缓存时间（秒）
+STATIC_JSON_MAX_AGE = 3600
+
+def static_json_etag(payload):
+    """静态JSON的ETag，内容不变时保持不变"""
+    return hashlib.sha256(payload).hexdigest()[:32]
+
+EXERCISES_ETAG = static_json_etag(EXERCISES_JSON)
+
+def static_json_response(payload, etag):
+    """
+    返回启动时序列化好的静态JSON
+    带上 Cache-Control 和 ETag，客户端携带 If-None-Match 且内容未变时返回 304
+    """
+    response = app.response_class(payload, mimetype='application/json')
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = STATIC_JSON_MAX_AGE
+    return response.make_conditional(request)
+
 @app.route('/api/exercises', methods=['GET'])
 def get_exercises():
     """
@@ -247,37 +612,7 @@ def get_exercises():
     Returns:
         JSON: 运动类型列表，包含每种运动的详细信息
     """
-    exercises = [
-        {
-            "id": "squat",
-            "name": "深蹲",
-            "description": "训练大腿和臀部肌肉的经典动作",
-            "difficulty": "easy",
-            "target_muscles": ["大腿", "臀部", "核心"],
-            "instructions": [
-                "双脚与肩同宽站立",
-                "膝盖弯曲，臀部向后坐",
-                "保持背部挺直",
-                "大腿与地面平行时停止",
-                "缓慢回到起始位置"
-            ]
-        },
-        {
-            "id": "pushup",
-            "name": "俯卧撑",
-            "description": "上肢力量训练的基础动作",
-            "difficulty": "medium",
-            "target_muscles": ["胸部", "肩部", "三头肌"],
-            "instructions": [
-                "俯卧撑起始位置",
-                "手掌与肩同宽",
-                "身体保持一条直线",
-                "胸部贴近地面",
-                "推起回到起始位置"
-            ]
-        }
-    ]
-    return jsonify(exercises)
+    return static_json_response(EXERCISES_JSON, EXERCISES_ETAG)
 
 @app.route('/api/session/start', methods=['POST'])
 def start_session():
@@ -300,13 +635,15 @@ def start_session():
         if not validate_exercise_type(exercise_type):
             return jsonify({"error": "无效的运动类型"}), 400
         
-        session_id = f"{user_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        # 会话ID与开始时间使用同一个时间点
+        now = datetime.now()
+        session_id = f"{user_id}_{now.strftime('%Y%m%d_%H%M%S')}"
         
         session_data = {
             "session_id": session_id,
             "user_id": user_id,
             "exercise_type": exercise_type,
-            "start_time": datetime.now().isoformat(),
+            "start_time": now.isoformat(),
             "total_count": 0,
             "correct_count": 0,
             "status": "active",
@@ -351,10 +688,53 @@ def start_session():
             "details": error_details if app.debug else None
         }), 500
 
+# 单次批量提交的最大帧数
+MAX_BATCH_FRAMES = 300
+
+# 逐帧接口的弃用警告只打印一次，避免每帧刷屏
+per_frame_deprecation_logged = False
+
+def parse_frame_score(score_value):
+    """安全地转换 score，处理字符串和 None 的情况，结果限制在0-100"""
+    try:
+        if isinstance(score_value, str):
+            return max(0, min(100, int(float(score_value))))
+        elif score_value is None:
+            return 0
+        else:
+            return max(0, min(100, int(score_value)))
+    except (ValueError, TypeError) as e:
+        logger.warning(f"分数转换失败: {score_value}, 使用默认值 0, 错误: {e}")
+        return 0
+
+def increment_session_counts(session_id, total_inc, correct_inc):
+    """
+    在数据库中原子地累加会话计数
+    
+    Returns:
+        tuple: 累加后的 (total_count, correct_count)
+    """
+    new_total = func.coalesce(Session.total_count, 0) + total_inc
+    stmt = (
+        update(Session)
+        .where(Session.session_id == session_id)
+        .values(
+            total_count=new_total,
+            # 确保correct_count不超过total_count（防止数据异常）
+            correct_count=func.least(
+                func.coalesce(Session.correct_count, 0) + correct_inc,
+                new_total
+            )
+        )
+        .returning(Session.total_count, Session.correct_count)
+        .execution_options(synchronize_session=False)
+    )
+    return db.session.execute(stmt).one()
+
 @app.route('/api/session/<session_id>/data', methods=['POST'])
 def submit_exercise_data(session_id):
     """
-    提交运动数据
+    提交运动数据（已弃用，请使用批量接口 /api/session/<session_id>/data/batch）
     
     Path Parameters:
         - session_id: 会话ID
@@ -370,68 +750,44 @@ def submit_exercise_data(session_id):
     """
     try:
         # 获取当前会话对象
-        session_obj = Session.query.get(session_id)
+        session_obj = db.session.get(Session, session_id)
         if not session_obj:
             logger.warning(f"会话不存在: {session_id}")
             return jsonify({"error": "Session not found"}), 404
         
+        global per_frame_deprecation_logged
+        if not per_frame_deprecation_logged:
+            logger.warning("逐帧提交接口 /api/session/<id>/data 已弃用，请改用 /api/session/<id>/data/batch")
+            per_frame_deprecation_logged = True
+        
         data = request.get_json() or {}
         is_correct = bool(data.get('is_correct', False))
-        
-        # 安全地转换 score，处理字符串和 None 的情况
-        try:
-            score_value = data.get('score', 0)
-            if isinstance(score_value, str):
-                score = max(0, min(100, int(float(score_value))))
-            elif score_value is None:
-                score = 0
-            else:
-                score = max(0, min(100, int(score_value)))
-        except (ValueError, TypeError) as e:
-            logger.warning(f"分数转换失败: {score_value}, 使用默认值 0, 错误: {e}")
-            score = 0
-        
+        score = parse_frame_score(data.get('score', 0))
         feedback = sanitize_input(data.get('feedback', ''), max_length=500)
         
         # 对于平板支撑，不增加计数，而是使用时长
-        # 对于其他运动，增加计数
-        if session_obj.exercise_type != 'plank':
-            session_obj.total_count += 1
-            if is_correct:
-                session_obj.correct_count += 1
-            # 确保correct_count不超过total_count（防止数据异常）
-            if session_obj.correct_count > session_obj.total_count:
-                session_obj.correct_count = session_obj.total_count
+        # 对于其他运动，在数据库中原子地增加计数，避免并发帧互相覆盖
+        is_plank = session_obj.exercise_type == 'plank'
+        if not is_plank:
+            total_count, correct_count = increment_session_counts(session_id, 1, 1 if is_correct else 0)
         # 平板支撑的时长会在 end_session 时通过 end_time - start_time 计算
     
-        # 更新分数记录 - 安全地处理 None 和空字符串
-        scores = []
-        if session_obj.scores:
-            if isinstance(session_obj.scores, str):
-                try:
-                    if session_obj.scores.strip():
-                        scores = json.loads(session_obj.scores)
-                except (json.JSONDecodeError, TypeError) as e:
-                    logger.warning(f"解析分数记录失败: {e}, 使用空列表")
-                    scores = []
-            elif isinstance(session_obj.scores, (list, dict)):
-                scores = session_obj.scores
-        
-        scores.append({
-            "timestamp": datetime.now().isoformat(),
-            "score": score,
-            "is_correct": is_correct,
-            "feedback": feedback
-        })
-        session_obj.scores = json.dumps(scores)
+        # 得分记录写入独立的表，每帧只插入一行
+        now = datetime.now()
+        db.session.add(SessionScore(
+            session_id=session_id,
+            timestamp=now,
+            score=score,
+            is_correct=is_correct,
+            feedback=feedback
+        ))
         
         try:
             db.session.commit()
             
             # 对于平板支撑，计算当前时长
-            is_plank = session_obj.exercise_type == 'plank'
             if is_plank:
-                duration_seconds = int((datetime.now() - session_obj.start_time).total_seconds())
+                duration_seconds = int((now - session_obj.start_time).total_seconds())
                 logger.info(f"✅ 提交运动数据成功: {session_id}, duration={duration_seconds}秒, score={score}")
                 return jsonify({
                     "message": "Data submitted successfully",
@@ -443,14 +799,14 @@ def submit_exercise_data(session_id):
                     }
                 })
             else:
-                logger.info(f"✅ 提交运动数据成功: {session_id}, count={session_obj.total_count}, score={score}")
+                logger.info(f"✅ 提交运动数据成功: {session_id}, count={total_count}, score={score}")
                 # 确保准确率不超过100%
-                accuracy = round(min(100, (session_obj.correct_count / session_obj.total_count * 100) if session_obj.total_count > 0 else 0), 2)
+                accuracy = round(min(100, (correct_count / total_count * 100) if total_count > 0 else 0), 2)
                 return jsonify({
                     "message": "Data submitted successfully",
                     "session_stats": {
-                        "total_count": session_obj.total_count,
-                        "correct_count": session_obj.correct_count,
+                        "total_count": total_count,
+                        "correct_count": correct_count,
                         "accuracy": accuracy
                     }
                 })
@@ -472,9 +828,107 @@ def submit_exercise_data(session_id):
             "details": traceback.format_exc() if app.debug else None
         }), 500
 
+@app.route('/api/session/<session_id>/data/batch', methods=['POST'])
+def submit_exercise_data_batch(session_id):
+    """
+    批量提交运动数据，一次请求写入多帧，只提交一次事务
+    
+    Path Parameters:
+        - session_id: 会话ID
+    
+    Request Body:
+        - frames: 帧数据数组，每项包含 is_correct、score、feedback
+    
+    Returns:
+        JSON: 处理结果
+    """
+    try:
+        session_obj = db.session.get(Session, session_id)
+        if not session_obj:
+            logger.warning(f"会话不存在: {session_id}")
+            return jsonify({"error": "Session not found"}), 404
+        
+        try:
+            data = orjson.loads(request.get_data() or b'{}')
+        except orjson.JSONDecodeError:
+            return jsonify({"error": "请求体不是有效的JSON"}), 400
+        
+        frames = data.get('frames') if isinstance(data, dict) else None
+        if not isinstance(frames, list) or not frames:
+            return jsonify({"error": "frames 必须是非空数组"}), 400
+        if len(frames) > MAX_BATCH_FRAMES:
+            return jsonify({"error": f"单次最多提交{MAX_BATCH_FRAMES}帧"}), 400
+        if not all(isinstance(frame, dict) for frame in frames):
+            return jsonify({"error": "frames 中的每一项都必须是对象"}), 400
+        
+        now = datetime.now()
+        rows = []
+        correct_inc = 0
+        for frame in frames:
+            is_correct = bool(frame.get('is_correct', False))
+            if is_correct:
+                correct_inc += 1
+            rows.append({
+                "session_id": session_id,
+                "timestamp": now,
+                "score": parse_frame_score(frame.get('score', 0)),
+                "is_correct": is_correct,
+                "feedback": sanitize_input(frame.get('feedback', ''), max_length=500)
+            })
+        
+        db.session.bulk_insert_mappings(SessionScore, rows)
+        
+        is_plank = session_obj.exercise_type == 'plank'
+        if not is_plank:
+            total_count, correct_count = increment_session_counts(session_id, len(rows), correct_inc)
+        
+        try:
+            db.session.commit()
+        except Exception as e:
+            logger.error(f"❌ 批量提交运动数据失败（数据库错误）: {str(e)}", exc_info=True)
+            db.session.rollback()
+            return jsonify({
+                "error": "提交数据失败",
+                "message": str(e)
+            }), 500
+        
+        if is_plank:
+            duration_seconds = int((now - session_obj.start_time).total_seconds())
+            session_stats = {
+                "duration": duration_seconds,  # 秒
+                "duration_minutes": round(duration_seconds / 60, 1)  # 分钟
+            }
+        else:
+            accuracy = round(min(100, (correct_count / total_count * 100) if total_count > 0 else 0), 2)
+            session_stats = {
+                "total_count": total_count,
+                "correct_count": correct_count,
+                "accuracy": accuracy
+            }
+        
+        logger.info(f"✅ 批量提交运动数据成功: {session_id}, frames={len(rows)}")
+        return jsonify({
+            "message": "Data submitted successfully",
+            "frames_received": len(rows),
+            "session_stats": session_stats
+        })
+    except Exception as e:
+        logger.error(f"❌ 处理批量提交运动数据请求失败: {str(e)}", exc_info=True)
+        db.session.rollback()
+        return jsonify({
+            "error": "服务器错误",
+            "message": str(e)
+        }), 500
+
 from datetime import datetime, timedelta
 from sqlalchemy import func
 
+# 一天的开始时间，按天查询使用 [当天0点, 次日0点) 的半开区间
+DAY_START_TIME = datetime.min.time()
+
+# 周几的缩写（与 strftime('%a') 在默认 C locale 下的结果一致）
+WEEKDAY_LABELS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+
 @app.route('/api/user/stats/weekly', methods=['GET'])
 @require_auth
 def get_weekly_stats():
@@ -484,41 +938,38 @@ def get_weekly_stats():
     # 计算本周起始日期（周一）
     today = datetime.now().date()
     start_of_week = today - timedelta(days=today.weekday())
-    end_of_week = start_of_week + timedelta(days=6)
-    
-    # 查询本周的所有会话
-    sessions = Session.query.filter(
+    week_start = datetime.combine(start_of_week, DAY_START_TIME)
+    
+    # 在数据库中按天聚合，最多返回7行，不再拉取整周的会话记录
+    day_col = func.date(Session.start_time).label('day')
+    rows = db.session.query(
+        day_col,
+        func.coalesce(func.sum(Session.total_count), 0).label('count'),
+        func.coalesce(func.sum(Session.duration_seconds), 0).label('seconds')
+    ).filter(
         Session.user_id == user_id,
-        Session.start_time >= datetime.combine(start_of_week, datetime.min.time()),
-        Session.start_time <= datetime.combine(end_of_week, datetime.max.time())
-    ).all()
-    
-    # 初始化每日数据
-    daily_stats = {
-        (start_of_week + timedelta(days=i)).strftime('%Y-%m-%d'): {"count": 0, "duration": 0}
-        for i in range(7)
-    }
+        Session.start_time >= week_start,
+        Session.start_time < week_start + timedelta(days=7)
+    ).group_by(day_col).all()
     
-    # 填充数据
-    for session in sessions:
-        date_str = session.start_time.strftime('%Y-%m-%d')
-        if date_str in daily_stats:
-            daily_stats[date_str]["count"] += session.total_count
-            if session.end_time:
-                duration = (session.end_time - session.start_time).total_seconds() / 60  # 分钟
-                daily_stats[date_str]["duration"] += duration
-                
-    # 格式化返回数据
+    # 初始化每日数据（本周从周一开始，第i天对应 WEEKDAY_LABELS[i]）
     result = [
         {
-            "date": date,
-            "day": (datetime.strptime(date, '%Y-%m-%d')).strftime('%a'), # 周几
-            "count": stats["count"],
-            "duration": round(stats["duration"], 1)
+            "date": (start_of_week + timedelta(days=i)).isoformat(),
+            "day": WEEKDAY_LABELS[i],  # 周几
+            "count": 0,
+            "duration": 0
         }
-        for date, stats in daily_stats.items()
+        for i in range(7)
     ]
     
+    # 填充数据（未结束的会话 end_time 为空，不计入时长）
+    for day, count, seconds in rows:
+        offset = (day - start_of_week).days
+        if 0 <= offset < 7:
+            result[offset]["count"] = int(count)
+            result[offset]["duration"] = round(float(seconds) / 60, 1)  # 分钟
+    
     return jsonify(result)
 
 @app.route('/api/user/stats/exercise-distribution', methods=['GET'])
@@ -528,19 +979,25 @@ def get_exercise_distribution():
     user_id = request.user_id
     
     # 聚合查询各种运动类型的总次数
-    stats = db.session.query(
-        Session.exercise_type,
-        func.sum(Session.total_count).label('total_count')
+    per_type = db.session.query(
+        Session.exercise_type.label('name'),
+        func.coalesce(func.sum(Session.total_count), 0).label('value')
     ).filter(
         Session.user_id == user_id
-    ).group_by(Session.exercise_type).all()
+    ).group_by(Session.exercise_type).subquery()
     
-    result = [
-        {"name": stat.exercise_type, "value": stat.total_count or 0}
-        for stat in stats
-    ]
+    # 由 PostgreSQL 直接拼出响应JSON，Python 端不再逐行构造和序列化
+    payload = db.session.query(
+        cast(
+            func.coalesce(
+                func.jsonb_agg(func.jsonb_build_object('name', per_type.c.name, 'value', per_type.c.value)),
+                '[]'
+            ),
+            Text
+        )
+    ).scalar()
     
-    return jsonify(result)
+    return app.response_class(payload, mimetype='application/json')
 
 @app.route('/api/session/<session_id>/end', methods=['POST'])
 def end_session(session_id):
@@ -554,13 +1011,14 @@ def end_session(session_id):
         JSON: 会话总结数据
     """
     try:
-        session_obj = Session.query.get(session_id)
+        session_obj = db.session.get(Session, session_id)
         if not session_obj:
             logger.warning(f"会话不存在: {session_id}")
             return jsonify({"error": "Session not found"}), 404
         
         # 更新会话状态
         session_obj.end_time = datetime.now()
+        session_obj.duration_seconds = (session_obj.end_time - session_obj.start_time).total_seconds()
         session_obj.status = 'completed'
         
         # 获取前端传入的数据
@@ -572,7 +1030,7 @@ def end_session(session_id):
         if actual_duration_seconds is not None:
              duration_seconds = float(actual_duration_seconds)
         else:
-             duration_seconds = (session_obj.end_time - session_obj.start_time).total_seconds()
+             duration_seconds = session_obj.duration_seconds
 
         duration_minutes = round(duration_seconds / 60, 1)
         
@@ -614,22 +1072,15 @@ def end_session(session_id):
                 correct_count = min(correct_count, total_count)
                 accuracy = min(100, (correct_count / total_count * 100) if total_count > 0 else 0)
         
-        # 安全地解析分数记录
-        
-        # 安全地解析分数记录
-        scores = []
-        if session_obj.scores:
-            if isinstance(session_obj.scores, str):
-                try:
-                    if session_obj.scores.strip():
-                        scores = json.loads(session_obj.scores)
-                except (json.JSONDecodeError, TypeError) as e:
-                    logger.warning(f"解析分数记录失败: {e}, 使用空列表")
-                    scores = []
-            elif isinstance(session_obj.scores, (list, dict)):
-                scores = session_obj.scores
-        
-        avg_score = sum([s.get('score', 0) for s in scores]) / len(scores) if scores else 0
+        # 平均分直接在数据库中计算
+        avg_score = db.session.query(func.avg(SessionScore.score)).filter(
+            SessionScore.session_id == session_id
+        ).scalar()
+        if avg_score is None and session_obj.scores:
+            # 旧会话的得分仍保存在 sessions.scores（JSONB 列表）中
+            legacy_scores = [item.get('score', 0) for item in session_obj.scores if isinstance(item, dict)]
+            avg_score = sum(legacy_scores) / len(legacy_scores) if legacy_scores else None
+        avg_score = float(avg_score) if avg_score is not None else 0
         
         # 计算卡路里消耗 (估算值)
         # METs (Metabolic Equivalent of Task) 参考值:
@@ -646,11 +1097,10 @@ def end_session(session_id):
         met = mets_table.get(session_obj.exercise_type, 4.0)
         
         # 尝试获取用户体重，如果获取不到则使用默认值 70kg
+        # 体重很少变化，优先读取进程内缓存，未命中时只查询体重一列
         user_weight = 70.0
         try:
-            user = get_user_by_id(session_obj.user_id)
-            if user and user.profile and user.profile.weight:
-                user_weight = user.profile.weight
+            user_weight = get_cached_user_weight(session_obj.user_id) or user_weight
         except:
             pass
             
@@ -659,38 +1109,21 @@ def end_session(session_id):
         calories_burned = round(met * user_weight * duration_hours, 1)
 
         # AI 生成训练总结
-        # 使用 Zhipu AI 生成简短的改进建议
-        # 优化 Prompt 以提高生成速度和质量
-        ai_summary = None
-        try:
-            from app import call_zhipu_ai_api # Import locally to avoid circular dependency
-            
-            # 构建一个更加精简的 Prompt，减少Token输出，提高速度
-            prompt = f"""
-            为用户生成30字以内的健身简评。
-            项目:{session_obj.exercise_type}
-            数据:时长{duration_seconds}s,次数{total_count},准确率{accuracy:.0f}%,均分{avg_score:.1f}
-            包含:肯定+1条改进建议。
-            """
-            
-            # 异步或快速调用 AI (为了不阻塞太久，使用快速模型 glm-4-flash)
-            # 设置 max_tokens 限制输出长度
-            ai_text, error = call_zhipu_ai_api(prompt, max_retries=1)
-            if ai_text:
-                ai_summary = ai_text.strip()
-            else:
-                ai_summary = "训练不错！注意保持动作节奏，期待您下次的表现。"
-                
-        except Exception as e:
-            logger.error(f"AI 生成总结失败: {e}")
-            ai_summary = "训练完成！继续保持，注意休息。"
+        # 使用 Zhipu AI 生成简短的改进建议，构建精简的 Prompt，减少Token输出，提高速度
+        comment_data = (
+            f"项目:{session_obj.exercise_type} "
+            f"数据:时长{duration_seconds}s,次数{total_count},准确率{accuracy:.0f}%,均分{avg_score:.1f}"
+        )
 
-        # 保存总结数据到数据库
+        # 保存总结数据到数据库；AI简评提交后在后台生成，客户端通过 /api/session/<id>/ai_comment 获取
         session_obj.calories = calories_burned
-        session_obj.ai_comment = ai_summary
+        session_obj.ai_comment = None
+        session_obj.ai_status = 'pending'
 
         try:
             db.session.commit()
+            # 会话已提交，后台任务更新时一定能找到这条记录
+            ai_comment_batcher.submit(session_id, comment_data)
             if is_plank:
                 logger.info(f"✅ 会话结束: {session_id} - 时长: {duration_seconds:.1f}秒")
             else:
@@ -707,7 +1140,8 @@ def end_session(session_id):
                     "duration_seconds": int(duration_seconds) if is_plank else None,  # 平板支撑返回秒数
                     "exercise_type": session_obj.exercise_type or '',
                     "calories": calories_burned if calories_burned is not None else 0,
-                    "ai_comment": ai_summary or "训练完成！继续保持，注意休息。"
+                    "ai_comment": None,
+                    "ai_status": "pending"
                 },
                 "message": "Session ended successfully"
             })
@@ -728,6 +1162,42 @@ def end_session(session_id):
             "details": traceback.format_exc() if app.debug else None
         }), 500
 
+@app.route('/api/session/<session_id>/ai_comment', methods=['GET'])
+@handle_db_error
+def get_session_ai_comment(session_id):
+    """
+    获取会话的AI训练简评
+    
+    Returns:
+        JSON: 已生成时返回 200 和简评内容，仍在生成时返回 202
+    """
+    row = db.session.query(Session.ai_comment, Session.ai_status, Session.end_time).filter(
+        Session.session_id == session_id
+    ).first()
+    if row is None:
+        return jsonify({"error": "Session not found"}), 404
+    
+    if row.ai_status == 'pending':
+        if row.end_time is None or datetime.now() - row.end_time < timedelta(seconds=AI_COMMENT_TIMEOUT):
+            return jsonify({"session_id": session_id, "ai_status": "pending"}), 202
+        # 后台任务已丢失（进程重启、任务异常等），标记为失败并返回默认简评，避免客户端无限轮询
+        db.session.execute(
+            update(Session)
+            .where(Session.session_id == session_id, Session.ai_status == 'pending')
+            .values(ai_comment=DEFAULT_AI_COMMENT, ai_status='failed')
+        )
+        db.session.commit()
+        return jsonify({
+            "session_id": session_id,
+            "ai_status": "failed",
+            "ai_comment": DEFAULT_AI_COMMENT
+        })
+    return jsonify({
+        "session_id": session_id,
+        "ai_status": row.ai_status or "done",
+        "ai_comment": row.ai_comment or "训练完成！继续保持，注意休息。"
+    })
+
 @app.route('/api/user/<user_id>/history', methods=['GET'])
 @handle_db_error
 def get_user_history(user_id):
@@ -740,6 +1210,7 @@ def get_user_history(user_id):
     Query Parameters:
         - limit: 返回记录数量限制（默认10）
         - exercise_type: 过滤特定运动类型
+        - before: 分页游标（上一页返回的 next_cursor）
     
     Returns:
         JSON: 用户历史会话列表
@@ -751,12 +1222,26 @@ def get_user_history(user_id):
         # 限制查询数量，防止过大
         limit = min(max(1, limit), 100)  # 限制在1-100之间
         
-        sessions = get_user_sessions(user_id, limit=limit, exercise_type=exercise_type)
+        before = request.args.get('before')
+        if before:
+            # 游标格式为 "开始时间ISO,会话ID"（ISO 时间不含逗号）
+            start_time, _, session_id = before.partition(',')
+            try:
+                before = (datetime.fromisoformat(start_time), session_id)
+            except ValueError:
+                return jsonify({"error": "before 参数格式错误"}), 400
+            if not session_id:
+                return jsonify({"error": "before 参数格式错误"}), 400
+        
+        sessions, next_cursor = get_user_session_history(
+            user_id, limit, exercise_type=exercise_type, before=before
+        )
         
         return jsonify({
             "user_id": user_id,
             "sessions": sessions,
-            "total_sessions": len(sessions)
+            "total_sessions": len(sessions),
+            "next_cursor": next_cursor
         })
     except Exception as e:
         logger.error(f"获取用户历史失败: {str(e)}", exc_info=True)
@@ -803,6 +1288,20 @@ def analyze_pose():
     
     return jsonify(analysis_result)
 
+# 默认推荐（静态数据）
+DEFAULT_RECOMMENDATIONS = {
+    "next_exercises": [
+        {"id": "pushup", "name": "俯卧撑", "reason": "增强上肢力量"},
+        {"id": "plank", "name": "平板支撑", "reason": "强化核心稳定"}
+    ],
+    "difficulty_adjustment": "maintain",  # increase, decrease, maintain
+    "suggested_sets": 3,
+    "suggested_reps": 15,
+    "rest_time": 60  # 秒
+}
+RECOMMENDATIONS_JSON = orjson.dumps(DEFAULT_RECOMMENDATIONS)
+RECOMMENDATIONS_ETAG = static_json_etag(RECOMMENDATIONS_JSON)
+
 @app.route('/api/recommendations', methods=['GET'])
 def get_recommendations():
     """
@@ -815,23 +1314,9 @@ def get_recommendations():
     Returns:
         JSON: 推荐的运动和训练计划
     """
-    user_id = request.args.get('user_id', 'anonymous')
-    current_exercise = request.args.get('current_exercise', 'squat')
-    
-    # TODO: 基于用户历史数据生成个性化推荐
-    
-    recommendations = {
-        "next_exercises": [
-            {"id": "pushup", "name": "俯卧撑", "reason": "增强上肢力量"},
-            {"id": "plank", "name": "平板支撑", "reason": "强化核心稳定"}
-        ],
-        "difficulty_adjustment": "maintain",  # increase, decrease, maintain
-        "suggested_sets": 3,
-        "suggested_reps": 15,
-        "rest_time": 60  # 秒
-    }
-    
-    return jsonify(recommendations)
+    # TODO: 基于用户历史数据（user_id, current_exercise）生成个性化推荐
+    # 目前推荐内容是静态的，直接返回启动时序列化好的结果
+    return static_json_response(RECOMMENDATIONS_JSON, RECOMMENDATIONS_ETAG)
 
 # ==================== 用户认证相关API ====================
 
@@ -959,14 +1444,24 @@ def login():
         # 从数据库查找用户
         user = get_user_by_username(username)
         if not user:
+            verify_password(password, DUMMY_PASSWORD_HASH)
             logger.warning(f"登录失败: 用户不存在 - {username}")
             return jsonify({"error": "用户名或密码错误"}), 401
         
-        password_hash = hash_password(password)
-        if user.password_hash != password_hash:
+        matched, needs_rehash = verify_password(password, user.password_hash)
+        if not matched:
             logger.warning(f"登录失败: 密码错误 - {username}")
             return jsonify({"error": "用户名或密码错误"}), 401
         
+        # 旧版哈希在登录成功后升级为当前方案
+        if needs_rehash:
+            try:
+                user.password_hash = hash_password(password)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                logger.warning(f"升级密码哈希失败: {username} - {str(e)}")
+        
         # 生成token
         token = generate_token()
         expire_time = datetime.now() + timedelta(days=1)  # 24小时后过期
@@ -1007,16 +1502,19 @@ def get_current_user():
     """
     try:
         user_id = request.user_id
-        user = get_user_by_id(user_id)
+        cached = cache_get(user_key(user_id))
+        if cached is not None:
+            return app.response_class(cached, mimetype='application/json')
+        
+        user = get_user_with_profile(user_id)
         
         if not user:
             return jsonify({"error": "用户不存在"}), 404
         
-        # to_dict() 方法已经安全处理了 profile 为 None 的情况
+        # to_dict() 方法已经安全处理了 profile 为 None 的情况，且不包含密码哈希
         # 不需要强制创建 profile，让用户在更新时自动创建
         user_dict = user.to_dict()
-        # 移除敏感信息
-        user_dict.pop('password_hash', None)
+        cache_set(user_key(user_id), orjson.dumps(user_dict), USER_CACHE_TTL)
         
         return jsonify(user_dict)
     except Exception as e:
@@ -1059,13 +1557,13 @@ def change_password():
             return jsonify({"error": "新密码不能与旧密码相同"}), 400
         
         user_id = request.user_id
-        user = get_user_by_id(user_id)
+        user = get_user_credentials(user_id)
         
         if not user:
             return jsonify({"error": "用户不存在"}), 404
         
         # 验证旧密码
-        if user.password_hash != hash_password(old_password):
+        if not verify_password(old_password, user.password_hash)[0]:
             logger.warning(f"密码修改失败: 旧密码错误 - {user_id}")
             return jsonify({"error": "旧密码错误"}), 400
         
@@ -1095,7 +1593,11 @@ def get_user_profile():
     """
     try:
         user_id = request.user_id
-        user = get_user_by_id(user_id)
+        cached = cache_get(user_key(user_id))
+        if cached is not None:
+            return app.response_class(cached, mimetype='application/json')
+        
+        user = get_user_with_profile(user_id)
         
         if not user:
             return jsonify({"error": "用户不存在"}), 404
@@ -1103,12 +1605,16 @@ def get_user_profile():
         # to_dict() 方法已经安全处理了 profile 为 None 的情况
         # 不需要强制创建 profile，让用户在更新时自动创建
         user_dict = user.to_dict()
+        cache_set(user_key(user_id), orjson.dumps(user_dict), USER_CACHE_TTL)
         return jsonify(user_dict)
     except Exception as e:
         logger.error(f"获取用户个人资料失败: {str(e)}", exc_info=True)
         db.session.rollback()
         raise
 
+# 个人资料中允许通过接口修改的字段
+PROFILE_FIELDS = ('height', 'weight', 'age', 'gender', 'body_fat')
+
 @app.route('/api/user/profile', methods=['PUT'])
 @require_auth
 @handle_db_error
@@ -1134,7 +1640,7 @@ def update_user_profile():
     """
     data = request.get_json()
     user_id = request.user_id
-    user = get_user_by_id(user_id)
+    user = get_user_with_profile(user_id)
     
     if not user:
         return jsonify({"error": "用户不存在"}), 404
@@ -1149,29 +1655,50 @@ def update_user_profile():
     
     # 更新用户资料
     if 'profile' in data:
-        if not user.profile:
-            from database import UserProfile
-            user.profile = UserProfile(user_id=user_id)
-            db.session.add(user.profile)
+        profile = user.profile
+        if not profile:
+            profile = UserProfile(user_id=user_id)
+            user.profile = profile
         
         profile_data = data['profile']
-        if 'height' in profile_data:
-            user.profile.height = profile_data['height']
-        if 'weight' in profile_data:
-            user.profile.weight = profile_data['weight']
-        if 'age' in profile_data:
-            user.profile.age = profile_data['age']
-        if 'gender' in profile_data:
-            user.profile.gender = profile_data['gender']
-        if 'body_fat' in profile_data:
-            user.profile.body_fat = profile_data['body_fat']
+        for field in PROFILE_FIELDS:
+            if field in profile_data:
+                setattr(profile, field, profile_data[field])
     
     db.session.commit()
+    weight_cache.delete(user_id)
     
-    # 返回更新后的用户信息
-    updated_user = user.to_dict()
+    # 提交后对象已过期，用一条 JOIN 查询重新读取用户和资料，并直接写入用户信息缓存
+    updated_user = get_user_with_profile(user_id, refresh=True).to_dict()
+    cache_set(user_key(user_id), orjson.dumps(updated_user), USER_CACHE_TTL)
     return jsonify(updated_user)
 
+# 默认健身计划目标（用户尚未设置计划时使用）
+DEFAULT_PLAN_GOALS = {
+    "daily_goals": {
+        "squat": 20,
+        "pushup": 15,
+        "plank": 60,  # 秒
+        "jumping_jack": 30
+    },
+    "weekly_goals": {
+        "total_sessions": 5,
+        "total_duration": 150  # 分钟
+    }
+}
+
+# 默认计划的响应体在模块加载时编码一次；用户尚未创建计划，时间戳取进程启动时间
+DEFAULT_PLAN_CREATED_AT = datetime.now().isoformat()
+DEFAULT_PLAN_JSON = orjson.dumps({
+    **DEFAULT_PLAN_GOALS,
+    "created_at": DEFAULT_PLAN_CREATED_AT,
+    "updated_at": DEFAULT_PLAN_CREATED_AT
+})
+
+def default_plan_response():
+    """返回预先编码好的默认计划"""
+    return app.response_class(DEFAULT_PLAN_JSON, mimetype='application/json')
+
 @app.route('/api/user/plan', methods=['GET'])
 @require_auth
 @handle_db_error
@@ -1193,39 +1720,11 @@ def get_user_plan_api():
             return jsonify(plan)
         else:
             # 返回默认计划
-            default_plan = {
-            "daily_goals": {
-                "squat": 20,
-                "pushup": 15,
-                "plank": 60,  # 秒
-                "jumping_jack": 30
-            },
-            "weekly_goals": {
-                "total_sessions": 5,
-                "total_duration": 150  # 分钟
-                },
-                "created_at": datetime.now().isoformat(),
-                "updated_at": datetime.now().isoformat()
-            }
-            return jsonify(default_plan)
+            return default_plan_response()
     except Exception as e:
         logger.error(f"获取用户计划失败: {str(e)}", exc_info=True)
         # 返回默认计划而不是错误
-        default_plan = {
-            "daily_goals": {
-                "squat": 20,
-                "pushup": 15,
-                "plank": 60,
-                "jumping_jack": 30
-            },
-            "weekly_goals": {
-                "total_sessions": 5,
-                "total_duration": 150
-            },
-            "created_at": datetime.now().isoformat(),
-            "updated_at": datetime.now().isoformat()
-        }
-        return jsonify(default_plan)
+        return default_plan_response()
 
 @app.route('/api/user/plan', methods=['PUT'])
 @require_auth
@@ -1263,19 +1762,83 @@ def calculate_bmi(height_cm, weight_kg):
     height_m = height_cm / 100
     return weight_kg / (height_m ** 2)
 
+# BMI分级阈值（中国标准），区间左闭右开：<18.5 偏瘦，18.5-24 正常，24-28 超重，>=28 肥胖
+BMI_THRESHOLDS = (18.5, 24, 28)
+BMI_LEVELS = ("underweight", "normal", "overweight", "obese")
+
 def get_fitness_level(bmi, age):
     """根据BMI和年龄判断健身水平"""
     if bmi is None:
         return "beginner"
-    
-    if bmi < 18.5:
-        return "underweight"
-    elif bmi < 24:
-        return "normal"
-    elif bmi < 28:
-        return "overweight"
-    else:
-        return "obese"
+    # bisect_right 使恰好等于阈值的BMI落入更高一级，与原 if/elif 的 < 判断一致
+    return BMI_LEVELS[bisect.bisect_right(BMI_THRESHOLDS, bmi)]
+
+# 智谱AI接口地址
+ZHIPU_API_URL = "https://open.bigmodel.cn/api/paas/v4/chat/completions"
+
+# 复用同一个HTTP会话，保持与智谱AI的TLS长连接，避免每次调用都重新握手
+# 网关类错误（502/503/504）由 urllib3 自动退避重试
+ZHIPU_RETRY_BACKOFF = 0.5
+zhipu_http = requests.Session()
+zhipu_http.mount('https://', HTTPAdapter(
+    pool_connections=10,
+    pool_maxsize=50,
+    max_retries=Retry(
+        total=2,
+        read=0,  # 读超时说明模型正在生成，不重复提交
+        backoff_factor=ZHIPU_RETRY_BACKOFF,
+        status_forcelist=[502, 503, 504],
+        allowed_methods=frozenset(['POST']),
+        raise_on_status=False
+    )
+))
+
+# 智谱SDK客户端缓存（按API Key），客户端内部同样维护连接池
+zhipu_clients = {}
+
+def get_zhipu_client(api_key):
+    """获取（或创建）智谱SDK客户端"""
+    client = zhipu_clients.get(api_key)
+    if client is None:
+        client = ZhipuAI(api_key=api_key)
+        zhipu_clients[api_key] = client
+    return client
+
+ZHIPU_KEY_PLACEHOLDER = 'your_zhipu_api_key_here'
+
+@lru_cache(maxsize=1)
+def read_zhipu_key_from_env_file():
+    """直接从 .env 文件读取API Key（每个进程只读取一次），未找到时返回 None"""
+    try:
+        env_path = Path(__file__).parent / '.env'
+        if env_path.exists():
+            with open(env_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if line.strip().startswith('ZHIPU_API_KEY='):
+                        file_key = line.split('=', 1)[1].strip()
+                        if file_key and file_key != ZHIPU_KEY_PLACEHOLDER:
+                            logger.warning("⚠️ [AI] 从.env文件直接读取到API Key")
+                            return file_key
+    except Exception as e:
+        logger.warning("❌ [AI] 读取.env文件失败: %s", e)
+    return None
+
+def get_zhipu_api_key():
+    """获取智谱API Key：优先环境变量，其次 .env 文件，未配置时返回 None"""
+    api_key = os.getenv('ZHIPU_API_KEY')
+    if api_key and api_key != ZHIPU_KEY_PLACEHOLDER:
+        return api_key
+    return read_zhipu_key_from_env_file()
+
+# 生成健身计划时使用的系统提示词
+PLAN_SYSTEM_PROMPT = "你是一位专业的健身教练，擅长根据用户的身体指标制定个性化的健身计划。请用中文回答，提供具体、可执行的建议。回答格式要清晰，包含具体的数值。"
+
+def build_plan_messages(prompt):
+    """构建生成健身计划的对话消息"""
+    return [
+        {"role": "system", "content": PLAN_SYSTEM_PROMPT},
+        {"role": "user", "content": prompt}
+    ]
 
 def call_zhipu_ai_api(prompt, max_retries=2):
     """
@@ -1290,35 +1853,20 @@ def call_zhipu_ai_api(prompt, max_retries=2):
         ai_content: AI生成的文本，如果失败则为None
         error_code: 错误代码 (None, 'missing_key', 'timeout', 'connection_error', 'api_error', 'unknown_error')
     """
-    api_key = os.getenv('ZHIPU_API_KEY')
-    
     # 增强的Key获取逻辑：如果环境变量为空，尝试直接读取文件
-    if not api_key or api_key == 'your_zhipu_api_key_here':
-        try:
-            from pathlib import Path
-            env_path = Path(__file__).parent / '.env'
-            if env_path.exists():
-                with open(env_path, 'r', encoding='utf-8') as f:
-                    for line in f:
-                        if line.strip().startswith('ZHIPU_API_KEY='):
-                            file_key = line.split('=', 1)[1].strip()
-                            if file_key and file_key != 'your_zhipu_api_key_here':
-                                api_key = file_key
-                                print(f"⚠️ [AI] 从.env文件直接读取到API Key")
-                                break
-        except Exception as e:
-            print(f"❌ [AI] 读取.env文件失败: {e}")
+    api_key = get_zhipu_api_key()
 
     # 如果仍然没有配置API Key，返回None（将使用规则引擎）
-    if not api_key or api_key == 'your_zhipu_api_key_here':
-        print("⚠️  [AI] API Key未配置，将使用规则引擎")
-        # 打印当前环境变量以便调试
-        print(f"🔍 [Debug] Current Env Keys: {[k for k in os.environ.keys() if 'API' in k]}")
+    if not api_key:
+        logger.warning("⚠️  [AI] API Key未配置，将使用规则引擎")
+        # 打印当前环境变量以便调试（只在 DEBUG 级别构建列表）
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("🔍 [Debug] Current Env Keys: %s", [k for k in os.environ.keys() if 'API' in k])
         return None, "missing_key"
     
-    print(f"🤖 [AI] 正在调用智谱AI官方API (open.bigmodel.cn)...")
-    print(f"🔑 [AI] API Key状态: {'已配置' if api_key else '未配置'} (长度: {len(api_key)})")
-    print(f"📝 [AI] 提示词长度: {len(prompt)} 字符")
+    logger.debug("🤖 [AI] 正在调用智谱AI官方API (open.bigmodel.cn)...")
+    logger.debug("🔑 [AI] API Key状态: 已配置 (长度: %d)", len(api_key))
+    logger.debug("📝 [AI] 提示词长度: %d 字符", len(prompt))
     
     # 使用官方SDK或直接HTTP请求
     # 优先使用 glm-4-flash (免费且速度快)
@@ -1326,78 +1874,206 @@ def call_zhipu_ai_api(prompt, max_retries=2):
     
     last_error = "unknown_error"
     
-    # 重试机制
-    for attempt in range(max_retries + 1):
+    # 重试机制（HTTP请求的重试由 zhipu_http 的连接适配器负责，这里只重试SDK调用）
+    attempts = max_retries + 1 if ZhipuAI else 1
+    for attempt in range(attempts):
         try:
             if attempt > 0:
-                print(f"🔄 [AI] 第 {attempt + 1} 次尝试...")
+                logger.debug("🔄 [AI] 第 %d 次尝试...", attempt + 1)
             
             if ZhipuAI:
-                client = ZhipuAI(api_key=api_key)
+                client = get_zhipu_client(api_key)
                 response = client.chat.completions.create(
                     model=model,
-                    messages=[
-                        {
-                            "role": "system",
-                            "content": "你是一位专业的健身教练，擅长根据用户的身体指标制定个性化的健身计划。请用中文回答，提供具体、可执行的建议。回答格式要清晰，包含具体的数值。"
-                        },
-                        {
-                            "role": "user",
-                            "content": prompt
-                        }
-                    ],
+                    messages=build_plan_messages(prompt),
                     temperature=0.7,
                     max_tokens=1000
                 )
                 ai_content = response.choices[0].message.content
             else:
                 # Fallback to requests if SDK not installed
-                url = "https://open.bigmodel.cn/api/paas/v4/chat/completions"
                 headers = {
                     "Authorization": f"Bearer {api_key}",
                     "Content-Type": "application/json"
                 }
                 data = {
                     "model": model,
-                    "messages": [
-                        {
-                            "role": "system",
-                            "content": "你是一位专业的健身教练，擅长根据用户的身体指标制定个性化的健身计划。请用中文回答，提供具体、可执行的建议。回答格式要清晰，包含具体的数值。"
-                        },
-                        {
-                            "role": "user",
-                            "content": prompt
-                        }
-                    ],
+                    "messages": build_plan_messages(prompt),
                     "temperature": 0.7,
                     "max_tokens": 1000
                 }
-                resp = requests.post(url, headers=headers, json=data, timeout=(5, 30))
+                resp = zhipu_http.post(ZHIPU_API_URL, headers=headers, data=orjson.dumps(data), timeout=(5, 30))
                 resp.raise_for_status()
-                ai_content = resp.json()['choices'][0]['message']['content']
+                ai_content = orjson.loads(resp.content)['choices'][0]['message']['content']
 
-            print(f"✅ [AI] API调用成功！")
-            print(f"📄 [AI] AI返回内容长度: {len(ai_content)} 字符")
+            logger.debug("✅ [AI] API调用成功！AI返回内容长度: %d 字符", len(ai_content))
             return ai_content, None
                 
         except Exception as e:
-            print(f"❌ [AI] API调用失败 (尝试 {attempt + 1}/{max_retries + 1}): {e}")
+            logger.warning("❌ [AI] API调用失败 (尝试 %d/%d): %s", attempt + 1, attempts, e)
             last_error = str(e)
-            if attempt < max_retries:
-                import time
-                time.sleep(2)
-            else:
-                pass
+            if attempt < attempts - 1:
+                # 与 zhipu_http 相同的指数退避：0.5s、1s……
+                time.sleep(ZHIPU_RETRY_BACKOFF * (2 ** attempt))
     
     return None, last_error
 
-def parse_ai_response(ai_text, height, weight, age, gender):
+def stream_zhipu_ai_api(prompt, api_key):
     """
-    解析AI返回的文本，提取健身计划数据
-    
-    参数:
-        ai_text: AI返回的文本
-        height: 身高
+    以流式模式调用智谱AI API生成健身计划，逐段产出生成的文本
+    不做重试：已经输出给客户端的内容无法撤回，失败时由调用方改用规则引擎
+    """
+    return stream_zhipu_chat(build_plan_messages(prompt), api_key, max_tokens=1000)
+
+def stream_zhipu_chat(messages, api_key, max_tokens):
+    """以流式模式调用智谱AI对话接口，逐段产出生成的文本"""
+    model = "glm-4-flash"
+    if ZhipuAI:
+        client = get_zhipu_client(api_key)
+        response = client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=0.7,
+            max_tokens=max_tokens,
+            stream=True
+        )
+        for chunk in response:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+        return
+
+    headers = {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json"
+    }
+    data = {
+        "model": model,
+        "messages": messages,
+        "temperature": 0.7,
+        "max_tokens": max_tokens,
+        "stream": True
+    }
+    # 智谱的流式接口同样以 SSE 返回，每行 "data: {...}"，以 "data: [DONE]" 结束
+    with zhipu_http.post(ZHIPU_API_URL, headers=headers, data=orjson.dumps(data),
+                         timeout=(5, 30), stream=True) as resp:
+        resp.raise_for_status()
+        for line in resp.iter_lines():
+            if not line.startswith(b'data:'):
+                continue
+            payload = line[5:].strip()
+            if payload == b'[DONE]':
+                break
+            choices = orjson.loads(payload).get('choices')
+            content = choices[0].get('delta', {}).get('content') if choices else None
+            if content:
+                yield content
+
+# ==================== AI响应解析规则 ====================
+# 所有正则在模块加载时编译一次，避免每次解析都重新构建
+
+def _compile_exercise_patterns(keyword, unit):
+    """
+    构建单项运动的匹配规则
+    优先匹配"每组X次"，其次"X次"，再次"X组"，最后"运动：X"
+    """
+    return [re.compile(p, re.IGNORECASE) for p in (
+        rf'{keyword}[：:].*?每组\s*(\d+)\s*{unit}',  # 深蹲：3组，每组15次
+        rf'{keyword}[：:].*?(\d+)\s*{unit}(?!组)',    # 深蹲：15次
+        rf'{keyword}[：:].*?(\d+)\s*组',              # 深蹲：3组
+        rf'{keyword}[：:]\s*(\d+)',                   # 深蹲：15
+    )]
+
+# 设定合理的上限（防止AI生成"200个深蹲"这种离谱数据）
+MAX_SQUAT = 60
+MAX_PUSHUP = 50
+MAX_PLANK = 120
+MAX_JACK = 100
+
+# (目标字段, 关键词, 单位, 最小值, 最大值, 小于该值视为组数, 是否用组数乘每组数量)
+# 第一条规则即"每组X次"，同时用于把组数换算成总量
+EXERCISE_PARSE_RULES = [
+    ("squat", "深蹲", "次", 10, MAX_SQUAT, 10, True),
+    ("pushup", "俯卧撑", "次", 5, MAX_PUSHUP, 10, True),
+    ("plank", "平板支撑", "秒", 20, MAX_PLANK, 20, False),  # 平板支撑通常取每组秒数
+    ("jumping_jack", "开合跳", "次", 15, MAX_JACK, 10, True),
+]
+EXERCISE_PATTERNS = {
+    field: _compile_exercise_patterns(keyword, unit)
+    for field, keyword, unit, *_ in EXERCISE_PARSE_RULES
+}
+
+# 每周运动次数
+SESSIONS_PATTERNS = [re.compile(p, re.IGNORECASE) for p in (
+    r'总运动次数[：:]\s*(\d+)',
+    r'每周.*?(\d+)\s*次(?!运动)',
+    r'运动次数[：:]\s*(\d+)',
+)]
+
+# 每周运动时长（分钟）
+DURATION_PATTERNS = [re.compile(p, re.IGNORECASE) for p in (
+    r'总运动时长[：:].*?(\d+)\s*分钟',
+    r'每次运动.*?(\d+)[-~](\d+)\s*分钟',  # 45-60分钟
+    r'每次运动.*?约\s*(\d+)\s*分钟',
+    r'每周.*?(\d+)\s*分钟',
+)]
+
+# 教练建议的标题，按优先级排列（策略1-4）
+ADVICE_TITLES = ('教练建议', 'AI教练深度指导', 'AI教练寄语', 'AI教练对话')
+# 在某个 "###" 处匹配教练建议标题，group(1) 为标题，匹配结束位置即正文开始位置
+ADVICE_HEADER_PATTERN = re.compile(r'###\s*(' + '|'.join(ADVICE_TITLES) + r')\s*')
+HEADER_PATTERN = re.compile(r'###\s*(.*?)\n')
+ADVICE_HEADER_KEYWORDS = ['指导', '寄语', '建议', '总结', '话', 'Guide', 'Advice']
+NUMBERED_ITEM_PATTERN = re.compile(r'^\d+\.')
+DASH_ITEM_PATTERN = re.compile(r'^\-')
+
+# 专业建议
+SUGGESTIONS_PATTERN = re.compile(r'### 专业建议\s*(.*?)(?=###|$)', re.DOTALL)
+SUGGESTION_PREFIX_PATTERN = re.compile(r'^[\d\.\-\s]+')
+# 只由这些符号、数字和空白组成的行不是建议，用 str.translate 删除符号后判断
+SYMBOL_DELETE_TABLE = str.maketrans('', '', '#*-•')
+SUGGESTION_SKIP_KEYWORDS = ['建议', '目标', '情感激励', 'AI教练对话', 'AI教练寄语', 'AI教练深度指导']
+# 所有跳过关键词合并为一个正则，一次扫描判断整行
+SUGGESTION_SKIP_PATTERN = re.compile('|'.join(map(re.escape, SUGGESTION_SKIP_KEYWORDS)))
+
+def find_advice_section(ai_text):
+    """
+    策略1-4：一次扫描找出所有 "###" 的位置，在这些位置上匹配教练建议标题
+    按 ADVICE_TITLES 的优先级取该标题第一次出现处的正文（到下一个 "###" 或文本末尾为止）
+    
+    返回:
+        str: 未去除首尾空白的正文，没有任何教练建议标题时返回 None
+    """
+    positions = []
+    pos = ai_text.find('###')
+    while pos >= 0:
+        positions.append(pos)
+        pos = ai_text.find('###', pos + 1)
+    
+    sections = {}
+    for pos in positions:
+        match = ADVICE_HEADER_PATTERN.match(ai_text, pos)
+        if match and match.group(1) not in sections:
+            body_start = match.end()
+            next_index = bisect.bisect_left(positions, body_start)
+            body_end = positions[next_index] if next_index < len(positions) else len(ai_text)
+            sections[match.group(1)] = ai_text[body_start:body_end]
+    
+    for title in ADVICE_TITLES:
+        if title in sections:
+            return sections[title]
+    return None
+
+def clamp(value, min_val, max_val):
+    """安全限制：把数值限制在 [min_val, max_val] 范围内（直接比较，不调用 min/max）"""
+    return min_val if value < min_val else max_val if value > max_val else value
+
+def parse_ai_response(ai_text, height, weight, age, gender):
+    """
+    解析AI返回的文本，提取健身计划数据
+    
+    参数:
+        ai_text: AI返回的文本
+        height: 身高
         weight: 体重
         age: 年龄
         gender: 性别
@@ -1405,8 +2081,6 @@ def parse_ai_response(ai_text, height, weight, age, gender):
     返回:
         解析后的健身计划字典
     """
-    import re
-    
     # 默认值
     daily_goals = {
         "squat": 20,
@@ -1420,134 +2094,47 @@ def parse_ai_response(ai_text, height, weight, age, gender):
     }
     suggestions = []
     
-    print(f"🔍 [AI] 开始解析AI响应...")
-    
-    # --- 安全限制函数 ---
-    def clamp(value, min_val, max_val):
-        return max(min_val, min(value, max_val))
-        
-    # 设定合理的上限（防止AI生成"200个深蹲"这种离谱数据）
-    MAX_SQUAT = 60
-    MAX_PUSHUP = 50
-    MAX_PLANK = 120
-    MAX_JACK = 100
-    
-    # 改进的解析逻辑：优先匹配"每组X次"或"X次"，如果没有则匹配"X组"
-    # 深蹲：匹配"每组(\d+)次"或"(\d+)次"或"(\d+)组"
-    squat_patterns = [
-        r'深蹲[：:].*?每组\s*(\d+)\s*次',  # 深蹲：3组，每组15次
-        r'深蹲[：:].*?(\d+)\s*次(?!组)',  # 深蹲：15次
-        r'深蹲[：:].*?(\d+)\s*组',  # 深蹲：3组
-        r'深蹲[：:]\s*(\d+)',  # 深蹲：15
-    ]
-    for pattern in squat_patterns:
-        match = re.search(pattern, ai_text, re.IGNORECASE)
-        if match:
-            value = int(match.group(1))
-            # 如果值太小（可能是组数），尝试找每组次数
-            if value < 10:
-                each_match = re.search(r'深蹲[：:].*?每组\s*(\d+)\s*次', ai_text, re.IGNORECASE)
-                if each_match:
-                    value = int(each_match.group(1)) * value  # 组数 * 每组次数
-            
-            # 安全限制
-            original_value = value
-            value = clamp(value, 10, MAX_SQUAT)
-            daily_goals["squat"] = value
-            print(f"✅ [AI] 解析深蹲: {original_value}次 -> 修正为: {value}次")
-            break
-    
-    # 俯卧撑
-    pushup_patterns = [
-        r'俯卧撑[：:].*?每组\s*(\d+)\s*次',
-        r'俯卧撑[：:].*?(\d+)\s*次(?!组)',
-        r'俯卧撑[：:].*?(\d+)\s*组',
-        r'俯卧撑[：:]\s*(\d+)',
-    ]
-    for pattern in pushup_patterns:
-        match = re.search(pattern, ai_text, re.IGNORECASE)
-        if match:
-            value = int(match.group(1))
-            if value < 10:
-                each_match = re.search(r'俯卧撑[：:].*?每组\s*(\d+)\s*次', ai_text, re.IGNORECASE)
-                if each_match:
-                    value = int(each_match.group(1)) * value
-            
-            # 安全限制
-            original_value = value
-            value = clamp(value, 5, MAX_PUSHUP)
-            daily_goals["pushup"] = value
-            print(f"✅ [AI] 解析俯卧撑: {original_value}次 -> 修正为: {value}次")
-            break
+    logger.debug("🔍 [AI] 开始解析AI响应...")
     
-    # 平板支撑（单位是秒）
-    plank_patterns = [
-        r'平板支撑[：:].*?每组\s*(\d+)\s*秒',
-        r'平板支撑[：:].*?(\d+)\s*秒(?!组)',
-        r'平板支撑[：:].*?(\d+)\s*组',
-        r'平板支撑[：:]\s*(\d+)',
-    ]
-    for pattern in plank_patterns:
-        match = re.search(pattern, ai_text, re.IGNORECASE)
-        if match:
-            value = int(match.group(1))
-            if value < 20:  # 如果值太小，可能是组数
-                each_match = re.search(r'平板支撑[：:].*?每组\s*(\d+)\s*秒', ai_text, re.IGNORECASE)
-                if each_match:
-                    value = int(each_match.group(1))  # 平板支撑通常取每组秒数
-            
-            # 安全限制
-            original_value = value
-            value = clamp(value, 20, MAX_PLANK)
-            daily_goals["plank"] = value
-            print(f"✅ [AI] 解析平板支撑: {original_value}秒 -> 修正为: {value}秒")
-            break
-    
-    # 开合跳
-    jack_patterns = [
-        r'开合跳[：:].*?每组\s*(\d+)\s*次',
-        r'开合跳[：:].*?(\d+)\s*次(?!组)',
-        r'开合跳[：:].*?(\d+)\s*组',
-        r'开合跳[：:]\s*(\d+)',
-    ]
-    for pattern in jack_patterns:
-        match = re.search(pattern, ai_text, re.IGNORECASE)
-        if match:
-            value = int(match.group(1))
-            if value < 10:
-                each_match = re.search(r'开合跳[：:].*?每组\s*(\d+)\s*次', ai_text, re.IGNORECASE)
-                if each_match:
-                    value = int(each_match.group(1)) * value
-            
-            # 安全限制
-            original_value = value
-            value = clamp(value, 15, MAX_JACK)
-            daily_goals["jumping_jack"] = value
-            print(f"✅ [AI] 解析开合跳: {original_value}次 -> 修正为: {value}次")
-            break
+    # 各项运动目标
+    # 所有规则都以运动关键词开头：先用 str.find 定位关键词第一次出现的位置，
+    # 文本中没有该关键词时整组规则直接跳过，否则各规则都从该位置开始搜索
+    for field, keyword, unit, min_val, max_val, sets_threshold, multiply_sets in EXERCISE_PARSE_RULES:
+        start = ai_text.find(keyword)
+        if start < 0:
+            continue
+        patterns = EXERCISE_PATTERNS[field]
+        for pattern in patterns:
+            match = pattern.search(ai_text, start)
+            if match:
+                value = int(match.group(1))
+                # 如果值太小（可能是组数），尝试找每组数量
+                if value < sets_threshold:
+                    each_match = patterns[0].search(ai_text, start)
+                    if each_match:
+                        if multiply_sets:
+                            value = int(each_match.group(1)) * value  # 组数 * 每组次数
+                        else:
+                            value = int(each_match.group(1))
+                
+                # 安全限制
+                original_value = value
+                value = clamp(value, min_val, max_val)
+                daily_goals[field] = value
+                logger.debug("✅ [AI] 解析%s: %d%s -> 修正为: %d%s", keyword, original_value, unit, value, unit)
+                break
     
     # 每周运动次数
-    sessions_patterns = [
-        r'总运动次数[：:]\s*(\d+)',
-        r'每周.*?(\d+)\s*次(?!运动)',
-        r'运动次数[：:]\s*(\d+)',
-    ]
-    for pattern in sessions_patterns:
-        match = re.search(pattern, ai_text, re.IGNORECASE)
+    for pattern in SESSIONS_PATTERNS:
+        match = pattern.search(ai_text)
         if match:
             weekly_goals["total_sessions"] = int(match.group(1))
-            print(f"✅ [AI] 解析每周运动次数: {weekly_goals['total_sessions']}次")
+            logger.debug("✅ [AI] 解析每周运动次数: %d次", weekly_goals["total_sessions"])
             break
     
     # 每周运动时长（分钟）
-    duration_patterns = [
-        r'总运动时长[：:].*?(\d+)\s*分钟',
-        r'每次运动.*?(\d+)[-~](\d+)\s*分钟',  # 45-60分钟
-        r'每次运动.*?约\s*(\d+)\s*分钟',
-        r'每周.*?(\d+)\s*分钟',
-    ]
-    for pattern in duration_patterns:
-        match = re.search(pattern, ai_text, re.IGNORECASE)
+    for pattern in DURATION_PATTERNS:
+        match = pattern.search(ai_text)
         if match:
             # 如果是范围（如45-60），取平均值
             if len(match.groups()) == 2:
@@ -1561,89 +2148,85 @@ def parse_ai_response(ai_text, height, weight, age, gender):
                     weekly_goals["total_duration"] = duration * weekly_goals["total_sessions"]
                 else:
                     weekly_goals["total_duration"] = duration
-            print(f"✅ [AI] 解析每周运动时长: {weekly_goals['total_duration']}分钟")
+            logger.debug("✅ [AI] 解析每周运动时长: %d分钟", weekly_goals["total_duration"])
             break
     
     # 提取AI教练建议
     ai_advice = ""
     
     # 调试：打印原始文本的最后500个字符，看看AI到底返回了什么
-    print(f"🔍 [AI Debug] 原始响应末尾预览:\n{ai_text[-500:]}")
+    logger.debug("🔍 [AI Debug] 原始响应末尾预览:\n%s", ai_text[-500:])
 
-    # 策略1：标准匹配 "教练建议"
-    advice_match = re.search(r'###\s*教练建议\s*(.*?)(?=###|$)', ai_text, re.DOTALL)
-    
-    # 策略2：兼容 "AI教练深度指导"
-    if not advice_match:
-        advice_match = re.search(r'###\s*AI教练深度指导\s*(.*?)(?=###|$)', ai_text, re.DOTALL)
-        
-    # 策略3：兼容 "AI教练寄语"
-    if not advice_match:
-        advice_match = re.search(r'###\s*AI教练寄语\s*(.*?)(?=###|$)', ai_text, re.DOTALL)
-        
-    # 策略4：兼容 "AI教练对话"
-    if not advice_match:
-        advice_match = re.search(r'###\s*AI教练对话\s*(.*?)(?=###|$)', ai_text, re.DOTALL)
+    # 策略1-4：依次匹配 "教练建议"、"AI教练深度指导"、"AI教练寄语"、"AI教练对话"
+    advice_section = find_advice_section(ai_text)
 
     # 策略5：寻找最后一个 "###" 标题之后的内容（通常是总结或寄语）
-    if not advice_match:
+    if advice_section is None:
         # 找到最后一个 ### 标题
-        last_header_match = list(re.finditer(r'###\s*(.*?)\n', ai_text))
+        last_header_match = list(HEADER_PATTERN.finditer(ai_text))
         if last_header_match:
             last_header = last_header_match[-1]
             # 如果最后一个标题包含 "指导"、"寄语"、"建议"、"总结" 等关键词
             header_text = last_header.group(1)
-            if any(k in header_text for k in ['指导', '寄语', '建议', '总结', '话', 'Guide', 'Advice']):
+            if any(k in header_text for k in ADVICE_HEADER_KEYWORDS):
                 start_pos = last_header.end()
                 ai_advice = ai_text[start_pos:].strip()
-                print(f"✅ [AI] 策略5匹配成功 (标题: {header_text}): {ai_advice[:20]}...")
+                logger.debug("✅ [AI] 策略5匹配成功 (标题: %s): %s...", header_text, ai_advice[:20])
 
-    if advice_match:
-        ai_advice = advice_match.group(1).strip()
-        print(f"✅ [AI] 精确匹配成功: {ai_advice[:20]}...")
+    if advice_section is not None:
+        ai_advice = advice_section.strip()
+        logger.debug("✅ [AI] 精确匹配成功: %s...", ai_advice[:20])
     elif not ai_advice:
         # 策略6：实在找不到，尝试提取最后一段长文本
-        print(f"⚠️ [AI] 未找到明确标记，尝试提取最后一段长文本...")
+        logger.debug("⚠️ [AI] 未找到明确标记，尝试提取最后一段长文本...")
         paragraphs = [p.strip() for p in ai_text.split('\n\n') if len(p.strip()) > 50]
         if paragraphs:
             # 取最后一段，但要排除包含大量数字或列表项的段落
             potential_advice = paragraphs[-1]
-            if not re.search(r'^\d+\.', potential_advice) and not re.search(r'^\-', potential_advice):
+            if not NUMBERED_ITEM_PATTERN.search(potential_advice) and not DASH_ITEM_PATTERN.search(potential_advice):
                 ai_advice = potential_advice
-                print(f"✅ [AI] 宽松匹配找到文本: {ai_advice[:20]}...")
+                logger.debug("✅ [AI] 宽松匹配找到文本: %s...", ai_advice[:20])
             else:
                 # 如果最后一段像列表，可能倒数第二段是建议
                 if len(paragraphs) > 1:
                     ai_advice = paragraphs[-2]
-                    print(f"✅ [AI] 宽松匹配找到倒数第二段: {ai_advice[:20]}...")
+                    logger.debug("✅ [AI] 宽松匹配找到倒数第二段: %s...", ai_advice[:20])
 
     # 提取专业建议
-    suggestions_match = re.search(r'### 专业建议\s*(.*?)(?=###|$)', ai_text, re.DOTALL)
+    suggestions_match = SUGGESTIONS_PATTERN.search(ai_text)
     if suggestions_match:
         suggestions_text = suggestions_match.group(1).strip()
         # 提取每一行作为建议
-        suggestions = [line.strip() for line in suggestions_text.split('\n') if line.strip() and (line.strip().startswith('-') or line.strip()[0].isdigit())]
         # 去掉开头的序号或破折号
-        suggestions = [re.sub(r'^[\d\.\-\s]+', '', s) for s in suggestions]
-        print(f"✅ [AI] 解析专业建议: {len(suggestions)}条")
+        stripped_lines = (line.strip() for line in suggestions_text.split('\n'))
+        suggestions = [
+            SUGGESTION_PREFIX_PATTERN.sub('', line) for line in stripped_lines
+            if line and (line.startswith('-') or line[0].isdigit())
+        ]
+        logger.debug("✅ [AI] 解析专业建议: %d条", len(suggestions))
     else:
         # 旧的宽松解析逻辑
-        lines = [line.strip() for line in ai_text.split('\n') if line.strip()]
-        for line in lines:
-            # 跳过标题、数字行、空行
-            if (len(line) > 20 and 
-                not re.match(r'^[#*\-•\d\s]+$', line) and 
-                not re.match(r'^[###\s]+', line) and
-                '建议' not in line and '目标' not in line and '情感激励' not in line and 'AI教练对话' not in line and 'AI教练寄语' not in line and 'AI教练深度指导' not in line and
-                line not in ai_advice):
-                suggestions.append(line)
+        for line in ai_text.split('\n'):
+            line = line.strip()
+            # 跳过短行、标题、纯符号/数字行以及包含关键词的行
+            if len(line) <= 20 or line.startswith('#'):
+                continue
+            if SUGGESTION_SKIP_PATTERN.search(line) or line in ai_advice:
+                continue
+            remainder = ''.join(line.translate(SYMBOL_DELETE_TABLE).split())
+            if not remainder or remainder.isdecimal():
+                continue
+            suggestions.append(line)
+            if len(suggestions) == 5:
+                break
     
     suggestions = suggestions[:5]  # 最多5条建议
     
-    print(f"📋 [AI] 最终解析结果:")
-    print(f"   深蹲: {daily_goals['squat']}次, 俯卧撑: {daily_goals['pushup']}次")
-    print(f"   平板支撑: {daily_goals['plank']}秒, 开合跳: {daily_goals['jumping_jack']}次")
-    print(f"   每周: {weekly_goals['total_sessions']}次, {weekly_goals['total_duration']}分钟")
+    logger.debug(
+        "📋 [AI] 最终解析结果: 深蹲: %d次, 俯卧撑: %d次, 平板支撑: %d秒, 开合跳: %d次, 每周: %d次, %d分钟",
+        daily_goals["squat"], daily_goals["pushup"], daily_goals["plank"], daily_goals["jumping_jack"],
+        weekly_goals["total_sessions"], weekly_goals["total_duration"]
+    )
     
     return {
         "daily_goals": daily_goals,
@@ -1653,125 +2236,117 @@ def parse_ai_response(ai_text, height, weight, age, gender):
         "ai_response": ai_text
     }
 
-def ai_generate_fitness_plan(height, weight, age, gender, body_fat=None, custom_goal=None):
-    """
-    AI Agent: 根据用户生命体征生成个性化健身计划建议
-    优先使用智谱AI API，如果失败则使用规则引擎
-    
-    参数:
-        height: 身高（cm）
-        weight: 体重（kg）
-        age: 年龄
-        gender: 性别（male/female/other）
-        body_fat: 体脂率（%）
-        custom_goal: 自定义目标（如：减脂、增肌、塑形）
-    
-    返回:
-        包含每日目标和每周目标的字典
-    """
-    # 计算BMI
-    bmi = calculate_bmi(height, weight)
-    fitness_level = get_fitness_level(bmi, age) if bmi else "beginner"
-    
-    # 构建AI提示词
-    gender_text = {"male": "男性", "female": "女性", "other": "其他"}.get(gender, "未知")
-    age_text = f"{age}岁" if age else "未知"
-    bmi_text = f"{round(bmi, 1)}" if bmi else "未知"
-    body_fat_text = f"{body_fat}%" if body_fat else "未知"
-    goal_text = custom_goal if custom_goal else "综合健康"
-    
-    prompt = f"""请根据以下用户信息，制定一份个性化的健身计划：
+# ==================== 规则引擎常量 ====================
 
-用户信息：
-- 身高：{height}cm
-- 体重：{weight}kg
-- BMI：{bmi_text}
-- 体脂率：{body_fat_text}
-- 年龄：{age_text}
-- 性别：{gender_text}
-- 健身水平：{fitness_level}
-- 健身目标：{goal_text}
+GENDER_TEXT = {"male": "男性", "female": "女性", "other": "其他"}
 
-请提供以下内容：
+# 基础建议值（根据健身水平调整）
+BASE_DAILY_GOALS = {
+    "beginner": {"squat": 15, "pushup": 10, "plank": 30, "jumping_jack": 20},
+    "underweight": {"squat": 20, "pushup": 15, "plank": 45, "jumping_jack": 25},
+    "normal": {"squat": 25, "pushup": 20, "plank": 60, "jumping_jack": 30},
+    "overweight": {"squat": 30, "pushup": 25, "plank": 75, "jumping_jack": 40},
+    "obese": {"squat": 35, "pushup": 30, "plank": 90, "jumping_jack": 50}
+}
 
-### 每日目标
-- 深蹲：XX次（直接写总次数）
-- 俯卧撑：XX次（直接写总次数）
-- 平板支撑：XX秒（直接写总秒数）
-- 开合跳：XX次（直接写总次数）
+# 同样的基础值按 DAILY_GOAL_KEYS 的顺序排成数组，便于一次性计算
+DAILY_GOAL_KEYS = ("squat", "pushup", "plank", "jumping_jack")
+BASE_DAILY_ARRAYS = {
+    level: np.array([goals[key] for key in DAILY_GOAL_KEYS], dtype=np.float64)
+    for level, goals in BASE_DAILY_GOALS.items()
+}
+# 每项目标的下限，以及是否受性别系数影响
+DAILY_GOAL_MINIMUMS = np.array([10, 5, 20, 15], dtype=np.int64)
+GENDER_SCALED_MASK = np.array([True, True, False, True])
+
+# 年龄系数：<18 青少年适当降低，18-29 青年，30-39 中年，40-49，>=50 中老年
+AGE_BINS = (18, 30, 40, 50)
+AGE_FACTORS = (0.8, 1.0, 0.9, 0.85, 0.75)
+
+# 性别系数（男性通常力量更强），未知性别为1.0
+GENDER_FACTORS = {"male": 1.1, "female": 0.9}
+
+def _daily_goal_kernel(base_values, age_factor, gender_factor, scaled_mask, minimums):
+    """每日目标：基础值 × 年龄系数 × 性别系数（仅 scaled_mask 项），取整后不低于下限"""
+    result = np.empty(base_values.shape[0], dtype=np.int64)
+    for i in range(base_values.shape[0]):
+        factor = gender_factor if scaled_mask[i] else 1.0
+        # 保持 (基础值 × 年龄) × 性别 的运算顺序，结果与逐项计算完全一致
+        result[i] = max(int(base_values[i] * age_factor * factor), minimums[i])
+    return result
+
+# 安装了 numba 时编译为机器码（不开启 fastmath，保证浮点结果不变），否则以纯 Python 运行
+if njit is not None:
+    daily_goal_kernel = njit(cache=True)(_daily_goal_kernel)
+    # 导入时预热，避免第一个请求承担JIT编译耗时
+    daily_goal_kernel(BASE_DAILY_ARRAYS["beginner"], 1.0, 1.0, GENDER_SCALED_MASK, DAILY_GOAL_MINIMUMS)
+else:
+    daily_goal_kernel = _daily_goal_kernel
+
+# 每周运动量较低的健身水平
+LIGHT_PLAN_LEVELS = ("beginner", "obese")
+
+# 建议说明查找表
+# BMI建议按健身水平查找（健身水平即由BMI分档得到，未提供BMI时为 beginner，无建议）
+BMI_SUGGESTIONS = {
+    "underweight": "您的BMI偏低，建议增加力量训练，同时注意营养补充。",
+    "normal": "您的BMI在正常范围内，建议保持均衡的有氧和力量训练。",
+    "overweight": "您的BMI在正常范围内，建议保持均衡的有氧和力量训练。",
+    "obese": "您的BMI偏高，建议增加有氧运动（如开合跳），并配合力量训练。",
+}
+# 年龄建议按 AGE_BINS 分档下标查找：0 为 <18，4 为 >=50
+AGE_SUGGESTIONS = {
+    0: "青少年时期是身体发育的关键期，建议适度运动，避免过度训练。",
+    4: "考虑到您的年龄，建议从较低强度开始，循序渐进。",
+}
+GENDER_SUGGESTIONS = {
+    "female": "女性训练建议：可以适当增加平板支撑等核心训练，有助于塑造体形。",
+}
 
-### 每周目标
-- 总运动次数：X次
-- 总运动时长：X分钟
+# 模板化的AI建议（当AI服务不可用时），按目标定制：(饮食建议, 运动建议)
+GOAL_ADVICE = {
+    "减脂": (
+        "在饮食方面，试着把晚餐的主食减半，换成粗粮（如玉米、红薯）。早餐可以吃得丰富些，比如全麦面包配鸡蛋和牛奶。记得少吃油炸食品和甜点，它们是热量炸弹哦！",
+        "运动时，保持心率在燃脂区间很重要。做开合跳时，注意膝盖微屈缓冲，避免关节受伤。如果觉得累，可以放慢节奏，但尽量不要停下来。"
+    ),
+    "增肌": (
+        "增肌需要足够的燃料！运动后30分钟内补充蛋白质非常关键，比如喝一杯蛋白粉或者吃两个蛋白。平时多吃牛肉、鸡胸肉，保证碳水化合物的摄入来维持训练强度。",
+        "做俯卧撑和深蹲时，动作要慢，感受肌肉的发力。宁可少做几个，也要保证动作标准。每组之间休息60-90秒，让肌肉得到恢复。"
+    ),
+    "塑形": (
+        "塑形期要注重蛋白质和维生素的摄入。多吃深色蔬菜，它们富含抗氧化剂。晚餐尽量清淡，避免水肿。",
+        "平板支撑是塑形的神器！做的时候收紧核心，不要塌腰。试着每天多坚持5秒，你会发现线条越来越紧致。"
+    ),
+}
+DEFAULT_GOAL_ADVICE = (
+    "保持均衡饮食是关键。每天保证一斤蔬菜半斤水果，多喝水促进代谢。少吃加工食品，回归天然食材。",
+    "循序渐进是最好的策略。运动前充分热身，运动后拉伸放松。听从身体的声音，累了就休息，不要勉强。"
+)
 
-重要：
-1. 每日目标请直接写总次数/总秒数，不要写"X组，每组X次"的格式。
-2. 运动强度必须合理，适合普通人。深蹲不要超过50次，俯卧撑不要超过40次，平板支撑不要超过90秒。
-3. 不需要提供任何文字建议，只需要返回上述数据即可。"""
-    
-    # 尝试调用智谱AI API
-    print(f"\n{'='*60}")
-    print(f"🤖 [AI] 开始生成健身计划")
-    print(f"📊 [AI] 用户信息: 身高{height}cm, 体重{weight}kg, 年龄{age_text}, 性别{gender_text}, BMI{bmi_text}, 体脂{body_fat_text}, 目标{goal_text}")
-    print(f"{'='*60}\n")
-    
-    ai_response, ai_error = call_zhipu_ai_api(prompt)
-    
-    if ai_response:
-        print(f"✅ [AI] 使用智谱AI生成计划")
-        # 解析AI返回的结果
-        result = parse_ai_response(ai_response, height, weight, age, gender)
-        result["bmi"] = round(bmi, 1) if bmi else None
-        result["fitness_level"] = fitness_level
-        result["reasoning"] = f"基于您的身体指标（BMI: {round(bmi, 1) if bmi else '未提供'}, 体脂: {body_fat_text}, 目标: {goal_text}），智谱AI为您生成了个性化的健身计划。"
-        result["ai_used"] = True
-        result["ai_status"] = "success"
-        result["ai_raw_response"] = ai_response  # 保存原始AI响应
-        print(f"📋 [AI] 解析后的计划: 深蹲{result['daily_goals']['squat']}次, 俯卧撑{result['daily_goals']['pushup']}次")
-        print(f"{'='*60}\n")
-        return result
-    else:
-        print(f"⚠️  [AI] API调用失败 ({ai_error})，使用规则引擎生成计划")
+@lru_cache(maxsize=2048)
+def compute_rule_plan(height, weight, age, gender, custom_goal):
+    """
+    规则引擎：根据身体指标计算健身计划
+    结果只取决于参数，按参数缓存；返回不可变元组，避免调用方修改缓存内容
     
-    # 如果AI API调用失败，使用规则引擎（原有逻辑）
-    # 基础建议值（根据健身水平调整）
-    base_daily = {
-        "beginner": {"squat": 15, "pushup": 10, "plank": 30, "jumping_jack": 20},
-        "underweight": {"squat": 20, "pushup": 15, "plank": 45, "jumping_jack": 25},
-        "normal": {"squat": 25, "pushup": 20, "plank": 60, "jumping_jack": 30},
-        "overweight": {"squat": 30, "pushup": 25, "plank": 75, "jumping_jack": 40},
-        "obese": {"squat": 35, "pushup": 30, "plank": 90, "jumping_jack": 50}
-    }
+    返回:
+        (每日目标项, 每周目标项, 建议说明, 模板化AI建议)
+    """
+    bmi = calculate_bmi(height, weight)
+    fitness_level = get_fitness_level(bmi, age) if bmi else "beginner"
     
     # 根据年龄调整（年龄越大，建议值适当降低）
-    age_factor = 1.0
-    if age:
-        if age < 18:
-            age_factor = 0.8  # 青少年适当降低
-        elif age < 30:
-            age_factor = 1.0  # 青年
-        elif age < 40:
-            age_factor = 0.9  # 中年
-        elif age < 50:
-            age_factor = 0.85
-        else:
-            age_factor = 0.75  # 中老年
+    age_band = bisect.bisect_right(AGE_BINS, age) if age else None
+    age_factor = AGE_FACTORS[age_band] if age_band is not None else 1.0
     
     # 根据性别调整（男性通常力量更强）
-    gender_factor = 1.0
-    if gender == "male":
-        gender_factor = 1.1
-    elif gender == "female":
-        gender_factor = 0.9
-    
-    # 生成每日目标
-    base_values = base_daily.get(fitness_level, base_daily["beginner"])
-    daily_goals = {
-        "squat": max(10, int(base_values["squat"] * age_factor * gender_factor)),
-        "pushup": max(5, int(base_values["pushup"] * age_factor * gender_factor)),
-        "plank": max(20, int(base_values["plank"] * age_factor)),
-        "jumping_jack": max(15, int(base_values["jumping_jack"] * age_factor * gender_factor))
-    }
+    gender_factor = GENDER_FACTORS.get(gender, 1.0)
+    
+    # 生成每日目标：基础值 × 年龄系数 × 性别系数（平板支撑不受性别影响），再取下限
+    base_values = BASE_DAILY_ARRAYS.get(fitness_level, BASE_DAILY_ARRAYS["beginner"])
+    values = daily_goal_kernel(base_values, float(age_factor), float(gender_factor),
+                               GENDER_SCALED_MASK, DAILY_GOAL_MINIMUMS)
+    daily_goals = dict(zip(DAILY_GOAL_KEYS, values.tolist()))
 
     # 根据自定义目标调整
     if custom_goal:
@@ -1791,9 +2366,10 @@ def ai_generate_fitness_plan(height, weight, age, gender, body_fat=None, custom_
     
     # 生成每周目标（基于每日目标计算）
     # 建议每周运动5-6次，每次约30-45分钟
+    light_plan = fitness_level in LIGHT_PLAN_LEVELS
     weekly_goals = {
-        "total_sessions": 5 if fitness_level in ["beginner", "obese"] else 6,
-        "total_duration": 150 if fitness_level in ["beginner", "obese"] else 180
+        "total_sessions": 5 if light_plan else 6,
+        "total_duration": 150 if light_plan else 180
     }
 
     # 根据目标调整每周计划
@@ -1804,42 +2380,18 @@ def ai_generate_fitness_plan(height, weight, age, gender, body_fat=None, custom_
         weekly_goals["total_sessions"] = 4  # 增肌需要休息
         weekly_goals["total_duration"] = 160
     
-    # 生成建议说明
-    suggestions = []
-    if bmi:
-        if bmi < 18.5:
-            suggestions.append("您的BMI偏低，建议增加力量训练，同时注意营养补充。")
-        elif bmi >= 28:
-            suggestions.append("您的BMI偏高，建议增加有氧运动（如开合跳），并配合力量训练。")
-        else:
-            suggestions.append("您的BMI在正常范围内，建议保持均衡的有氧和力量训练。")
-    
-    if age:
-        if age >= 50:
-            suggestions.append("考虑到您的年龄，建议从较低强度开始，循序渐进。")
-        elif age < 18:
-            suggestions.append("青少年时期是身体发育的关键期，建议适度运动，避免过度训练。")
-    
-    if gender == "female":
-        suggestions.append("女性训练建议：可以适当增加平板支撑等核心训练，有助于塑造体形。")
+    # 生成建议说明：BMI、年龄、性别各查一次表
+    suggestions = tuple(
+        text for text in (
+            BMI_SUGGESTIONS.get(fitness_level),
+            AGE_SUGGESTIONS.get(age_band),
+            GENDER_SUGGESTIONS.get(gender),
+        ) if text
+    )
 
     # 生成模板化的AI建议（当AI服务不可用时）
     # 根据目标定制更详细的建议
-    diet_advice = ""
-    exercise_advice = ""
-    
-    if custom_goal == "减脂":
-        diet_advice = "在饮食方面，试着把晚餐的主食减半，换成粗粮（如玉米、红薯）。早餐可以吃得丰富些，比如全麦面包配鸡蛋和牛奶。记得少吃油炸食品和甜点，它们是热量炸弹哦！"
-        exercise_advice = "运动时，保持心率在燃脂区间很重要。做开合跳时，注意膝盖微屈缓冲，避免关节受伤。如果觉得累，可以放慢节奏，但尽量不要停下来。"
-    elif custom_goal == "增肌":
-        diet_advice = "增肌需要足够的燃料！运动后30分钟内补充蛋白质非常关键，比如喝一杯蛋白粉或者吃两个蛋白。平时多吃牛肉、鸡胸肉，保证碳水化合物的摄入来维持训练强度。"
-        exercise_advice = "做俯卧撑和深蹲时，动作要慢，感受肌肉的发力。宁可少做几个，也要保证动作标准。每组之间休息60-90秒，让肌肉得到恢复。"
-    elif custom_goal == "塑形":
-        diet_advice = "塑形期要注重蛋白质和维生素的摄入。多吃深色蔬菜，它们富含抗氧化剂。晚餐尽量清淡，避免水肿。"
-        exercise_advice = "平板支撑是塑形的神器！做的时候收紧核心，不要塌腰。试着每天多坚持5秒，你会发现线条越来越紧致。"
-    else:
-        diet_advice = "保持均衡饮食是关键。每天保证一斤蔬菜半斤水果，多喝水促进代谢。少吃加工食品，回归天然食材。"
-        exercise_advice = "循序渐进是最好的策略。运动前充分热身，运动后拉伸放松。听从身体的声音，累了就休息，不要勉强。"
+    diet_advice, exercise_advice = GOAL_ADVICE.get(custom_goal, DEFAULT_GOAL_ADVICE)
 
     ai_advice_template = f"""你好呀！我是你的AI健身教练。很高兴能陪伴你开始这段"{custom_goal or '健康'}"之旅！
 
@@ -1849,21 +2401,242 @@ def ai_generate_fitness_plan(height, weight, age, gender, body_fat=None, custom_
 
 改变从来都不是一件容易的事，但我看到了你的决心。不要急于求成，身体的改变需要时间。每一滴汗水都不会白流，坚持下去，你一定能遇到更好的自己。加油，我看好你！"""
     
-    gender_text = {"male": "男性", "female": "女性", "other": "其他"}.get(gender, "未知")
-    print(f"📋 [规则引擎] 生成的计划: 深蹲{daily_goals['squat']}次, 俯卧撑{daily_goals['pushup']}次")
-    print(f"{'='*60}\n")
+    return (
+        tuple(daily_goals.items()),
+        tuple(weekly_goals.items()),
+        suggestions,
+        ai_advice_template
+    )
+
+# 生成健身计划的提示词模板，模块加载时构建一次，只在未命中计划缓存时填充
+PLAN_PROMPT_TEMPLATE = """请根据以下用户信息，制定一份个性化的健身计划：
+
+用户信息：
+- 身高：{height}cm
+- 体重：{weight}kg
+- BMI：{bmi_text}
+- 体脂率：{body_fat_text}
+- 年龄：{age_text}
+- 性别：{gender_text}
+- 健身水平：{fitness_level}
+- 健身目标：{goal_text}
+
+请提供以下内容：
+
+### 每日目标
+- 深蹲：XX次（直接写总次数）
+- 俯卧撑：XX次（直接写总次数）
+- 平板支撑：XX秒（直接写总秒数）
+- 开合跳：XX次（直接写总次数）
+
+### 每周目标
+- 总运动次数：X次
+- 总运动时长：X分钟
+
+重要：
+1. 每日目标请直接写总次数/总秒数，不要写"X组，每组X次"的格式。
+2. 运动强度必须合理，适合普通人。深蹲不要超过50次，俯卧撑不要超过40次，平板支撑不要超过90秒。
+3. 不需要提供任何文字建议，只需要返回上述数据即可。"""
+
+def build_plan_prompt(height, weight, inputs):
+    """用身高、体重和 plan_inputs 的描述文字填充提示词模板"""
+    return PLAN_PROMPT_TEMPLATE.format(height=height, weight=weight, **inputs)
+
+def plan_inputs(height, weight, age, gender, body_fat, custom_goal):
+    """
+    计算BMI、健身水平，以及提示词和说明文字中用到的各项描述
+    
+    返回:
+        dict: bmi_rounded, fitness_level 以及各项描述文字
+    """
+    # 计算BMI
+    bmi = calculate_bmi(height, weight)
+    fitness_level = get_fitness_level(bmi, age) if bmi else "beginner"
+    # BMI只取整一次，提示词、说明和返回结果共用
+    bmi_rounded = round(bmi, 1) if bmi else None
+    
+    # 提示词和说明中使用的描述
+    gender_text = GENDER_TEXT.get(gender, "未知")
+    age_text = f"{age}岁" if age else "未知"
+    bmi_text = str(bmi_rounded) if bmi_rounded is not None else "未知"
+    bmi_reason_text = str(bmi_rounded) if bmi_rounded is not None else "未提供"
+    body_fat_text = f"{body_fat}%" if body_fat else "未知"
+    goal_text = custom_goal if custom_goal else "综合健康"
+    
     return {
-        "daily_goals": daily_goals,
-        "weekly_goals": weekly_goals,
-        "suggestions": suggestions,
-        "ai_advice": ai_advice_template,
-        "bmi": round(bmi, 1) if bmi else None,
+        "bmi_rounded": bmi_rounded,
         "fitness_level": fitness_level,
-        "reasoning": f"基于您的身体指标（BMI: {round(bmi, 1) if bmi else '未提供'}, 年龄: {age or '未提供'}, 性别: {gender_text}），系统为您生成了个性化的健身计划。",
+        "gender_text": gender_text,
+        "age_text": age_text,
+        "bmi_text": bmi_text,
+        "bmi_reason_text": bmi_reason_text,
+        "body_fat_text": body_fat_text,
+        "goal_text": goal_text
+    }
+
+def get_cached_ai_plan_response(plan_cache_key):
+    """读取缓存的AI响应：先查进程内缓存，再查 Redis（多进程共享），未命中时返回 None"""
+    ai_response = ai_plan_local_cache.get(plan_cache_key)
+    if ai_response is None:
+        cached_response = cache_get(plan_cache_key)
+        if cached_response is not None:
+            ai_response = cached_response.decode()
+            ai_plan_local_cache.set(plan_cache_key, ai_response)
+    return ai_response
+
+def store_ai_plan_response(plan_cache_key, ai_response):
+    """缓存AI响应（进程内和 Redis）"""
+    ai_plan_local_cache.set(plan_cache_key, ai_response)
+    cache_set(plan_cache_key, ai_response.encode(), AI_PLAN_CACHE_TTL)
+
+def build_ai_plan_result(ai_response, inputs, height, weight, age, gender):
+    """解析AI返回的文本，补充BMI、健身水平和生成说明"""
+    result = parse_ai_response(ai_response, height, weight, age, gender)
+    result["bmi"] = inputs["bmi_rounded"]
+    result["fitness_level"] = inputs["fitness_level"]
+    result["reasoning"] = f"基于您的身体指标（BMI: {inputs['bmi_reason_text']}, 体脂: {inputs['body_fat_text']}, 目标: {inputs['goal_text']}），智谱AI为您生成了个性化的健身计划。"
+    result["ai_used"] = True
+    result["ai_status"] = "success"
+    result["ai_raw_response"] = ai_response  # 保存原始AI响应
+    return result
+
+def build_rule_plan_result(inputs, height, weight, age, gender, custom_goal, ai_error):
+    """AI不可用时使用规则引擎生成计划"""
+    daily_items, weekly_items, suggestions, ai_advice_template = compute_rule_plan(
+        height, weight, age, gender, custom_goal
+    )
+    return {
+        "daily_goals": dict(daily_items),
+        "weekly_goals": dict(weekly_items),
+        "suggestions": list(suggestions),
+        "ai_advice": ai_advice_template,
+        "bmi": inputs["bmi_rounded"],
+        "fitness_level": inputs["fitness_level"],
+        "reasoning": f"基于您的身体指标（BMI: {inputs['bmi_reason_text']}, 年龄: {age or '未提供'}, 性别: {inputs['gender_text']}），系统为您生成了个性化的健身计划。",
         "ai_used": False,
-        "ai_status": ai_error if 'ai_error' in locals() else "unknown_error"
+        "ai_status": ai_error
     }
 
+def ai_generate_fitness_plan(height, weight, age, gender, body_fat=None, custom_goal=None):
+    """
+    AI Agent: 根据用户生命体征生成个性化健身计划建议
+    优先使用智谱AI API，如果失败则使用规则引擎
+    
+    参数:
+        height: 身高（cm）
+        weight: 体重（kg）
+        age: 年龄
+        gender: 性别（male/female/other）
+        body_fat: 体脂率（%）
+        custom_goal: 自定义目标（如：减脂、增肌、塑形）
+    
+    返回:
+        包含每日目标和每周目标的字典
+    """
+    inputs = plan_inputs(height, weight, age, gender, body_fat, custom_goal)
+    
+    # 尝试调用智谱AI API
+    logger.debug(
+        "🤖 [AI] 开始生成健身计划: 身高%scm, 体重%skg, 年龄%s, 性别%s, BMI%s, 体脂%s, 目标%s",
+        height, weight, inputs['age_text'], inputs['gender_text'], inputs['bmi_text'],
+        inputs['body_fat_text'], inputs['goal_text']
+    )
+    
+    # 相同身体指标和目标的AI响应会被缓存，命中时不再调用API
+    plan_cache_key = ai_plan_key(height, weight, age, gender, body_fat, custom_goal)
+    ai_response, ai_error = get_cached_ai_plan_response(plan_cache_key), None
+    if ai_response is not None:
+        logger.debug("⚡ [AI] 命中计划缓存")
+    else:
+        ai_response, ai_error = call_zhipu_ai_api(build_plan_prompt(height, weight, inputs))
+        if ai_response:
+            store_ai_plan_response(plan_cache_key, ai_response)
+    
+    if ai_response:
+        logger.debug("✅ [AI] 使用智谱AI生成计划")
+        # 解析AI返回的结果
+        result = build_ai_plan_result(ai_response, inputs, height, weight, age, gender)
+        logger.debug("📋 [AI] 解析后的计划: 深蹲%d次, 俯卧撑%d次", result['daily_goals']['squat'], result['daily_goals']['pushup'])
+        return result
+    else:
+        logger.warning("⚠️ [AI] API调用失败 (%s)，使用规则引擎生成计划", ai_error)
+    
+    # 如果AI API调用失败，使用规则引擎（原有逻辑）
+    result = build_rule_plan_result(inputs, height, weight, age, gender, custom_goal, ai_error)
+    logger.debug("📋 [规则引擎] 生成的计划: 深蹲%d次, 俯卧撑%d次", result['daily_goals']['squat'], result['daily_goals']['pushup'])
+    return result
+
+def sse_event(event, data):
+    """格式化一条 Server-Sent Events 消息，data 编码为单行JSON"""
+    return f"event: {event}\ndata: {orjson.dumps(data).decode()}\n\n"
+
+def stream_fitness_plan(height, weight, age, gender, body_fat=None, custom_goal=None):
+    """
+    流式生成健身计划：AI生成的文本以 delta 事件逐段推送，
+    结束后对完整文本解析一次，以 plan 事件推送与 ai_generate_fitness_plan 相同结构的结果
+    """
+    inputs = plan_inputs(height, weight, age, gender, body_fat, custom_goal)
+    plan_cache_key = ai_plan_key(height, weight, age, gender, body_fat, custom_goal)
+    ai_response, ai_error = get_cached_ai_plan_response(plan_cache_key), None
+    
+    if ai_response is None:
+        api_key = get_zhipu_api_key()
+        if not api_key:
+            ai_error = "missing_key"
+        else:
+            parts = []
+            try:
+                for content in stream_zhipu_ai_api(build_plan_prompt(height, weight, inputs), api_key):
+                    parts.append(content)
+                    yield sse_event("delta", {"content": content})
+                ai_response = "".join(parts)
+            except Exception as e:
+                logger.warning("❌ [AI] 流式调用失败，改用规则引擎: %s", e)
+                ai_error = str(e)
+            if ai_response:
+                store_ai_plan_response(plan_cache_key, ai_response)
+    
+    if ai_response:
+        result = build_ai_plan_result(ai_response, inputs, height, weight, age, gender)
+    else:
+        result = build_rule_plan_result(inputs, height, weight, age, gender, custom_goal, ai_error)
+    yield sse_event("plan", result)
+
+# AI教练对话的系统提示词
+CHAT_SYSTEM_PROMPT = "你是一位专业的健身教练，语气亲切、专业且富有感染力。请根据用户的问题提供具体的健身、饮食或健康建议。回答要简洁明了，不要长篇大论。"
+
+# AI教练单次回复的最大token数
+CHAT_MAX_TOKENS = 500
+
+# AI教练对话的超时时间（秒）：500 token 的回复通常数秒内完成，超时后尽快返回错误而不是占住工作线程
+CHAT_TIMEOUT = 15
+
+def build_chat_messages(user_message, history):
+    """构建AI教练对话上下文：系统提示词 + 最近的历史消息 + 当前用户消息"""
+    messages = [{"role": "system", "content": CHAT_SYSTEM_PROMPT}]
+    
+    # 添加历史记录（限制最近5轮对话，避免token溢出）
+    for msg in history[-10:]:
+        messages.append({
+            "role": msg.get('role'),
+            "content": msg.get('content')
+        })
+    
+    # 添加当前用户消息
+    messages.append({
+        "role": "user",
+        "content": user_message
+    })
+    return messages
+
+def chat_rate_limited_response(upstream_headers):
+    """AI服务限流时的响应，透传上游的 Retry-After"""
+    rate_limited = jsonify({"error": "AI服务请求过于频繁，请稍后再试"})
+    retry_after = upstream_headers.get('Retry-After') if upstream_headers else None
+    if retry_after:
+        rate_limited.headers['Retry-After'] = retry_after
+    return rate_limited, 429
+
 @app.route('/api/ai/chat', methods=['POST'])
 @require_auth
 def chat_with_coach():
@@ -1885,51 +2658,23 @@ def chat_with_coach():
         return jsonify({"error": "消息不能为空"}), 400
         
     # 构建对话上下文
-    messages = [
-        {
-            "role": "system",
-            "content": "你是一位专业的健身教练，语气亲切、专业且富有感染力。请根据用户的问题提供具体的健身、饮食或健康建议。回答要简洁明了，不要长篇大论。"
-        }
-    ]
-    
-    # 添加历史记录（限制最近5轮对话，避免token溢出）
-    for msg in history[-10:]:
-        messages.append({
-            "role": msg.get('role'),
-            "content": msg.get('content')
-        })
-        
-    # 添加当前用户消息
-    messages.append({
-        "role": "user",
-        "content": user_message
-    })
-    
-    # 调用AI API
-    api_key = os.getenv('ZHIPU_API_KEY')
-    if not api_key or api_key == 'your_zhipu_api_key_here':
-        # 尝试从文件读取
-        try:
-            from pathlib import Path
-            env_path = Path(__file__).parent / '.env'
-            if env_path.exists():
-                with open(env_path, 'r', encoding='utf-8') as f:
-                    for line in f:
-                        if line.strip().startswith('ZHIPU_API_KEY='):
-                            file_key = line.split('=', 1)[1].strip()
-                            if file_key and file_key != 'your_zhipu_api_key_here':
-                                api_key = file_key
-                                break
-        except:
-            pass
-            
-    if not api_key or api_key == 'your_zhipu_api_key_here':
-        print("❌ [Chat] API Key未配置")
+    messages = build_chat_messages(user_message, history)
+    
+    # 完全相同的对话上下文直接返回缓存的回复，不再请求AI
+    reply_cache_key = chat_reply_key(orjson.dumps(messages))
+    cached_reply = cache_get(reply_cache_key)
+    if cached_reply is not None:
+        response = jsonify({"reply": cached_reply.decode(), "cached": True})
+        response.headers['X-Cache'] = 'HIT'
+        return response
+    
+    # 调用AI API（环境变量未配置时从 .env 文件读取）
+    api_key = get_zhipu_api_key()
+    if not api_key:
+        logger.warning("❌ [Chat] API Key未配置")
         return jsonify({"error": "AI服务未配置"}), 503
-        
-    # 打印Key的掩码以便调试 (只显示前4位和后4位)
-    masked_key = f"{api_key[:4]}...{api_key[-4:]}" if len(api_key) > 8 else "***"
-    print(f"🔑 [Chat] 使用API Key: {masked_key}")
+    
+    logger.debug("🔑 [Chat] API Key状态: 已配置 (长度: %d)", len(api_key))
 
     # 使用官方SDK或直接HTTP请求
     # 优先使用 glm-4-flash (免费且速度快)
@@ -1937,27 +2682,26 @@ def chat_with_coach():
         "glm-4-flash"
     ]
     
-    import time
-    
     last_error = None
     
     for model in models_to_try:
-        print(f"🤖 [Chat] 尝试使用模型: {model}")
+        logger.debug("🤖 [Chat] 尝试使用模型: %s", model)
         
         try:
             if ZhipuAI:
-                client = ZhipuAI(api_key=api_key)
+                client = get_zhipu_client(api_key)
                 response = client.chat.completions.create(
                     model=model,
                     messages=messages,
                     temperature=0.7,
-                    max_tokens=500
+                    max_tokens=CHAT_MAX_TOKENS,
+                    timeout=CHAT_TIMEOUT
                 )
                 ai_reply = response.choices[0].message.content
+                cache_set(reply_cache_key, ai_reply.encode(), CHAT_REPLY_CACHE_TTL)
                 return jsonify({"reply": ai_reply})
             else:
                 # Fallback to requests if SDK not installed
-                url = "https://open.bigmodel.cn/api/paas/v4/chat/completions"
                 headers = {
                     "Authorization": f"Bearer {api_key}",
                     "Content-Type": "application/json"
@@ -1966,44 +2710,149 @@ def chat_with_coach():
                     "model": model,
                     "messages": messages,
                     "temperature": 0.7,
-                    "max_tokens": 500
+                    "max_tokens": CHAT_MAX_TOKENS
                 }
-                # 增加超时时间到60秒
-                response = requests.post(url, headers=headers, json=payload, timeout=60) 
+                # 网关错误（502/503/504）已由 zhipu_http 退避重试，这里不再额外等待
+                response = zhipu_http.post(ZHIPU_API_URL, headers=headers, data=orjson.dumps(payload), timeout=CHAT_TIMEOUT)
                 
                 # 如果成功，直接返回
                 if response.status_code == 200:
-                    result = response.json()
+                    result = orjson.loads(response.content)
                     if 'choices' in result and len(result['choices']) > 0:
                         ai_reply = result['choices'][0]['message']['content']
+                        cache_set(reply_cache_key, ai_reply.encode(), CHAT_REPLY_CACHE_TTL)
                         return jsonify({"reply": ai_reply})
                 
                 # 如果失败，记录错误并尝试下一个模型
                 error_detail = response.text
-                print(f"⚠️ [Chat] 模型 {model} 调用失败 ({response.status_code}): {error_detail}")
+                logger.warning("⚠️ [Chat] 模型 %s 调用失败 (%d): %s", model, response.status_code, error_detail)
                 last_error = error_detail
                 
-                # 如果是 50603 (System busy) 或 429 (Rate limit)，等待一下再试下一个
-                if response.status_code in [429, 500, 502, 503, 504]:
-                    time.sleep(1) # 简单的退避
-                    continue
-                else:
-                    continue
+                # 被限流时重试只会继续被拒绝，直接告诉客户端多久后再试
+                if response.status_code == 429:
+                    return chat_rate_limited_response(response.headers)
+                continue
 
         except Exception as e:
-            print(f"⚠️ [Chat] 模型 {model} 发生异常: {str(e)}")
+            logger.warning("⚠️ [Chat] 模型 %s 发生异常: %s", model, e)
+            # SDK 以 APIReachLimitError（status_code 为 429）抛出限流，与 HTTP 分支一样直接返回
+            if getattr(e, 'status_code', None) == 429:
+                return chat_rate_limited_response(getattr(getattr(e, 'response', None), 'headers', None))
             last_error = str(e)
             continue
             
     # 所有模型都失败了
-    print(f"❌ [Chat] 所有模型均调用失败。最后一次错误: {last_error}")
+    logger.error("❌ [Chat] 所有模型均调用失败。最后一次错误: %s", last_error)
     return jsonify({
         "error": "AI服务繁忙", 
         "details": f"所有可用模型均繁忙或不可用。最后错误: {last_error}"
     }), 503
 
+def stream_chat_reply(messages, reply_cache_key, api_key):
+    """
+    流式生成AI教练回复：文本以 delta 事件逐段推送，结束时以 done 事件推送完整回复
+    缓存命中时直接推送缓存的回复；中途失败时推送 error 事件
+    """
+    cached_reply = cache_get(reply_cache_key)
+    if cached_reply is not None:
+        ai_reply = cached_reply.decode()
+        yield sse_event("delta", {"content": ai_reply})
+        yield sse_event("done", {"reply": ai_reply, "cached": True})
+        return
+    
+    parts = []
+    try:
+        for content in stream_zhipu_chat(messages, api_key, max_tokens=CHAT_MAX_TOKENS):
+            parts.append(content)
+            yield sse_event("delta", {"content": content})
+    except Exception as e:
+        logger.warning("⚠️ [Chat] 流式调用失败: %s", e)
+        yield sse_event("error", {"error": "AI服务繁忙"})
+        return
+    
+    ai_reply = "".join(parts)
+    cache_set(reply_cache_key, ai_reply.encode(), CHAT_REPLY_CACHE_TTL)
+    yield sse_event("done", {"reply": ai_reply})
+
+@app.route('/api/ai/chat/stream', methods=['POST'])
+@require_auth
+def stream_chat_with_coach():
+    """
+    AI Coach Chat（流式），请求体与 /api/ai/chat 相同
+    
+    Returns:
+        text/event-stream:
+            - delta: AI回复的文本片段 {"content": ...}
+            - done: 完整回复 {"reply": ...}
+            - error: 生成中途失败 {"error": ...}
+    """
+    data = request.get_json() or {}
+    user_message = data.get('message')
+    
+    if not user_message:
+        return jsonify({"error": "消息不能为空"}), 400
+    
+    messages = build_chat_messages(user_message, data.get('history', []))
+    reply_cache_key = chat_reply_key(orjson.dumps(messages))
+    
+    api_key = get_zhipu_api_key()
+    if not api_key:
+        return jsonify({"error": "AI服务未配置"}), 503
+    
+    return app.response_class(
+        stream_chat_reply(messages, reply_cache_key, api_key),
+        mimetype='text/event-stream',
+        # 禁止缓存和反向代理缓冲，保证文本片段立即送达
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+# AI健身计划在后台线程池中生成，接口线程不等待AI接口
+AI_PLAN_WORKERS = int(os.getenv('AI_PLAN_WORKERS', 8))
+ai_plan_executor = ThreadPoolExecutor(max_workers=AI_PLAN_WORKERS, thread_name_prefix='ai-plan')
+
+def run_ai_plan_job(job_id, height, weight, age, gender, body_fat, custom_goal):
+    """后台任务：生成AI健身计划并写回任务表"""
+    try:
+        ai_plan = ai_generate_fitness_plan(height, weight, age, gender, body_fat, custom_goal)
+        status = 'done'
+    except Exception as e:
+        logger.error(f"AI计划生成失败: {job_id} - {str(e)}")
+        ai_plan, status = None, 'failed'
+    try:
+        with app.app_context():
+            finish_ai_plan_job(job_id, ai_plan, status)
+    except Exception as e:
+        logger.error(f"保存AI计划任务结果失败: {job_id} - {str(e)}")
+
+def resolve_plan_metrics(data, user_id):
+    """
+    确定生成计划用的身体指标：优先使用请求中的数据，否则从用户资料中获取
+    
+    返回:
+        ((身高, 体重, 年龄, 性别, 体脂率, 自定义目标), None)，用户不存在或缺少身高体重时为 (None, 错误响应)
+    """
+    profile = get_user_body_metrics(user_id)
+    if profile is None:
+        return None, (jsonify({"error": "用户不存在"}), 404)
+    
+    height = data.get('height') or profile.get('height')
+    weight = data.get('weight') or profile.get('weight')
+    age = data.get('age') or profile.get('age')
+    gender = data.get('gender') or profile.get('gender')
+    body_fat = data.get('body_fat') or profile.get('body_fat')
+    custom_goal = data.get('custom_goal')
+    
+    # 检查是否有足够的信息
+    if not height or not weight:
+        return None, (jsonify({
+            "error": "缺少必要信息",
+            "message": "请先在个人资料中填写身高和体重，以便AI生成个性化建议"
+        }), 400)
+    return (height, weight, age, gender, body_fat, custom_goal), None
+
 @app.route('/api/ai/generate-plan', methods=['POST'])
 @require_auth
+@handle_db_error
 def generate_ai_plan():
     """
     AI Agent: 根据用户生命体征生成个性化健身计划建议（需要认证）
@@ -2018,7 +2867,7 @@ def generate_ai_plan():
         - gender: 性别（可选，从用户资料获取）
     
     Returns:
-        JSON: AI生成的健身计划建议
+        JSON: 202 和任务ID（job_id），通过 GET /api/user/plan/job/{job_id} 轮询结果，结果包含：
             - daily_goals: 每日目标
             - weekly_goals: 每周目标
             - suggestions: 建议说明
@@ -2026,34 +2875,65 @@ def generate_ai_plan():
             - fitness_level: 健身水平
             - reasoning: 生成理由
     """
-    data = request.get_json() or {}
     user_id = request.user_id
+    metrics, error_response = resolve_plan_metrics(request.get_json() or {}, user_id)
+    if error_response is not None:
+        return error_response
     
-    user = get_user_by_id(user_id)
-    if not user:
-        return jsonify({"error": "用户不存在"}), 404
-    
-    profile = user.profile.to_dict() if user.profile else {}
-    
-    # 优先使用请求中的数据，否则从用户资料中获取
-    height = data.get('height') or profile.get('height')
-    weight = data.get('weight') or profile.get('weight')
-    age = data.get('age') or profile.get('age')
-    gender = data.get('gender') or profile.get('gender')
-    body_fat = data.get('body_fat') or profile.get('body_fat')
-    custom_goal = data.get('custom_goal')
+    # AI接口可能耗时数十秒，交给后台线程池生成，请求立即返回任务ID
+    job_id = secrets.token_hex(16)
+    create_ai_plan_job(job_id, user_id)
+    ai_plan_executor.submit(run_ai_plan_job, job_id, *metrics)
     
-    # 检查是否有足够的信息
-    if not height or not weight:
-        return jsonify({
-            "error": "缺少必要信息",
-            "message": "请先在个人资料中填写身高和体重，以便AI生成个性化建议"
-        }), 400
+    return jsonify({"job_id": job_id, "status": "pending"}), 202
+
+@app.route('/api/user/plan/stream', methods=['POST'])
+@require_auth
+@handle_db_error
+def stream_ai_plan():
+    """
+    流式生成AI健身计划（需要认证），请求体与 /api/ai/generate-plan 相同
     
-    # 调用AI agent生成建议
-    ai_plan = ai_generate_fitness_plan(height, weight, age, gender, body_fat, custom_goal)
+    Returns:
+        text/event-stream:
+            - delta: AI生成的文本片段 {"content": ...}
+            - plan: 最终计划（格式同 /api/ai/generate-plan 的结果）
+    """
+    metrics, error_response = resolve_plan_metrics(request.get_json() or {}, request.user_id)
+    if error_response is not None:
+        return error_response
+    
+    return app.response_class(
+        stream_fitness_plan(*metrics),
+        mimetype='text/event-stream',
+        # 禁止缓存和反向代理缓冲，保证文本片段立即送达
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/api/user/plan/job/<job_id>', methods=['GET'])
+@require_auth
+@handle_db_error
+def get_ai_plan_job_result(job_id):
+    """
+    获取AI健身计划生成任务的结果（需要认证）
     
-    return jsonify(ai_plan)
+    Returns:
+        JSON: 生成完成时返回 200 和计划内容（格式同原 /api/ai/generate-plan），仍在生成时返回 202
+    """
+    job = get_ai_plan_job(job_id, request.user_id)
+    if job is None:
+        return jsonify({"error": "任务不存在"}), 404
+    
+    status = job.status
+    # 生成进程中途退出时任务会一直停留在 pending，超时后按失败返回
+    if (status == 'pending' and datetime.now() - job.created_at >= AI_PLAN_JOB_TIMEOUT
+            and expire_stale_ai_plan_job(job_id)):
+        status = 'failed'
+    if status == 'pending':
+        return jsonify({"job_id": job_id, "status": "pending"}), 202
+    if status == 'failed':
+        return jsonify({"error": "AI生成建议失败，请稍后重试"}), 500
+    return jsonify(job.result)
 
 # ==================== 成就系统API ====================
 
@@ -2081,60 +2961,90 @@ ACHIEVEMENT_DEFINITIONS = {
     "challenge_perfect": {"name": "完美挑战", "icon": "🏅", "description": "单次挑战准确率达到100%"}
 }
 
-def check_achievements(user_id):
-    """检查并解锁用户成就"""
+# 成就接口返回的公共字段，模块加载时按定义顺序生成一次
+ACHIEVEMENT_TEMPLATES = {
+    achievement_id: {
+        "id": achievement_id,
+        "name": definition["name"],
+        "icon": definition["icon"],
+        "description": definition["description"],
+    }
+    for achievement_id, definition in ACHIEVEMENT_DEFINITIONS.items()
+}
+
+ALL_EXERCISE_TYPES = frozenset(('squat', 'pushup', 'plank', 'jumping_jack'))
+
+# 成就解锁条件：(成就ID, 判断函数)，判断函数接收 check_achievements 汇总出的统计数据
+ACHIEVEMENT_CHECKS = (
+    ("first_exercise", lambda s: s['total_sessions'] >= 1),
+    ("exercise_10", lambda s: s['total_sessions'] >= 10),
+    ("exercise_100", lambda s: s['total_sessions'] >= 100),
+    ("streak_3", lambda s: s['current_streak'] >= 3),
+    ("streak_7", lambda s: s['current_streak'] >= 7),
+    ("streak_30", lambda s: s['current_streak'] >= 30),
+    ("squat_100", lambda s: s['exercise_counts'].get('squat', 0) >= 100),
+    ("pushup_100", lambda s: s['exercise_counts'].get('pushup', 0) >= 100),
+    ("accuracy_90", lambda s: s['max_accuracy'] >= 90),
+    ("accuracy_100", lambda s: s['max_accuracy'] >= 100),
+    ("duration_10h", lambda s: s['total_duration'] >= 10),
+    ("all_exercises", lambda s: ALL_EXERCISE_TYPES.issubset(s['exercise_counts'])),
+    # 挑战相关成就
+    ("challenge_first", lambda s: s['total_challenges'] >= 1),
+    ("challenge_7", lambda s: s['total_challenges'] >= 7),
+    ("challenge_30", lambda s: s['total_challenges'] >= 30),
+    ("challenge_streak_3", lambda s: s['challenge_streak'] >= 3),
+    ("challenge_streak_7", lambda s: s['challenge_streak'] >= 7),
+    ("challenge_combo", lambda s: s['has_combo_challenge']),
+)
+
+# 上次完整检查成就时的数据签名：user_id -> (日期, 已完成会话数, 打卡次数, 挑战完成次数)
+# 签名由数据本身算出，各进程分别缓存也不会误判，只影响命中率
+ACHIEVEMENT_SIGNATURE_TTL = 24 * 3600
+achievement_signatures = LocalTTLCache(maxsize=10000, ttl=ACHIEVEMENT_SIGNATURE_TTL)
+
+def check_achievements(user_id, checkin_stats=None):
+    """
+    检查并解锁用户成就
+    checkin_stats: 调用方已经取得的打卡统计，未传入时重新获取
+    """
     try:
-        # 从数据库获取用户会话
-        user_sessions = Session.query.filter(
-            Session.user_id == user_id,
-            Session.status == 'completed'
-        ).all()
+        # 自上次检查以来会话、打卡、挑战记录都没有变化时不可能解锁新成就，跳过完整统计
+        # 连续天数与日期有关，签名中带上当天日期
+        signature = (date.today(), *get_achievement_activity_counts(user_id))
+        if achievement_signatures.get(user_id) == signature:
+            return []
         
-        total_sessions = len(user_sessions)
-        total_count = sum(s.total_count for s in user_sessions)
+        # 用户全部会话在数据库中按运动类型汇总，只取回每种运动一行
+        totals = get_session_totals_by_type(user_id)
+        
+        total_sessions = sum(t['sessions'] for t in totals)
+        total_count = sum(t['total_count'] for t in totals)
         
         # 统计各运动类型
-        exercise_counts = {}
-        for session in user_sessions:
-            ex_type = session.exercise_type
-            exercise_counts[ex_type] = exercise_counts.get(ex_type, 0) + session.total_count
+        exercise_counts = {t['exercise_type']: t['total_count'] for t in totals}
         
         # 统计准确率
-        max_accuracy = 0
-        for session in user_sessions:
-            if session.total_count > 0:
-                # 确保correct_count不超过total_count，准确率不超过100%
-                correct_count = min(session.correct_count or 0, session.total_count)
-                accuracy = min(100, (correct_count / session.total_count) * 100)
-                max_accuracy = max(max_accuracy, accuracy)
-        
-        # 统计总时长
-        total_duration = 0
-        for session in user_sessions:
-            if session.end_time:
-                duration = (session.end_time - session.start_time).total_seconds() / 3600  # 小时
-                total_duration += duration
+        max_accuracy = max((t['max_accuracy'] for t in totals), default=0)
+        
+        # 统计总时长（小时）
+        total_duration = sum(t['duration_seconds'] for t in totals) / 3600
         
         # 获取连续打卡天数
-        checkin_stats = get_user_checkin_stats(user_id)
+        if checkin_stats is None:
+            checkin_stats = cached_checkin_stats(user_id)
         current_streak = checkin_stats.get('current_streak', 0)
         
         # 获取挑战完成记录
         challenge_completions = get_challenge_completions(user_id)
         total_challenges = len(challenge_completions)
         
-        # 计算连续完成挑战天数
+        # 计算连续完成挑战天数（一次取回所有完成日期，再从今天往前数）
+        completion_dates = get_challenge_completion_dates(user_id)
         challenge_streak = 0
-        today = date.today()
-        check_date = today
-        while True:
-            date_str = check_date.isoformat()
-            completions_on_date = get_challenge_completions(user_id, date_str)
-            if completions_on_date:
-                challenge_streak += 1
-                check_date = check_date - timedelta(days=1)
-            else:
-                break
+        check_date = date.today()
+        while check_date in completion_dates:
+            challenge_streak += 1
+            check_date = check_date - timedelta(days=1)
         
         # 检查是否有组合挑战完成记录
         has_combo_challenge = any('combo' in cid for cid in challenge_completions)
@@ -2145,35 +3055,25 @@ def check_achievements(user_id):
         
         new_achievements = []
         
-        # 检查成就
-        checks = [
-            ("first_exercise", total_sessions >= 1),
-            ("exercise_10", total_sessions >= 10),
-            ("exercise_100", total_sessions >= 100),
-            ("streak_3", current_streak >= 3),
-            ("streak_7", current_streak >= 7),
-            ("streak_30", current_streak >= 30),
-            ("squat_100", exercise_counts.get('squat', 0) >= 100),
-            ("pushup_100", exercise_counts.get('pushup', 0) >= 100),
-            ("accuracy_90", max_accuracy >= 90),
-            ("accuracy_100", max_accuracy >= 100),
-            ("duration_10h", total_duration >= 10),
-            ("all_exercises", len([k for k in exercise_counts.keys() if k in ['squat', 'pushup', 'plank', 'jumping_jack']]) >= 4),
-            # 挑战相关成就
-            ("challenge_first", total_challenges >= 1),
-            ("challenge_7", total_challenges >= 7),
-            ("challenge_30", total_challenges >= 30),
-            ("challenge_streak_3", challenge_streak >= 3),
-            ("challenge_streak_7", challenge_streak >= 7),
-            ("challenge_combo", has_combo_challenge)
-        ]
+        stats = {
+            'total_sessions': total_sessions,
+            'current_streak': current_streak,
+            'exercise_counts': exercise_counts,
+            'max_accuracy': max_accuracy,
+            'total_duration': total_duration,
+            'total_challenges': total_challenges,
+            'challenge_streak': challenge_streak,
+            'has_combo_challenge': has_combo_challenge,
+        }
         
-        for achievement_id, condition in checks:
-            if condition and achievement_id not in unlocked_ids:
+        # 检查成就
+        for achievement_id, condition in ACHIEVEMENT_CHECKS:
+            if achievement_id not in unlocked_ids and condition(stats):
                 if unlock_achievement(user_id, achievement_id):
                     new_achievements.append(achievement_id)
                     logger.info(f"用户 {user_id} 解锁成就: {achievement_id}")
         
+        achievement_signatures.set(user_id, signature)
         return new_achievements
     except Exception as e:
         logger.error(f"检查成就失败: {str(e)}", exc_info=True)
@@ -2190,25 +3090,12 @@ def get_user_achievements_api():
         
         # 返回所有成就（已解锁和未解锁）
         result = []
-        for achievement_id, definition in ACHIEVEMENT_DEFINITIONS.items():
-            if achievement_id in user_achievements_dict:
-                achievement_data = user_achievements_dict[achievement_id]
-                result.append({
-                    "id": achievement_id,
-                    "name": definition["name"],
-                    "icon": definition["icon"],
-                    "description": definition["description"],
-                    "unlocked": True,
-                    "unlocked_at": achievement_data.get("unlocked_at")
-                })
+        for achievement_id, template in ACHIEVEMENT_TEMPLATES.items():
+            achievement_data = user_achievements_dict.get(achievement_id)
+            if achievement_data is not None:
+                result.append({**template, "unlocked": True, "unlocked_at": achievement_data.get("unlocked_at")})
             else:
-                result.append({
-                    "id": achievement_id,
-                    "name": definition["name"],
-                    "icon": definition["icon"],
-                    "description": definition["description"],
-                    "unlocked": False
-                })
+                result.append({**template, "unlocked": False})
         
         return jsonify({"achievements": result})
     except Exception as e:
@@ -2229,13 +3116,7 @@ def check_user_achievements():
         result = []
         for achievement_id in new_achievement_ids:
             achievement_data = user_achievements_dict.get(achievement_id, {})
-            result.append({
-                "id": achievement_id,
-                "name": ACHIEVEMENT_DEFINITIONS[achievement_id]["name"],
-                "icon": ACHIEVEMENT_DEFINITIONS[achievement_id]["icon"],
-                "description": ACHIEVEMENT_DEFINITIONS[achievement_id]["description"],
-                "unlocked_at": achievement_data.get("unlocked_at")
-            })
+            result.append({**ACHIEVEMENT_TEMPLATES[achievement_id], "unlocked_at": achievement_data.get("unlocked_at")})
         
         return jsonify({
             "new_achievements": result,
@@ -2247,6 +3128,28 @@ def check_user_achievements():
 
 # ==================== 排行榜API ====================
 
+def build_leaderboard(ranked, field):
+    """
+    构建排行榜条目：用一条查询批量读取上榜用户的用户名和昵称
+    
+    参数:
+        ranked: 按排名排好的 [(user_id, 值)]，排名即列表中的位置，已删除的用户跳过但保留其名次
+        field: 值在条目中的字段名
+    """
+    names = get_user_names([user_id for user_id, _ in ranked])
+    result = []
+    for rank, (user_id, value) in enumerate(ranked, 1):
+        if user_id in names:
+            username, nickname = names[user_id]
+            result.append({
+                "rank": rank,
+                "user_id": user_id,
+                "username": username,
+                "nickname": nickname or username,
+                field: value
+            })
+    return result
+
 @app.route('/api/leaderboard/weekly-count', methods=['GET'])
 @require_auth
 @handle_db_error
@@ -2271,17 +3174,9 @@ def get_weekly_count_leaderboard():
             Session.start_time < week_end
         ).group_by(Session.user_id).order_by(func.sum(Session.total_count).desc()).limit(20).all()
         
-        result = []
-        for rank, (user_id, count) in enumerate(leaderboard_query, 1):
-            user = get_user_by_id(user_id)
-            if user:
-                result.append({
-                    "rank": rank,
-                    "user_id": user_id,
-                    "username": user.username,
-                    "nickname": user.nickname or user.username,
-                    "count": int(count) if count else 0
-                })
+        result = build_leaderboard(
+            [(user_id, int(count) if count else 0) for user_id, count in leaderboard_query], "count"
+        )
         
         return jsonify({"leaderboard": result})
     except Exception as e:
@@ -2299,35 +3194,24 @@ def get_weekly_duration_leaderboard():
         week_start = week_start.replace(hour=0, minute=0, second=0, microsecond=0)
         week_end = week_start + timedelta(days=7)
         
-        # 从数据库查询本周完成的会话
+        # 本周完成的会话按用户汇总时长，排序和截取前20名在数据库中完成
         from sqlalchemy import func
         from database import Session
         
-        sessions = Session.query.filter(
+        total_seconds = func.sum(Session.duration_seconds)
+        leaderboard = db.session.query(
+            Session.user_id,
+            total_seconds
+        ).filter(
             Session.status == 'completed',
             Session.start_time >= week_start,
             Session.start_time < week_end,
-            Session.end_time.isnot(None)
-        ).all()
-        
-        user_durations = {}
-        for session in sessions:
-            duration = (session.end_time - session.start_time).total_seconds() / 60  # 分钟
-            user_durations[session.user_id] = user_durations.get(session.user_id, 0) + duration
-        
-        leaderboard = sorted(user_durations.items(), key=lambda x: x[1], reverse=True)[:20]
+            Session.duration_seconds.isnot(None)
+        ).group_by(Session.user_id).order_by(total_seconds.desc(), Session.user_id).limit(20).all()
         
-        result = []
-        for rank, (user_id, duration) in enumerate(leaderboard, 1):
-            user = get_user_by_id(user_id)
-            if user:
-                result.append({
-                    "rank": rank,
-                    "user_id": user_id,
-                    "username": user.username,
-                    "nickname": user.nickname or user.username,
-                    "duration": round(duration, 2)
-                })
+        result = build_leaderboard(
+            [(user_id, round(seconds / 60, 2)) for user_id, seconds in leaderboard], "duration"  # 分钟
+        )
         
         return jsonify({"leaderboard": result})
     except Exception as e:
@@ -2340,36 +3224,8 @@ def get_weekly_duration_leaderboard():
 def get_streak_leaderboard():
     """获取连续打卡排行榜"""
     try:
-        from database import User
-        
-        # 获取所有用户的打卡统计
-        all_users = User.query.all()
-        user_streaks = []
-        
-        for user in all_users:
-            stats = get_user_checkin_stats(user.user_id)
-            # 使用current_streak，如果为0则使用longest_streak
-            streak = stats['current_streak'] if stats['current_streak'] > 0 else stats['longest_streak']
-            if streak > 0:  # 只显示有打卡记录的用户
-                user_streaks.append({
-                    "user_id": user.user_id,
-                    "streak": streak
-                })
-        
-        user_streaks.sort(key=lambda x: x['streak'], reverse=True)
-        user_streaks = user_streaks[:20]
-        
-        result = []
-        for rank, item in enumerate(user_streaks, 1):
-            user = get_user_by_id(item['user_id'])
-            if user:
-                result.append({
-                    "rank": rank,
-                    "user_id": item['user_id'],
-                    "username": user.username,
-                    "nickname": user.nickname or user.username,
-                    "streak": item['streak']
-                })
+        # 使用current_streak，如果为0则使用longest_streak；只统计有打卡记录的用户
+        result = build_leaderboard(get_streak_leaderboard_rows(20), "streak")
         
         return jsonify({"leaderboard": result})
     except Exception as e:
@@ -2382,42 +3238,31 @@ def get_streak_leaderboard():
 def get_accuracy_leaderboard():
     """获取准确率排行榜"""
     try:
-        from sqlalchemy import func
+        from sqlalchemy import func, cast, Float
         from database import Session
         
         # 计算每个用户的平均准确率（排除平板支撑，因为平板支撑的total_count是秒数）
-        user_stats = db.session.query(
+        # 确保correct_count不超过total_count，准确率不超过100%；排序和截取前20名在数据库中完成
+        total_count = func.sum(Session.total_count)
+        accuracy = func.least(
+            100,
+            cast(func.least(func.coalesce(func.sum(Session.correct_count), 0), total_count), Float)
+            / cast(total_count, Float) * 100
+        ).label('accuracy')
+        leaderboard = db.session.query(
             Session.user_id,
-            func.sum(Session.correct_count).label('total_correct'),
-            func.sum(Session.total_count).label('total_count')
+            accuracy
         ).filter(
             Session.status == 'completed',
             Session.total_count > 0,
             Session.exercise_type != 'plank'  # 排除平板支撑
         ).group_by(Session.user_id).having(
-            func.sum(Session.total_count) > 0
-        ).all()
-        
-        avg_accuracies = {}
-        for user_id, total_correct, total_count in user_stats:
-            if total_count and total_count > 0:
-                # 确保correct_count不超过total_count，准确率不超过100%
-                total_correct = min(total_correct, total_count)
-                avg_accuracies[user_id] = min(100, (total_correct / total_count) * 100)
+            total_count > 0
+        ).order_by(accuracy.desc(), Session.user_id).limit(20).all()
         
-        leaderboard = sorted(avg_accuracies.items(), key=lambda x: x[1], reverse=True)[:20]
-        
-        result = []
-        for rank, (user_id, accuracy) in enumerate(leaderboard, 1):
-            user = get_user_by_id(user_id)
-            if user:
-                result.append({
-                    "rank": rank,
-                    "user_id": user_id,
-                    "username": user.username,
-                    "nickname": user.nickname or user.username,
-                    "accuracy": round(accuracy, 2)
-                })
+        result = build_leaderboard(
+            [(user_id, round(accuracy, 2)) for user_id, accuracy in leaderboard], "accuracy"
+        )
         
         return jsonify({"leaderboard": result})
     except Exception as e:
@@ -2426,6 +3271,16 @@ def get_accuracy_leaderboard():
 
 # ==================== 打卡系统API ====================
 
+def cached_checkin_stats(user_id):
+    """获取用户打卡统计，结果缓存 CHECKIN_STATS_CACHE_TTL 秒，打卡成功后删除"""
+    key = checkin_stats_key(user_id, date.today())
+    cached = cache_get(key)
+    if cached is not None:
+        return orjson.loads(cached)
+    stats = get_user_checkin_stats(user_id)
+    cache_set(key, orjson.dumps(stats), CHECKIN_STATS_CACHE_TTL)
+    return stats
+
 @app.route('/api/checkin', methods=['POST'])
 @require_auth
 @handle_db_error
@@ -2439,15 +3294,16 @@ def checkin():
         if not success:
             return jsonify({
                 "message": "今天已打卡",
-                "current_streak": get_user_checkin_stats(user_id)['current_streak']
+                "current_streak": cached_checkin_stats(user_id)['current_streak']
             }), 200
         
-        # 获取更新后的统计
-        stats = get_user_checkin_stats(user_id)
+        # 获取更新后的统计（打卡前缓存的统计已过时）
+        cache_delete(checkin_stats_key(user_id, date.today()))
+        stats = cached_checkin_stats(user_id)
         
         # 检查成就
         try:
-            check_achievements(user_id)
+            check_achievements(user_id, stats)
         except Exception as e:
             logger.warning(f"检查成就失败: {str(e)}")
         
@@ -2470,7 +3326,7 @@ def get_checkin_streak():
     """获取用户打卡连续天数"""
     try:
         user_id = request.user_id
-        stats = get_user_checkin_stats(user_id)
+        stats = cached_checkin_stats(user_id)
         
         return jsonify({
             "current_streak": stats['current_streak'],
@@ -2490,7 +3346,7 @@ def get_checkin_calendar():
     try:
         user_id = request.user_id
         calendar_data = get_checkin_calendar(user_id, days=90)
-        stats = get_user_checkin_stats(user_id)
+        stats = cached_checkin_stats(user_id)
         
         return jsonify({
             "calendar": calendar_data,
@@ -2520,46 +3376,20 @@ def generate_weekly_report():
         week_start = week_start.replace(hour=0, minute=0, second=0, microsecond=0)
         week_end = week_start + timedelta(days=7)
         
-        # 从数据库查询本周会话
-        from database import Session
-        weekly_sessions = Session.query.filter(
-            Session.user_id == user_id,
-            Session.status == 'completed',
-            Session.start_time >= week_start,
-            Session.start_time < week_end
-        ).all()
-    
-        total_count = sum(s.total_count for s in weekly_sessions)
-        total_duration = 0
-        exercise_counts = {}
-        accuracy_scores = []
+        # 本周会话在数据库中按运动类型汇总
+        totals = get_session_totals_by_type(user_id, week_start, week_end)
         
-        for session in weekly_sessions:
-            if session.end_time:
-                duration = (session.end_time - session.start_time).total_seconds() / 60
-                total_duration += duration
-            
-            ex_type = session.exercise_type
-            exercise_counts[ex_type] = exercise_counts.get(ex_type, 0) + session.total_count
-            
-            if session.total_count > 0:
-                # 确保correct_count不超过total_count，准确率不超过100%
-                correct_count = min(session.correct_count or 0, session.total_count)
-                accuracy = min(100, (correct_count / session.total_count) * 100)
-                accuracy_scores.append(accuracy)
+        total_sessions = sum(t['sessions'] for t in totals)
+        total_count = sum(t['total_count'] for t in totals)
+        total_duration = sum(t['duration_seconds'] for t in totals) / 60
+        exercise_counts = {t['exercise_type']: t['total_count'] for t in totals}
         
-        avg_accuracy = sum(accuracy_scores) / len(accuracy_scores) if accuracy_scores else 0
+        # 平均准确率：有次数的会话的准确率平均值
+        accuracy_sessions = sum(t['accuracy_sessions'] for t in totals)
+        avg_accuracy = sum(t['accuracy_sum'] for t in totals) / accuracy_sessions if accuracy_sessions else 0
         
         # 检查目标完成情况
-        daily_goals = {}
-        if user_plan and user_plan.daily_goals:
-            if isinstance(user_plan.daily_goals, str):
-                try:
-                    daily_goals = json.loads(user_plan.daily_goals)
-                except:
-                    daily_goals = {}
-            else:
-                daily_goals = user_plan.daily_goals
+        daily_goals = (user_plan.daily_goals if user_plan else None) or {}
         
         goal_completion = {}
         for ex_type, count in exercise_counts.items():
@@ -2583,7 +3413,7 @@ def generate_weekly_report():
         report = {
             "period": f"{week_start.strftime('%Y-%m-%d')} 至 {week_end.strftime('%Y-%m-%d')}",
             "summary": {
-                "total_sessions": len(weekly_sessions),
+                "total_sessions": total_sessions,
                 "total_count": total_count,
                 "total_duration": round(total_duration, 2),
                 "avg_accuracy": round(avg_accuracy, 2)
@@ -2614,26 +3444,13 @@ def generate_monthly_report():
         else:
             month_end = today.replace(month=today.month + 1, day=1)
         
-        # 从数据库查询本月会话
-        from database import Session
-        monthly_sessions = Session.query.filter(
-            Session.user_id == user_id,
-            Session.status == 'completed',
-            Session.start_time >= month_start,
-            Session.start_time < month_end
-        ).all()
-        
-        total_count = sum(s.total_count for s in monthly_sessions)
-        total_duration = 0
-        exercise_counts = {}
+        # 本月会话在数据库中按运动类型汇总
+        totals = get_session_totals_by_type(user_id, month_start, month_end)
         
-        for session in monthly_sessions:
-            if session.end_time:
-                duration = (session.end_time - session.start_time).total_seconds() / 60
-                total_duration += duration
-            
-            ex_type = session.exercise_type
-            exercise_counts[ex_type] = exercise_counts.get(ex_type, 0) + session.total_count
+        total_sessions = sum(t['sessions'] for t in totals)
+        total_count = sum(t['total_count'] for t in totals)
+        total_duration = sum(t['duration_seconds'] for t in totals) / 60
+        exercise_counts = {t['exercise_type']: t['total_count'] for t in totals}
         
         # 获取成就
         user_achievements_dict = get_user_achievements(user_id)
@@ -2642,7 +3459,7 @@ def generate_monthly_report():
         report = {
             "month": today.strftime('%Y-%m'),
             "summary": {
-                "total_sessions": len(monthly_sessions),
+                "total_sessions": total_sessions,
                 "total_count": total_count,
                 "total_duration": round(total_duration, 2),
                 "unlocked_achievements": unlocked_achievements
@@ -2659,64 +3476,71 @@ def generate_monthly_report():
 
 # ==================== 每日挑战API ====================
 
-def generate_daily_challenge():
-    """生成每日挑战"""
-    challenges = [
-        {
-            "id": "squat_50",
-            "type": "count",
-            "exercise": "squat",
-            "name": "深蹲挑战",
-            "target": 50,
-            "description": "今天完成50个深蹲",
-            "reward": {"points": 100}
-        },
-        {
-            "id": "pushup_30",
-            "type": "count",
-            "exercise": "pushup",
-            "name": "俯卧撑挑战",
-            "target": 30,
-            "description": "今天完成30个俯卧撑",
-            "reward": {"points": 80}
-        },
-        {
-            "id": "plank_120",
-            "type": "duration",
-            "exercise": "plank",
-            "name": "平板支撑挑战",
-            "target": 120,
-            "description": "平板支撑坚持2分钟",
-            "reward": {"points": 90}
-        },
-        {
-            "id": "combo_challenge",
-            "type": "combo",
-            "exercises": ["squat", "pushup", "jumping_jack"],
-            "name": "组合挑战",
-            "targets": {"squat": 20, "pushup": 15, "jumping_jack": 20},
-            "description": "完成深蹲20次+俯卧撑15次+开合跳20次",
-            "reward": {"points": 150}
-        }
-    ]
-    
-    # 根据日期选择挑战（确保每天相同）
-    today = datetime.now().date()
-    day_of_year = today.timetuple().tm_yday
-    selected_challenge = challenges[day_of_year % len(challenges)]
-    
+# 每日挑战池，按一年中的第几天轮换
+DAILY_CHALLENGES = (
+    {
+        "id": "squat_50",
+        "type": "count",
+        "exercise": "squat",
+        "name": "深蹲挑战",
+        "target": 50,
+        "description": "今天完成50个深蹲",
+        "reward": {"points": 100}
+    },
+    {
+        "id": "pushup_30",
+        "type": "count",
+        "exercise": "pushup",
+        "name": "俯卧撑挑战",
+        "target": 30,
+        "description": "今天完成30个俯卧撑",
+        "reward": {"points": 80}
+    },
+    {
+        "id": "plank_120",
+        "type": "duration",
+        "exercise": "plank",
+        "name": "平板支撑挑战",
+        "target": 120,
+        "description": "平板支撑坚持2分钟",
+        "reward": {"points": 90}
+    },
+    {
+        "id": "combo_challenge",
+        "type": "combo",
+        "exercises": ["squat", "pushup", "jumping_jack"],
+        "name": "组合挑战",
+        "targets": {"squat": 20, "pushup": 15, "jumping_jack": 20},
+        "description": "完成深蹲20次+俯卧撑15次+开合跳20次",
+        "reward": {"points": 150}
+    }
+)
+DAILY_CHALLENGES_BY_ID = {challenge["id"]: challenge for challenge in DAILY_CHALLENGES}
+
+@lru_cache(maxsize=1)
+def daily_challenge_for(day):
+    """某一天的挑战（根据日期选择，确保每天相同），同一天只构建一次"""
+    selected_challenge = DAILY_CHALLENGES[day.timetuple().tm_yday % len(DAILY_CHALLENGES)]
     return {
         **selected_challenge,
-        "date": today.isoformat(),
+        "date": day.isoformat(),
         "available": True
     }
 
+@lru_cache(maxsize=1)
+def daily_challenge_json(day):
+    """某一天的挑战，预先编码为JSON"""
+    return orjson.dumps(daily_challenge_for(day))
+
+def generate_daily_challenge():
+    """生成每日挑战"""
+    return daily_challenge_for(datetime.now().date())
+
 @app.route('/api/challenges/daily', methods=['GET'])
 @require_auth
 def get_daily_challenge():
     """获取今日挑战"""
-    challenge = generate_daily_challenge()
-    return jsonify(challenge)
+    return app.response_class(daily_challenge_json(datetime.now().date()), mimetype='application/json')
 
 def validate_challenge_completion(user_id, challenge_id, challenge_data):
     """
@@ -2731,28 +3555,41 @@ def validate_challenge_completion(user_id, challenge_id, challenge_data):
         tuple: (是否完成, 实际完成值, 目标值)
     """
     today = datetime.now().date()
-    today_start = datetime.combine(today, datetime.min.time())
-    today_end = datetime.combine(today, datetime.max.time())
-    
-    # 查询今天的会话
-    today_sessions = Session.query.filter(
-        Session.user_id == user_id,
-        Session.status == 'completed',
-        Session.start_time >= today_start,
-        Session.start_time <= today_end
-    ).all()
+    today_start = datetime.combine(today, DAY_START_TIME)
+    tomorrow_start = today_start + timedelta(days=1)
     
     challenge_type = challenge_data.get('type')
+    if challenge_type == 'combo':
+        exercises = challenge_data.get('exercises', [])
+    elif challenge_type in ('count', 'duration'):
+        exercises = [challenge_data.get('exercise')]
+    else:
+        return False, 0, 0
+    
+    # 今天相关运动的会话在数据库中按运动类型汇总，每种运动一行：(次数, 时长秒数, 整秒数)
+    # 组合挑战中平板支撑按每次会话的整秒数累加，与逐条 int() 后求和一致
+    today_totals = {
+        ex_type: (int(count or 0), float(seconds or 0), int(whole_seconds or 0))
+        for ex_type, count, seconds, whole_seconds in db.session.query(
+            Session.exercise_type,
+            func.sum(Session.total_count),
+            func.sum(Session.duration_seconds),
+            func.sum(func.trunc(Session.duration_seconds))
+        ).filter(
+            Session.user_id == user_id,
+            Session.status == 'completed',
+            Session.exercise_type.in_(exercises),
+            Session.start_time >= today_start,
+            Session.start_time < tomorrow_start
+        ).group_by(Session.exercise_type)
+    }
     
     if challenge_type == 'count':
         # 计数类挑战：检查指定运动的累计次数
         exercise = challenge_data.get('exercise')
         target = challenge_data.get('target', 0)
         
-        total_count = 0
-        for session in today_sessions:
-            if session.exercise_type == exercise:
-                total_count += session.total_count
+        total_count = today_totals.get(exercise, (0, 0, 0))[0]
         
         completed = total_count >= target
         return completed, total_count, target
@@ -2762,34 +3599,20 @@ def validate_challenge_completion(user_id, challenge_id, challenge_data):
         exercise = challenge_data.get('exercise')
         target = challenge_data.get('target', 0)  # 秒
         
-        total_duration = 0
-        for session in today_sessions:
-            if session.exercise_type == exercise and session.end_time:
-                duration = (session.end_time - session.start_time).total_seconds()
-                total_duration += duration
+        total_duration = today_totals.get(exercise, (0, 0, 0))[1]
         
         completed = total_duration >= target
         return completed, int(total_duration), target
     
-    elif challenge_type == 'combo':
+    else:
         # 组合挑战：检查多个运动是否都达到目标
-        exercises = challenge_data.get('exercises', [])
         targets = challenge_data.get('targets', {})
         
-        exercise_counts = {}
-        for session in today_sessions:
-            ex_type = session.exercise_type
-            if ex_type in exercises:
-                if ex_type == 'plank':
-                    # 平板支撑：使用时长（秒）
-                    if session.end_time:
-                        duration_seconds = int((session.end_time - session.start_time).total_seconds())
-                    else:
-                        duration_seconds = 0
-                    exercise_counts[ex_type] = exercise_counts.get(ex_type, 0) + duration_seconds
-                else:
-                    # 其他运动：使用次数
-                    exercise_counts[ex_type] = exercise_counts.get(ex_type, 0) + session.total_count
+        # 平板支撑使用时长（秒），其他运动使用次数
+        exercise_counts = {
+            ex_type: whole_seconds if ex_type == 'plank' else count
+            for ex_type, (count, _, whole_seconds) in today_totals.items()
+        }
         
         all_completed = True
         for exercise in exercises:
@@ -2798,8 +3621,6 @@ def validate_challenge_completion(user_id, challenge_id, challenge_data):
                 break
         
         return all_completed, exercise_counts, targets
-    
-    return False, 0, 0
 
 @app.route('/api/user/daily_stats', methods=['GET', 'OPTIONS'])
 @require_auth
@@ -2811,15 +3632,17 @@ def get_daily_stats():
     try:
         user_id = request.user_id
         today = datetime.now().date()
-        today_start = datetime.combine(today, datetime.min.time())
-        today_end = datetime.combine(today, datetime.max.time())
+        today_start = datetime.combine(today, DAY_START_TIME)
+        tomorrow_start = today_start + timedelta(days=1)
         
-        # 查询今天的会话
-        today_sessions = Session.query.filter(
+        # 查询今天的会话（只取统计用到的列，不构建完整的ORM对象）
+        today_sessions = db.session.query(
+            Session.exercise_type, Session.total_count, Session.duration_seconds
+        ).filter(
             Session.user_id == user_id,
             Session.status == 'completed',
             Session.start_time >= today_start,
-            Session.start_time <= today_end
+            Session.start_time < tomorrow_start
         ).all()
         
         # 初始化统计
@@ -2834,12 +3657,8 @@ def get_daily_stats():
             ex_type = session.exercise_type
             if ex_type == 'plank':
                 # 平板支撑：累加时长
-                 # 如果 session.calories (duration) 存在，使用它，否则计算时间差
-                 # 这里我们应该使用数据库里可靠的 duration_seconds 或者从 start/end 计算
-                 # 由于我们没有专门的 duration_seconds 字段（除了临时返回），我们用 timedelta
-                 if session.end_time and session.start_time:
-                     duration = (session.end_time - session.start_time).total_seconds()
-                     stats[ex_type] += int(duration)
+                 if session.duration_seconds:
+                     stats[ex_type] += int(session.duration_seconds)
             elif ex_type in stats:
                 stats[ex_type] += (session.total_count or 0)
                 
@@ -2867,15 +3686,8 @@ def complete_challenge_endpoint(challenge_id):
         # 获取挑战数据
         challenge = generate_daily_challenge()
         if challenge.get('id') != challenge_id:
-            # 如果挑战ID不匹配，尝试从挑战列表中找到对应的挑战
-            challenges = [
-                {"id": "squat_50", "type": "count", "exercise": "squat", "target": 50},
-                {"id": "pushup_30", "type": "count", "exercise": "pushup", "target": 30},
-                {"id": "plank_120", "type": "duration", "exercise": "plank", "target": 120},
-                {"id": "combo_challenge", "type": "combo", "exercises": ["squat", "pushup", "jumping_jack"], 
-                 "targets": {"squat": 20, "pushup": 15, "jumping_jack": 20}}
-            ]
-            challenge_data = next((c for c in challenges if c.get('id') == challenge_id), None)
+            # 如果挑战ID不匹配，尝试从挑战池中找到对应的挑战
+            challenge_data = DAILY_CHALLENGES_BY_ID.get(challenge_id)
             if not challenge_data:
                 return jsonify({"error": "挑战不存在"}), 404
         else:
@@ -3047,8 +3859,14 @@ if __name__ == '__main__':
     print("[INFO] Local access: http://localhost:8000")
     print("[INFO] Press Ctrl+C to stop the server")
     
+    # 开发服务器：debug 模式需要显式设置 FLASK_DEBUG=1 开启
+    # 生产环境请使用 gunicorn：gunicorn -c gunicorn.conf.py wsgi:app
+    debug_mode = os.getenv('FLASK_DEBUG') == '1'
+    if debug_mode:
+        print("[INFO] Debug mode enabled (FLASK_DEBUG=1)")
+    
     try:
-        app.run(debug=True, host='0.0.0.0', port=8000, use_reloader=False)
+        app.run(debug=debug_mode, host='0.0.0.0', port=8000, use_reloader=False, threaded=True)
     except Exception as e:
         print(f"[ERROR] Failed to start server: {e}")
         import traceback
@@ -0,0 +1,168 @@
+"""
+缓存层
+基于 Redis 的轻量缓存封装，设置 REDIS_URL 环境变量后启用
+未配置或 Redis 不可用时所有操作退化为空操作，调用方直接回源数据库
+"""
+import os
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+# 用户信息缓存时间（秒），用户资料可能被修改，因此比token短得多
+USER_CACHE_TTL = 60
+
+# AI健身计划缓存时间（秒），相同身体指标生成的计划基本一致，缓存7天
+AI_PLAN_CACHE_TTL = 7 * 24 * 3600
+
+# 打卡统计缓存时间（秒），用户打卡后主动删除
+CHECKIN_STATS_CACHE_TTL = 60
+
+# AI教练对话回复缓存时间（秒），完全相同的对话上下文在1小时内直接返回上次的回复
+CHAT_REPLY_CACHE_TTL = 3600
+
+# 进程内AI计划缓存容量，Redis 未配置时同样生效，有效期与 Redis 缓存一致
+AI_PLAN_LOCAL_CACHE_SIZE = 4096
+
+# 进程内token缓存：容量与有效期上限（秒）
+# 多进程部署时其他进程无法收到注销通知，因此有效期上限决定了注销最迟多久在所有进程生效
+LOCAL_TOKEN_CACHE_SIZE = 4096
+LOCAL_TOKEN_CACHE_TTL = 60
+
+redis_url = os.getenv('REDIS_URL')
+rds = None
+if redis_url:
+    if redis is None:
+        print("[Warning] redis library not found. Please install it via 'pip install redis'")
+    else:
+        # 超时设置得很短：缓存不可用时宁可回源数据库，也不要阻塞请求
+        rds = redis.Redis.from_url(redis_url, socket_timeout=0.5, socket_connect_timeout=0.5)
+        print("[Config] Redis cache enabled")
+
+
+def token_key(token_hash):
+    """token缓存键（使用token的 SHA-256 摘要，Redis 中不出现可直接使用的token）"""
+    return b"tok:" + token_hash
+
+
+def user_key(user_id):
+    """用户信息缓存键"""
+    return f"user:{user_id}"
+
+
+def _bucket(value, step):
+    """把数值归到 step 的整数倍上，未填写时返回 None"""
+    if not value:
+        return None
+    return round(float(value) / step) * step
+
+
+def checkin_stats_key(user_id, today):
+    """打卡统计缓存键，连续天数按当天日期计算，因此键中带上日期"""
+    return f"checkin:stats:{user_id}:{today.isoformat()}"
+
+
+def ai_plan_key(height, weight, age, gender, body_fat, custom_goal):
+    """
+    AI健身计划缓存键
+    身高、体重、年龄取整，体脂按 0.5% 分档，字符串与数值形式的同一输入落到同一个键上，以提高命中率
+    """
+    height = _bucket(height, 1)
+    weight = _bucket(weight, 1)
+    age = _bucket(age, 1)
+    body_fat = _bucket(body_fat, 0.5)
+    return f"ai:plan:{height}:{weight}:{age}:{gender}:{body_fat}:{custom_goal}"
+
+
+def chat_reply_key(payload):
+    """AI教练对话回复缓存键，payload 为序列化后的完整对话上下文（含系统提示词）"""
+    return "chat:reply:" + hashlib.sha256(payload).hexdigest()
+
+
+def cache_get(key):
+    """读取缓存，未命中、未启用或出错时返回 None"""
+    if rds is None:
+        return None
+    try:
+        return rds.get(key)
+    except redis.RedisError as e:
+        logger.warning(f"读取缓存失败: {key} - {str(e)}")
+        return None
+
+
+def cache_set(key, value, ttl):
+    """写入缓存，ttl 单位为秒"""
+    ttl = int(ttl)
+    if rds is None or ttl <= 0:
+        return
+    try:
+        rds.set(key, value, ex=ttl)
+    except redis.RedisError as e:
+        logger.warning(f"写入缓存失败: {key} - {str(e)}")
+
+
+def cache_delete(*keys):
+    """删除缓存"""
+    if rds is None or not keys:
+        return
+    try:
+        rds.delete(*keys)
+    except redis.RedisError as e:
+        logger.warning(f"删除缓存失败: {keys} - {str(e)}")
+
+
+class LocalTTLCache:
+    """
+    进程内 TTL + LRU 缓存
+    不依赖 Redis，命中时连网络往返都省掉；每个条目单独设置过期时间，超出容量时淘汰最久未使用的条目
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """读取缓存，未命中或已过期时返回 None"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            deadline, value = entry
+            if deadline <= time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        """写入缓存，ttl 不超过缓存的有效期上限"""
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        """删除缓存"""
+        with self._lock:
+            self._data.pop(key, None)
+
+
+# token摘要 -> user_id
+local_token_cache = LocalTTLCache(LOCAL_TOKEN_CACHE_SIZE, LOCAL_TOKEN_CACHE_TTL)
+
+# AI计划缓存键 -> AI原始响应文本
+ai_plan_local_cache = LocalTTLCache(AI_PLAN_LOCAL_CACHE_SIZE, AI_PLAN_CACHE_TTL)
@@ -4,7 +4,9 @@
 支持本地开发和服务器部署
 """
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.dialects.postgresql import JSONB
 from datetime import datetime, timedelta, date
+import hashlib
 import json
 
 db = SQLAlchemy()
@@ -87,13 +89,22 @@ class UserProfile(db.Model):
         }
 
 
+# token为32字节随机值，传输时使用hex字符串
+# 数据库只保存其 SHA-256 摘要（固定32字节 bytea），数据库泄露时无法直接拿来登录
+TOKEN_BYTES = 32
+TOKEN_HASH_BYTES = 32
+
+def hash_token(token_raw):
+    """计算token原始字节的 SHA-256 摘要，作为数据库主键和缓存键"""
+    return hashlib.sha256(token_raw).digest()
+
 class Token(db.Model):
     """Token表"""
     __tablename__ = 'tokens'
     
-    token = db.Column(db.String(255), primary_key=True)
+    token_hash = db.Column(db.LargeBinary(TOKEN_HASH_BYTES), primary_key=True)
     user_id = db.Column(db.String(100), db.ForeignKey('users.user_id'), nullable=False)
-    expire_time = db.Column(db.DateTime, nullable=False)
+    expire_time = db.Column(db.DateTime, nullable=False, index=True)  # 索引用于后台批量清理过期token
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 
@@ -103,37 +114,17 @@ class Plan(db.Model):
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.String(100), db.ForeignKey('users.user_id'), unique=True, nullable=False)
-    daily_goals = db.Column(db.Text)  # JSON字符串
-    weekly_goals = db.Column(db.Text)  # JSON字符串
+    daily_goals = db.Column(JSONB)  # 每日目标 {运动类型: 次数/秒数}
+    weekly_goals = db.Column(JSONB)  # 每周目标
     custom_goal = db.Column(db.String(50))  # 用户自定义目标 (weight_loss, muscle_gain, etc.)
     ai_advice = db.Column(db.Text)  # AI生成的建议对话
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     def to_dict(self):
-        daily_goals_data = {}
-        if self.daily_goals:
-            if isinstance(self.daily_goals, str):
-                try:
-                    daily_goals_data = json.loads(self.daily_goals)
-                except:
-                    daily_goals_data = {}
-            else:
-                daily_goals_data = self.daily_goals
-
-        weekly_goals_data = {}
-        if self.weekly_goals:
-            if isinstance(self.weekly_goals, str):
-                try:
-                    weekly_goals_data = json.loads(self.weekly_goals)
-                except:
-                    weekly_goals_data = {}
-            else:
-                weekly_goals_data = self.weekly_goals
-
         return {
-            'daily_goals': daily_goals_data,
-            'weekly_goals': weekly_goals_data,
+            'daily_goals': self.daily_goals or {},
+            'weekly_goals': self.weekly_goals or {},
             'custom_goal': self.custom_goal,
             'ai_advice': self.ai_advice,
             'created_at': self.created_at.isoformat() if self.created_at else None,
@@ -150,28 +141,41 @@ class Session(db.Model):
     exercise_type = db.Column(db.String(50), nullable=False, index=True)
     start_time = db.Column(db.DateTime, nullable=False, index=True)
     end_time = db.Column(db.DateTime, index=True)
+    duration_seconds = db.Column(db.Float)  # 会话时长（秒），结束会话时写入 end_time - start_time，统计时直接求和
     total_count = db.Column(db.Integer, default=0)
     correct_count = db.Column(db.Integer, default=0)
     status = db.Column(db.String(20), default='active', index=True)
-    scores = db.Column(db.Text)  # JSON字符串，存储所有得分记录
+    scores = db.Column(JSONB)  # 旧版得分记录列表（新会话的得分写入 session_scores 表）
+    calories = db.Column(db.Float, default=0.0)  # 估算消耗的卡路里
+    ai_comment = db.Column(db.Text)  # AI训练简评（结束会话后在后台生成）
+    ai_status = db.Column(db.String(20))  # AI简评状态：pending/done
+    
+    # 逐帧得分记录（session_scores 表），按时间顺序；只读，写入走批量插入
+    score_records = db.relationship(
+        'SessionScore',
+        order_by=lambda: (SessionScore.timestamp, SessionScore.id),
+        viewonly=True
+    )
     
     # 添加复合索引以提高查询性能
     __table_args__ = (
-        db.Index('idx_user_status_time', 'user_id', 'status', 'start_time'),
+        # 个人报告、成就和每日挑战按 (user_id, status, start_time 范围) 过滤后按运动类型汇总，
+        # 汇总用到的列都放进索引，只读索引即可完成（index-only scan）
+        db.Index('idx_user_status_time', 'user_id', 'status', 'start_time',
+                 postgresql_include=['exercise_type', 'total_count', 'correct_count', 'duration_seconds']),
         db.Index('idx_user_exercise_time', 'user_id', 'exercise_type', 'start_time'),
+        # 按时间范围统计时只读索引即可得到次数和时长（index-only scan）
+        db.Index('idx_sessions_user_start', 'user_id', 'start_time',
+                 postgresql_include=['total_count', 'duration_seconds']),
+        # 运动类型分布按 (user_id, exercise_type) 分组求和，同样只读索引
+        db.Index('idx_sessions_user_type', 'user_id', 'exercise_type',
+                 postgresql_include=['total_count']),
+        # 周排行榜按时间范围统计所有用户的已完成会话，不按用户过滤
+        db.Index('idx_sessions_status_start', 'status', 'start_time',
+                 postgresql_include=['user_id', 'total_count', 'duration_seconds']),
     )
     
     def to_dict(self):
-        scores_data = []
-        if self.scores:
-            if isinstance(self.scores, str):
-                try:
-                    scores_data = json.loads(self.scores)
-                except:
-                    scores_data = []
-            else:
-                scores_data = self.scores
-
         return {
             'session_id': self.session_id,
             'user_id': self.user_id,
@@ -181,10 +185,42 @@ class Session(db.Model):
             'total_count': self.total_count,
             'correct_count': self.correct_count,
             'status': self.status,
-            'scores': scores_data
+            # 旧会话的得分在 scores 列中，新会话的得分在 session_scores 表中
+            'scores': self.scores or [record.to_dict() for record in self.score_records]
+        }
+
+
+class SessionScore(db.Model):
+    """会话得分记录表（每帧一条，替代 sessions.scores 中不断增长的JSON列表）"""
+    __tablename__ = 'session_scores'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    session_id = db.Column(db.String(255), db.ForeignKey('sessions.session_id', ondelete='CASCADE'), nullable=False, index=True)
+    timestamp = db.Column(db.DateTime, default=datetime.now, nullable=False)
+    score = db.Column(db.Integer, default=0)
+    is_correct = db.Column(db.Boolean, default=False)
+    feedback = db.Column(db.Text)
+    
+    def to_dict(self):
+        return {
+            'timestamp': self.timestamp.isoformat() if self.timestamp else None,
+            'score': self.score,
+            'is_correct': self.is_correct,
+            'feedback': self.feedback
         }
 
 
+class AIPlanJob(db.Model):
+    """AI健身计划生成任务表（后台线程调用AI，前端凭 job_id 轮询结果）"""
+    __tablename__ = 'ai_plan_jobs'
+    
+    job_id = db.Column(db.String(32), primary_key=True)
+    user_id = db.Column(db.String(100), db.ForeignKey('users.user_id', ondelete='CASCADE'), nullable=False, index=True)
+    status = db.Column(db.String(20), default='pending', nullable=False)  # pending / done / failed
+    result = db.Column(JSONB)  # 生成完成后的计划内容
+    created_at = db.Column(db.DateTime, default=datetime.now, nullable=False, index=True)  # 索引用于清理过期任务
+
+
 class UserAchievement(db.Model):
     """用户成就表"""
     __tablename__ = 'user_achievements'
@@ -214,13 +250,9 @@ class Checkin(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.String(100), db.ForeignKey('users.user_id'), nullable=False, index=True)
     checkin_date = db.Column(db.Date, nullable=False, index=True)
-    
-    __table_args__ = (
-        db.UniqueConstraint('user_id', 'checkin_date', name='unique_user_checkin_date'),
-        db.Index('idx_user_checkin_date', 'user_id', 'checkin_date'),
-    )
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    # 唯一约束自带 (user_id, checkin_date) 索引，按日期倒序计算连续打卡时反向扫描即可，无需单独建索引
     __table_args__ = (db.UniqueConstraint('user_id', 'checkin_date', name='unique_user_checkin_date'),)
     
     @staticmethod
@@ -358,15 +390,24 @@ def migrate_from_json(app):
         if os.path.exists(tokens_file):
             with open(tokens_file, 'r', encoding='utf-8') as f:
                 tokens_data = json.load(f)
+                migrated_tokens = 0
                 for token_str, token_data in tokens_data.items():
+                    # 旧版 base64 格式的token无法转换，跳过（用户重新登录即可）
+                    try:
+                        token_raw = bytes.fromhex(token_str)
+                    except ValueError:
+                        continue
+                    if len(token_raw) != TOKEN_BYTES:
+                        continue
+                    migrated_tokens += 1
                     token = Token(
-                        token=token_str,
+                        token_hash=hash_token(token_raw),
                         user_id=token_data.get('user_id'),
                         expire_time=datetime.fromisoformat(token_data.get('expire_time'))
                     )
                     db.session.add(token)
             
-            print(f"✅ 迁移了 {len(tokens_data)} 个token")
+            print(f"✅ 迁移了 {migrated_tokens} 个token")
         
         # 迁移计划数据
         plans_file = 'plans.json'
@@ -376,8 +417,8 @@ def migrate_from_json(app):
                 for user_id, plan_data in plans_data.items():
                     plan = Plan(
                         user_id=user_id,
-                        daily_goals=json.dumps(plan_data.get('daily_goals', {})),
-                        weekly_goals=json.dumps(plan_data.get('weekly_goals', {})),
+                        daily_goals=plan_data.get('daily_goals', {}),
+                        weekly_goals=plan_data.get('weekly_goals', {}),
                         created_at=datetime.fromisoformat(plan_data.get('created_at', datetime.now().isoformat())),
                         updated_at=datetime.fromisoformat(plan_data.get('updated_at', datetime.now().isoformat()))
                     )
@@ -399,12 +440,26 @@ def migrate_from_json(app):
                         end_time=datetime.fromisoformat(session_data.get('end_time')) if session_data.get('end_time') else None,
                         total_count=session_data.get('total_count', 0),
                         correct_count=session_data.get('correct_count', 0),
-                        status=session_data.get('status', 'completed'),
-                        scores=json.dumps(session_data.get('scores', []))
+                        status=session_data.get('status', 'completed')
                     )
+                    if session.end_time:
+                        session.duration_seconds = (session.end_time - session.start_time).total_seconds()
                     db.session.add(session)
+                # 先写入会话，再写入引用会话的得分记录
+                db.session.flush()
+                score_count = 0
+                for session_id, session_data in sessions_data.items():
+                    for score in session_data.get('scores', []):
+                        db.session.add(SessionScore(
+                            session_id=session_id,
+                            timestamp=datetime.fromisoformat(score['timestamp']) if score.get('timestamp') else datetime.now(),
+                            score=score.get('score', 0),
+                            is_correct=score.get('is_correct', False),
+                            feedback=score.get('feedback')
+                        ))
+                        score_count += 1
             
-            print(f"✅ 迁移了 {len(sessions_data)} 个会话")
+            print(f"✅ 迁移了 {len(sessions_data)} 个会话，{score_count} 条得分记录")
         
         # 迁移成就数据
         achievements_file = 'achievements.json'
@@ -3,12 +3,14 @@
 提供与JSON文件操作兼容的接口，底层使用数据库
 包含完整的错误处理和事务管理
 """
-from database import db, User, UserProfile, Token, Plan, Session, UserAchievement, Checkin, ChallengeCompletion
-from datetime import datetime, date
-import json
+from database import db, TOKEN_BYTES, hash_token, User, UserProfile, Token, Plan, Session, AIPlanJob, UserAchievement, Checkin, ChallengeCompletion
+from datetime import datetime, date, timedelta
 import logging
+from sqlalchemy import select, delete, update, text, func, cast, Float, tuple_
+from sqlalchemy.orm import joinedload, selectinload, load_only, defer
 from sqlalchemy.exc import SQLAlchemyError, IntegrityError
 from utils import db_transaction
+from cache import cache_delete, token_key, local_token_cache
 
 logger = logging.getLogger(__name__)
 
@@ -30,12 +32,64 @@ def save_users(users_dict):
 
 def get_user_by_id(user_id):
     """根据ID获取用户"""
-    return User.query.get(user_id)
+    return db.session.get(User, user_id)
+
+def get_user_with_profile(user_id, refresh=False):
+    """
+    根据ID获取用户（用于返回用户信息）
+    个人资料在同一条查询中 JOIN 加载，访问 user.profile 时不再单独查询；不读取密码哈希列
+    refresh 为 True 时即使对象已在会话中也重新查询（如提交后读取最新数据）
+    """
+    return db.session.get(
+        User, user_id,
+        options=[joinedload(User.profile), defer(User.password_hash)],
+        populate_existing=refresh
+    )
+
+def get_user_credentials(user_id):
+    """根据ID获取用户，只加载密码哈希列（用于修改密码）"""
+    return db.session.get(User, user_id, options=[load_only(User.password_hash)])
+
+def get_user_names(user_ids):
+    """
+    批量读取用户名和昵称（一条 IN 查询）
+    
+    Returns:
+        dict: user_id -> (username, nickname)，不存在的用户不包含在内
+    """
+    if not user_ids:
+        return {}
+    rows = db.session.execute(
+        select(User.user_id, User.username, User.nickname).where(User.user_id.in_(user_ids))
+    )
+    return {user_id: (username, nickname) for user_id, username, nickname in rows}
 
 def get_user_by_username(username):
     """根据用户名获取用户"""
     return User.query.filter_by(username=username).first()
 
+def get_user_body_metrics(user_id):
+    """
+    只读取用户资料中的身体指标列，不加载 User/UserProfile 对象
+    
+    Returns:
+        dict: 身体指标（未填写资料时各项为 None），用户不存在时返回 None
+    """
+    stmt = select(
+        UserProfile.height, UserProfile.weight, UserProfile.body_fat,
+        UserProfile.age, UserProfile.gender
+    ).select_from(User).outerjoin(
+        UserProfile, UserProfile.user_id == User.user_id
+    ).where(User.user_id == user_id)
+    row = db.session.execute(stmt).mappings().first()
+    return dict(row) if row is not None else None
+
+def get_user_weight(user_id):
+    """只读取用户资料中的体重，未填写时返回 None"""
+    return db.session.execute(
+        select(UserProfile.weight).where(UserProfile.user_id == user_id)
+    ).scalar()
+
 @db_transaction
 def create_user(user_data):
     """创建新用户"""
@@ -56,7 +110,7 @@ def create_user(user_data):
 def update_user(user_id, user_data):
     """更新用户"""
     try:
-        user = User.query.get(user_id)
+        user = db.session.get(User, user_id)
         if not user:
             raise ValueError(f"用户不存在: {user_id}")
         
@@ -71,12 +125,20 @@ def update_user(user_id, user_data):
 
 # ==================== Token相关 ====================
 
+def parse_token(token_str):
+    """把传输用的hex token转换为数据库中存储的摘要，格式不合法时返回 None"""
+    try:
+        token_raw = bytes.fromhex(token_str)
+    except (ValueError, TypeError):
+        return None
+    return hash_token(token_raw) if len(token_raw) == TOKEN_BYTES else None
+
 def load_tokens():
     """加载所有token（兼容旧接口）"""
     tokens = Token.query.all()
     result = {}
     for token in tokens:
-        result[token.token] = {
+        result[token.token_hash.hex()] = {
             'user_id': token.user_id,
             'expire_time': token.expire_time.isoformat()
         }
@@ -87,12 +149,12 @@ def save_token(token_str, user_id, expire_time):
     """保存token"""
     try:
         # 检查用户是否存在
-        user = User.query.get(user_id)
+        user = db.session.get(User, user_id)
         if not user:
             raise ValueError(f"用户不存在: {user_id}")
         
         token = Token(
-            token=token_str,
+            token_hash=parse_token(token_str),
             user_id=user_id,
             expire_time=expire_time
         )
@@ -110,17 +172,84 @@ def save_token(token_str, user_id, expire_time):
 def delete_token(token_str):
     """删除token"""
     try:
-        deleted = Token.query.filter_by(token=token_str).delete()
+        token_hash = parse_token(token_str)
+        if token_hash is None:
+            logger.warning(f"尝试删除格式不合法的token: {token_str}")
+            return
+        deleted = Token.query.filter_by(token_hash=token_hash).delete()
         if deleted == 0:
             logger.warning(f"尝试删除不存在的token: {token_str}")
+        # 同步清除缓存，避免已删除的token在缓存过期前仍然有效
+        local_token_cache.delete(token_hash)
+        cache_delete(token_key(token_hash))
     except Exception as e:
         logger.error(f"删除token失败: {str(e)}")
         db.session.rollback()
         raise
 
 def get_token(token_str):
-    """获取token"""
-    return Token.query.get(token_str)
+    """获取token，格式不合法时直接返回 None，不查询数据库"""
+    token_hash = parse_token(token_str)
+    if token_hash is None:
+        return None
+    return db.session.get(Token, token_hash)
+
+@db_transaction
+def purge_expired_tokens():
+    """批量删除已过期的token，返回删除数量"""
+    # 过期时间按本地时间存储，这里同样使用本地时间比较
+    result = db.session.execute(delete(Token).where(Token.expire_time < datetime.now()))
+    return result.rowcount
+
+# ==================== AI计划任务相关 ====================
+
+# AI计划任务保留时间，超过后由后台清理线程删除
+AI_PLAN_JOB_RETENTION = timedelta(days=1)
+# 超过该时长仍为 pending 的任务视为生成进程已退出
+AI_PLAN_JOB_TIMEOUT = timedelta(minutes=3)
+
+@db_transaction
+def create_ai_plan_job(job_id, user_id):
+    """创建一个等待生成的AI计划任务"""
+    db.session.add(AIPlanJob(job_id=job_id, user_id=user_id, status='pending'))
+
+@db_transaction
+def finish_ai_plan_job(job_id, result, status='done'):
+    """写入AI计划任务的生成结果"""
+    db.session.execute(
+        update(AIPlanJob)
+        .where(AIPlanJob.job_id == job_id)
+        .values(status=status, result=result)
+    )
+
+def get_ai_plan_job(job_id, user_id):
+    """读取当前用户的AI计划任务，不存在或不属于该用户时返回 None"""
+    return db.session.execute(
+        select(AIPlanJob.status, AIPlanJob.result, AIPlanJob.created_at)
+        .where(AIPlanJob.job_id == job_id, AIPlanJob.user_id == user_id)
+    ).first()
+
+@db_transaction
+def expire_stale_ai_plan_job(job_id):
+    """将超时仍为 pending 的AI计划任务标记为失败，返回是否已标记"""
+    result = db.session.execute(
+        update(AIPlanJob)
+        .where(
+            AIPlanJob.job_id == job_id,
+            AIPlanJob.status == 'pending',
+            AIPlanJob.created_at < datetime.now() - AI_PLAN_JOB_TIMEOUT,
+        )
+        .values(status='failed')
+    )
+    return result.rowcount > 0
+
+@db_transaction
+def purge_expired_ai_plan_jobs():
+    """批量删除过期的AI计划任务，返回删除数量"""
+    result = db.session.execute(
+        delete(AIPlanJob).where(AIPlanJob.created_at < datetime.now() - AI_PLAN_JOB_RETENTION)
+    )
+    return result.rowcount
 
 # ==================== 计划相关 ====================
 
@@ -146,7 +275,7 @@ def save_user_plan(user_id, plan_data):
     """保存用户计划"""
     try:
         # 验证用户是否存在
-        user = User.query.get(user_id)
+        user = db.session.get(User, user_id)
         if not user:
             raise ValueError(f"用户不存在: {user_id}")
         
@@ -158,8 +287,8 @@ def save_user_plan(user_id, plan_data):
         
         plan = Plan.query.filter_by(user_id=user_id).first()
         if plan:
-            plan.daily_goals = json.dumps(daily_goals)
-            plan.weekly_goals = json.dumps(weekly_goals)
+            plan.daily_goals = daily_goals
+            plan.weekly_goals = weekly_goals
             if custom_goal:
                 plan.custom_goal = custom_goal
             if ai_advice:
@@ -168,8 +297,8 @@ def save_user_plan(user_id, plan_data):
         else:
             plan = Plan(
                 user_id=user_id,
-                daily_goals=json.dumps(daily_goals),
-                weekly_goals=json.dumps(weekly_goals),
+                daily_goals=daily_goals,
+                weekly_goals=weekly_goals,
                 custom_goal=custom_goal,
                 ai_advice=ai_advice
             )
@@ -188,7 +317,7 @@ def save_user_plan(user_id, plan_data):
 
 def load_sessions():
     """加载所有会话（兼容旧接口）"""
-    sessions = Session.query.all()
+    sessions = Session.query.options(selectinload(Session.score_records)).all()
     result = {}
     for session in sessions:
         result[session.session_id] = session.to_dict()
@@ -196,7 +325,7 @@ def load_sessions():
 
 def get_session(session_id):
     """获取会话"""
-    session = Session.query.get(session_id)
+    session = db.session.get(Session, session_id)
     return session.to_dict() if session else None
 
 @db_transaction
@@ -211,7 +340,7 @@ def create_session(session_data):
     # 验证用户是否存在（允许匿名用户）
     user_id = session_data['user_id']
     if user_id != 'anonymous':
-        user = User.query.get(user_id)
+        user = db.session.get(User, user_id)
         if not user:
             logger.warning(f"用户不存在: {user_id}，但允许创建会话")
     
@@ -228,7 +357,7 @@ def create_session(session_data):
         total_count=session_data.get('total_count', 0),
         correct_count=session_data.get('correct_count', 0),
         status=session_data.get('status', 'active'),
-        scores=json.dumps(session_data.get('scores', []))
+        scores=session_data.get('scores', [])
     )
     db.session.add(session)
     logger.info(f"准备创建会话: {session_data['session_id']}")
@@ -238,12 +367,13 @@ def create_session(session_data):
 def update_session(session_id, session_data):
     """更新会话"""
     try:
-        session = Session.query.get(session_id)
+        session = db.session.get(Session, session_id)
         if not session:
             raise ValueError(f"会话不存在: {session_id}")
         
         if 'end_time' in session_data:
             session.end_time = datetime.fromisoformat(session_data['end_time']) if session_data['end_time'] and isinstance(session_data['end_time'], str) else session_data['end_time']
+            session.duration_seconds = (session.end_time - session.start_time).total_seconds() if session.end_time else None
         if 'total_count' in session_data:
             session.total_count = max(0, int(session_data['total_count']))  # 确保非负
         if 'correct_count' in session_data:
@@ -253,7 +383,7 @@ def update_session(session_id, session_data):
                 raise ValueError(f"无效的状态: {session_data['status']}")
             session.status = session_data['status']
         if 'scores' in session_data:
-            session.scores = json.dumps(session_data['scores'])
+            session.scores = session_data['scores']
         
         return session
     except (ValueError, TypeError) as e:
@@ -265,16 +395,109 @@ def update_session(session_id, session_data):
         db.session.rollback()
         raise
 
+# 会话列表和历史记录只需要这些列，不读取 scores 等大字段
+HISTORY_COLUMNS = (
+    Session.session_id, Session.user_id, Session.exercise_type,
+    Session.start_time, Session.end_time,
+    Session.total_count, Session.correct_count, Session.status,
+    Session.calories
+)
+
+def _history_rows_to_dicts(stmt):
+    """执行只含 HISTORY_COLUMNS 的查询，转换为字典列表（时间转为ISO格式）"""
+    sessions = []
+    for row in db.session.execute(stmt).mappings():
+        session = dict(row)
+        session['start_time'] = row['start_time'].isoformat() if row['start_time'] else None
+        session['end_time'] = row['end_time'].isoformat() if row['end_time'] else None
+        sessions.append(session)
+    return sessions
+
 def get_user_sessions(user_id, limit=None, exercise_type=None):
-    """获取用户会话"""
-    query = Session.query.filter_by(user_id=user_id)
+    """获取用户会话（只查询列表需要的列）"""
+    stmt = select(*HISTORY_COLUMNS).where(Session.user_id == user_id)
     if exercise_type:
-        query = query.filter_by(exercise_type=exercise_type)
-    query = query.order_by(Session.start_time.desc())
+        stmt = stmt.where(Session.exercise_type == exercise_type)
+    stmt = stmt.order_by(Session.start_time.desc())
     if limit:
-        query = query.limit(limit)
-    sessions = query.all()
-    return [s.to_dict() for s in sessions]
+        stmt = stmt.limit(limit)
+    return _history_rows_to_dicts(stmt)
+
+def get_user_session_history(user_id, limit, exercise_type=None, before=None):
+    """
+    获取用户历史会话（只读，按开始时间、会话ID倒序，游标分页）
+    
+    Args:
+        before: 上一页最后一条会话的 (开始时间, 会话ID)，只返回排在它之后的会话，用于翻页
+    
+    Returns:
+        tuple: (会话列表, 下一页游标)，游标格式为 "开始时间ISO,会话ID"，没有更多数据时为 None
+    """
+    stmt = select(*HISTORY_COLUMNS).where(Session.user_id == user_id)
+    if exercise_type:
+        stmt = stmt.where(Session.exercise_type == exercise_type)
+    if before:
+        # 开始时间可能相同，按 (开始时间, 会话ID) 行比较，翻页时不会跳过或重复同一时刻的会话
+        stmt = stmt.where(tuple_(Session.start_time, Session.session_id) < tuple_(*before))
+    stmt = stmt.order_by(Session.start_time.desc(), Session.session_id.desc()).limit(limit)
+    sessions = _history_rows_to_dicts(stmt)
+    
+    next_cursor = None
+    if len(sessions) == limit:
+        next_cursor = f"{sessions[-1]['start_time']},{sessions[-1]['session_id']}"
+    return sessions, next_cursor
+
+# 单次会话准确率（%）：正确数不超过总数，按 (正确数 / 总数) × 100 计算（与 Python 中的浮点运算顺序一致）
+SESSION_ACCURACY = func.least(
+    100,
+    cast(func.least(func.coalesce(Session.correct_count, 0), Session.total_count), Float)
+    / cast(func.nullif(Session.total_count, 0), Float) * 100
+)
+
+def get_session_totals_by_type(user_id, start=None, end=None):
+    """
+    在数据库中按运动类型汇总用户已完成的会话，不把会话逐行读到 Python
+    
+    Args:
+        start, end: 只统计开始时间在 [start, end) 内的会话，不传则统计全部
+    
+    Returns:
+        list: 每种运动类型一个字典
+            - exercise_type, sessions: 会话数, total_count: 总次数
+            - duration_seconds: 已结束会话的总时长（秒）
+            - accuracy_sum / accuracy_sessions: 有次数的会话的准确率之和与会话数
+            - max_accuracy: 单次最高准确率
+    """
+    has_count = Session.total_count > 0
+    stmt = select(
+        Session.exercise_type,
+        func.count().label('sessions'),
+        func.coalesce(func.sum(Session.total_count), 0).label('total_count'),
+        func.sum(Session.duration_seconds).label('duration_seconds'),
+        func.sum(SESSION_ACCURACY).filter(has_count).label('accuracy_sum'),
+        func.count().filter(has_count).label('accuracy_sessions'),
+        func.max(SESSION_ACCURACY).filter(has_count).label('max_accuracy'),
+    ).where(
+        Session.user_id == user_id,
+        Session.status == 'completed'
+    ).group_by(Session.exercise_type)
+    if start is not None:
+        stmt = stmt.where(Session.start_time >= start)
+    if end is not None:
+        stmt = stmt.where(Session.start_time < end)
+    
+    return [
+        {
+            'exercise_type': row.exercise_type,
+            'sessions': row.sessions,
+            'total_count': int(row.total_count),
+            'duration_seconds': float(row.duration_seconds or 0),
+            'accuracy_sum': float(row.accuracy_sum or 0),
+            'accuracy_sessions': row.accuracy_sessions,
+            'max_accuracy': float(row.max_accuracy or 0),
+        }
+        for row in db.session.execute(stmt)
+    ]
 
 # ==================== 成就相关 ====================
 
@@ -298,7 +521,7 @@ def unlock_achievement(user_id, achievement_id, unlocked_at=None):
     """解锁成就"""
     try:
         # 验证用户是否存在
-        user = User.query.get(user_id)
+        user = db.session.get(User, user_id)
         if not user:
             raise ValueError(f"用户不存在: {user_id}")
         
@@ -336,12 +559,42 @@ def get_user_checkin_stats(user_id):
     """获取用户打卡统计"""
     return Checkin.get_user_checkin_stats(user_id)
 
+# 连续打卡排行（gaps-and-islands）：同一用户按日期排序后，日期减去行号相同的打卡属于同一段连续打卡
+# 今天打过卡的用户取包含今天的这一段（当前连续天数），否则取最长的一段，与 get_user_checkin_stats 的口径一致
+STREAK_LEADERBOARD_SQL = text("""
+    WITH runs AS (
+        SELECT user_id, checkin_date,
+               checkin_date - CAST(ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY checkin_date) AS INTEGER) AS grp
+        FROM checkins
+    ), islands AS (
+        SELECT user_id, COUNT(*) AS length, MAX(checkin_date) AS last_date
+        FROM runs
+        GROUP BY user_id, grp
+    ), streaks AS (
+        SELECT user_id,
+               CASE WHEN MAX(last_date) = :today
+                    THEN MAX(length) FILTER (WHERE last_date = :today)
+                    ELSE MAX(length)
+               END AS streak
+        FROM islands
+        GROUP BY user_id
+    )
+    SELECT user_id, streak FROM streaks
+    ORDER BY streak DESC, user_id
+    LIMIT :limit
+""")
+
+def get_streak_leaderboard_rows(limit=20):
+    """一条SQL算出所有用户的连续打卡天数并排序，返回 [(user_id, 连续天数)]"""
+    rows = db.session.execute(STREAK_LEADERBOARD_SQL, {"today": date.today(), "limit": limit})
+    return [(user_id, int(streak)) for user_id, streak in rows]
+
 @db_transaction
 def add_checkin(user_id, checkin_date=None):
     """添加打卡记录"""
     try:
         # 验证用户是否存在
-        user = User.query.get(user_id)
+        user = db.session.get(User, user_id)
         if not user:
             raise ValueError(f"用户不存在: {user_id}")
         
@@ -373,23 +626,22 @@ def add_checkin(user_id, checkin_date=None):
         raise
 
 def get_checkin_calendar(user_id, days=90):
-    """获取打卡日历"""
-    from datetime import timedelta
+    """获取打卡日历（最近 days 天每天是否打卡），只查询打卡日期一列"""
     today = date.today()
     start_date = today - timedelta(days=days)
     
-    checkins = Checkin.query.filter(
-        Checkin.user_id == user_id,
-        Checkin.checkin_date >= start_date
-    ).all()
-    
-    checkin_dates = {c.checkin_date.isoformat(): True for c in checkins}
+    checkin_dates = set(db.session.execute(
+        select(Checkin.checkin_date).where(
+            Checkin.user_id == user_id,
+            Checkin.checkin_date >= start_date
+        )
+    ).scalars())
     
     # 生成所有日期
     calendar = {}
     for i in range(days):
         d = today - timedelta(days=i)
-        calendar[d.isoformat()] = d.isoformat() in checkin_dates
+        calendar[d.isoformat()] = d in checkin_dates
     
     return calendar
 
@@ -408,12 +660,36 @@ def get_challenge_completions(user_id, date_str=None):
     
     return [c.challenge_id for c in completions]
 
+def get_achievement_activity_counts(user_id):
+    """
+    成就相关数据的变化标记：(已完成会话数, 打卡次数, 挑战完成次数)
+    三个计数都走 user_id 索引，一条查询返回
+    """
+    row = db.session.execute(select(
+        select(func.count()).select_from(Session)
+        .where(Session.user_id == user_id, Session.status == 'completed').scalar_subquery(),
+        select(func.count()).select_from(Checkin)
+        .where(Checkin.user_id == user_id).scalar_subquery(),
+        select(func.count()).select_from(ChallengeCompletion)
+        .where(ChallengeCompletion.user_id == user_id).scalar_subquery(),
+    )).one()
+    return tuple(row)
+
+def get_challenge_completion_dates(user_id):
+    """获取用户有挑战完成记录的所有日期（去重），一条查询返回"""
+    rows = db.session.execute(
+        select(ChallengeCompletion.completion_date)
+        .where(ChallengeCompletion.user_id == user_id)
+        .distinct()
+    )
+    return {completion_date for completion_date, in rows}
+
 @db_transaction
 def complete_challenge(user_id, challenge_id, completion_date=None):
     """完成挑战"""
     try:
         # 验证用户是否存在
-        user = User.query.get(user_id)
+        user = db.session.get(User, user_id)
         if not user:
             raise ValueError(f"用户不存在: {user_id}")
         
@@ -11,9 +11,8 @@ import random
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 from app import app
-from database import db, Session, User, ChallengeCompletion, Checkin, UserAchievement
+from database import db, Session, SessionScore, User, ChallengeCompletion, Checkin, UserAchievement
 from db_adapter import create_session, update_session, complete_challenge, add_checkin, unlock_achievement
-import json
 
 def generate_test_sessions(user_id, days=30, start_date=None):
     """生成过去N天的会话数据"""
@@ -66,18 +65,19 @@ def generate_test_sessions(user_id, days=30, start_date=None):
                 duration_seconds = random.randint(60, 600)
                 end_time = start_time + timedelta(seconds=duration_seconds)
             
-            # 生成分数记录
+            session_id = f"{user_id}_{session_date.strftime('%Y%m%d')}_{session_num}"
+            
+            # 生成分数记录（写入 session_scores 表）
             scores = []
             for i in range(total_count if total_count > 0 else 1):
                 scores.append({
-                    "timestamp": (start_time + timedelta(seconds=i*5)).isoformat(),
+                    "session_id": session_id,
+                    "timestamp": start_time + timedelta(seconds=i*5),
                     "score": random.randint(70, 100),
                     "is_correct": i < correct_count if total_count > 0 else True,
                     "feedback": "动作标准" if random.random() > 0.3 else "需要改进"
                 })
             
-            session_id = f"{user_id}_{session_date.strftime('%Y%m%d')}_{session_num}"
-            
             try:
                 session_data = {
                     "session_id": session_id,
@@ -86,8 +86,7 @@ def generate_test_sessions(user_id, days=30, start_date=None):
                     "start_time": start_time.isoformat(),
                     "total_count": total_count,
                     "correct_count": correct_count,
-                    "status": "completed",
-                    "scores": scores
+                    "status": "completed"
                 }
                 
                 # 创建会话
@@ -95,11 +94,12 @@ def generate_test_sessions(user_id, days=30, start_date=None):
                 db.session.commit()
                 
                 # 更新结束时间和分数
-                session_obj = Session.query.get(session_id)
+                session_obj = db.session.get(Session, session_id)
                 if session_obj:
                     session_obj.end_time = end_time
+                    session_obj.duration_seconds = (end_time - start_time).total_seconds()
                     session_obj.status = 'completed'
-                    session_obj.scores = json.dumps(scores)
+                    db.session.bulk_insert_mappings(SessionScore, scores)
                     db.session.commit()
                 
                 sessions_created += 1
@@ -195,7 +195,7 @@ def generate_all_test_data(user_id=None, days=30, start_date=None):
             user_id = user.user_id
             print(f"📝 使用用户: {user.username} ({user_id})")
         else:
-            user = User.query.get(user_id)
+            user = db.session.get(User, user_id)
             if not user:
                 print(f"❌ 用户不存在: {user_id}")
                 return
@@ -0,0 +1,37 @@
+"""
+gunicorn 配置
+    gunicorn -c gunicorn.conf.py wsgi:app
+"""
+import multiprocessing
+import os
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+
+# 每个CPU核心一个进程，进程内使用线程处理并发请求（AI接口大部分时间在等待网络）
+workers = int(os.getenv('GUNICORN_WORKERS', multiprocessing.cpu_count()))
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+
+# GUNICORN_WORKER_CLASS=gevent 时每个进程用协程处理请求，
+# 等待AI接口的连接不再占用线程，单进程可同时挂起的连接数由 worker_connections 决定
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', 1000))
+
+
+def post_fork(server, worker):
+    """
+    gevent 进程中让 psycopg2 等待数据库时同样让出协程
+    必须在 fork 后、worker 加载 app 之前执行：wait callback 只对之后新建的连接生效，
+    而 app 导入时就可能建立连接（后台建表线程），post_worker_init 在加载 app 之后才调用，为时已晚
+    """
+    if worker_class != 'gevent':
+        return
+    try:
+        from psycogreen.gevent import patch_psycopg
+    except ImportError:
+        worker.log.warning("psycogreen not found, database queries will block the gevent worker")
+        return
+    patch_psycopg()
+
+# AI接口可能需要较长时间（智谱API超时30-60秒）
+timeout = 90
+keepalive = 5
@@ -13,6 +13,11 @@ import math
 import logging
 from typing import Dict, List, Tuple, Any
 
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
 # 配置日志
 logging.basicConfig(
     level=logging.INFO,
@@ -20,6 +25,38 @@ logging.basicConfig(
 )
 logger = logging.getLogger('pose_analyzer')
 
+# ==================== 数值计算内核 ====================
+# 安装了 numba 时编译为机器码，否则直接以纯 Python 运行，结果一致
+
+def _angle_kernel(ax, ay, bx, by, cx, cy):
+    """三个点形成的角度（度），b是角度的顶点；向量长度为0时返回180度"""
+    bax = ax - bx
+    bay = ay - by
+    bcx = cx - bx
+    bcy = cy - by
+    length = math.sqrt(bax**2 + bay**2) * math.sqrt(bcx**2 + bcy**2)
+    if length == 0.0:
+        return 180.0
+    # 防止浮点数计算导致的越界
+    cos_angle = max(min((bax * bcx + bay * bcy) / length, 1.0), -1.0)
+    return math.degrees(math.acos(cos_angle))
+
+def _distance_kernel(ax, ay, bx, by):
+    """两点之间的距离"""
+    dx = ax - bx
+    dy = ay - by
+    return math.sqrt(dx**2 + dy**2)
+
+if njit is not None:
+    angle_kernel = njit(cache=True)(_angle_kernel)
+    distance_kernel = njit(cache=True)(_distance_kernel)
+    # 导入时预热，避免第一帧承担JIT编译耗时
+    angle_kernel(0.0, 1.0, 0.0, 0.0, 1.0, 0.0)
+    distance_kernel(0.0, 0.0, 1.0, 1.0)
+else:
+    angle_kernel = _angle_kernel
+    distance_kernel = _distance_kernel
+
 class PoseAnalyzer:
     """姿态分析基类"""
     
@@ -69,29 +106,11 @@ class PoseAnalyzer:
         Returns:
             float: 角度（度）
         """
-        # 计算向量
-        ba = [a['x'] - b['x'], a['y'] - b['y']]
-        bc = [c['x'] - b['x'], c['y'] - b['y']]
-        
-        # 计算点积
-        dot_product = ba[0] * bc[0] + ba[1] * bc[1]
-        
-        # 计算向量长度
-        ba_length = math.sqrt(ba[0]**2 + ba[1]**2)
-        bc_length = math.sqrt(bc[0]**2 + bc[1]**2)
-        
-        # 计算夹角（弧度）
-        try:
-            cos_angle = dot_product / (ba_length * bc_length)
-            # 防止浮点数计算导致的越界
-            cos_angle = max(min(cos_angle, 1.0), -1.0)
-            angle_rad = math.acos(cos_angle)
-            
-            # 转换为角度
-            angle_deg = math.degrees(angle_rad)
-            return angle_deg
-        except (ZeroDivisionError, ValueError):
-            return 180.0  # 如果计算出错，返回180度
+        return angle_kernel(
+            float(a['x']), float(a['y']),
+            float(b['x']), float(b['y']),
+            float(c['x']), float(c['y'])
+        )
     
     def calculate_distance(self, a: Dict, b: Dict) -> float:
         """
@@ -103,7 +122,7 @@ class PoseAnalyzer:
         Returns:
             float: 距离
         """
-        return math.sqrt((a['x'] - b['x'])**2 + (a['y'] - b['y'])**2)
+        return distance_kernel(float(a['x']), float(a['y']), float(b['x']), float(b['y']))
 
 class SquatAnalyzer(PoseAnalyzer):
     """深蹲动作分析器"""
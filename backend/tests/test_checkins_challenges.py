@@ -0,0 +1,83 @@
+"""连续打卡排行SQL与每日挑战完成校验"""
+import random
+from datetime import date, datetime, timedelta
+
+from database import db, Checkin
+from db_adapter import get_streak_leaderboard_rows, get_user_checkin_stats
+from app import validate_challenge_completion, DAY_START_TIME
+
+
+def python_streak(user_id):
+    """原来逐个用户在 Python 中计算的连续天数：今天打过卡取当前连续天数，否则取最长连续天数"""
+    stats = get_user_checkin_stats(user_id)
+    return stats['current_streak'] if stats['current_streak'] > 0 else stats['longest_streak']
+
+
+def test_streak_leaderboard_sql_matches_python_logic(make_user):
+    rng = random.Random(20240501)
+    today = date.today()
+    user_ids = [f'user{i:02d}' for i in range(25)]
+    for user_id in user_ids:
+        make_user(user_id)
+        # 最近60天内随机打卡，部分用户今天打卡，部分用户没有任何打卡
+        density = rng.choice([0, 0.3, 0.7, 1.0])
+        days = {offset for offset in range(60) if rng.random() < density}
+        for offset in days:
+            db.session.add(Checkin(user_id=user_id, checkin_date=today - timedelta(days=offset)))
+    db.session.commit()
+
+    expected = {user_id: python_streak(user_id) for user_id in user_ids}
+    expected = {user_id: streak for user_id, streak in expected.items() if streak > 0}
+
+    rows = get_streak_leaderboard_rows(limit=len(user_ids))
+    assert dict(rows) == expected
+    assert [streak for _, streak in rows] == sorted(expected.values(), reverse=True)
+
+
+def test_streak_leaderboard_current_streak_beats_longer_past_run(make_user):
+    today = date.today()
+    make_user('a')
+    make_user('b')
+    # a：以前连续5天，今天开始新的2天；b：以前连续3天，今天没有打卡
+    for offset in [0, 1, 10, 11, 12, 13, 14]:
+        db.session.add(Checkin(user_id='a', checkin_date=today - timedelta(days=offset)))
+    for offset in [5, 6, 7]:
+        db.session.add(Checkin(user_id='b', checkin_date=today - timedelta(days=offset)))
+    db.session.commit()
+
+    assert get_streak_leaderboard_rows() == [('b', 3), ('a', 2)]
+    assert get_streak_leaderboard_rows(limit=1) == [('b', 3)]
+
+
+def test_validate_challenge_completion(make_session):
+    now = datetime.now()
+    today_start = datetime.combine(now.date(), DAY_START_TIME)
+
+    make_session('squat-1', today_start + timedelta(minutes=1), exercise_type='squat', total_count=30, status='completed')
+    make_session('squat-2', today_start + timedelta(minutes=2), exercise_type='squat', total_count=25, status='completed')
+    make_session('plank-1', today_start + timedelta(minutes=3), exercise_type='plank', duration_seconds=40.9, status='completed')
+    make_session('plank-2', today_start + timedelta(minutes=4), exercise_type='plank', duration_seconds=20.6, status='completed')
+    # 以下会话都不计入：昨天的、未完成的、其他用户的
+    make_session('squat-old', today_start - timedelta(minutes=1), exercise_type='squat', total_count=100, status='completed')
+    make_session('squat-active', today_start + timedelta(minutes=5), exercise_type='squat', total_count=100, status='active')
+    make_session('squat-other', today_start + timedelta(minutes=6), exercise_type='squat', total_count=100, user_id='u2', status='completed')
+
+    count_challenge = {"type": "count", "exercise": "squat", "target": 50}
+    assert validate_challenge_completion('u1', 'c', count_challenge) == (True, 55, 50)
+    assert validate_challenge_completion('u1', 'c', {**count_challenge, "target": 60}) == (False, 55, 60)
+
+    duration_challenge = {"type": "duration", "exercise": "plank", "target": 60}
+    assert validate_challenge_completion('u1', 'c', duration_challenge) == (True, 61, 60)
+    assert validate_challenge_completion('u1', 'c', {**duration_challenge, "target": 62}) == (False, 61, 62)
+
+    # 组合挑战中平板支撑按每次会话的整秒数累加：40 + 20 = 60
+    combo = {"type": "combo", "exercises": ["squat", "plank", "pushup"],
+             "targets": {"squat": 50, "plank": 60}}
+    assert validate_challenge_completion('u1', 'c', combo) == (True, {"squat": 55, "plank": 60}, combo["targets"])
+    combo_missing = {**combo, "targets": {"squat": 50, "plank": 60, "pushup": 1}}
+    assert validate_challenge_completion('u1', 'c', combo_missing)[0] is False
+    combo_plank = {**combo, "targets": {"plank": 61}}
+    assert validate_challenge_completion('u1', 'c', combo_plank)[0] is False
+
+    assert validate_challenge_completion('u1', 'c', {"type": "unknown"}) == (False, 0, 0)
+    assert validate_challenge_completion('u2', 'c', count_challenge) == (True, 100, 50)
@@ -0,0 +1,68 @@
+"""密码哈希与校验：argon2id / PBKDF2 / 旧版 sha256，以及登录后的升级判断"""
+import hashlib
+
+import pytest
+
+import app as app_module
+from app import hash_password, verify_password, pbkdf2_hash, PBKDF2_PREFIX, PBKDF2_ITERATIONS
+
+
+def make_pbkdf2_hash(password, iterations):
+    salt = bytes(range(16))
+    return f"{PBKDF2_PREFIX}{iterations}${salt.hex()}${pbkdf2_hash(password, salt, iterations)}"
+
+
+requires_argon2 = pytest.mark.skipif(app_module.password_hasher is None, reason="未安装 argon2-cffi")
+
+
+@requires_argon2
+def test_argon2_hash_roundtrip():
+    stored = hash_password('secret-pw')
+    assert stored.startswith(app_module.ARGON2_PREFIX)
+    assert verify_password('secret-pw', stored) == (True, False)
+    assert verify_password('wrong-pw', stored) == (False, False)
+
+
+@requires_argon2
+def test_argon2_hash_with_old_parameters_needs_rehash():
+    from argon2 import PasswordHasher
+    stored = PasswordHasher(memory_cost=8192, time_cost=1, parallelism=1).hash('secret-pw')
+    assert verify_password('secret-pw', stored) == (True, True)
+
+
+def test_pbkdf2_hash_roundtrip(monkeypatch):
+    monkeypatch.setattr(app_module, 'password_hasher', None)
+    stored = hash_password('secret-pw')
+    assert stored.startswith(PBKDF2_PREFIX)
+    # 每次哈希使用新的盐
+    assert stored != hash_password('secret-pw')
+    assert verify_password('secret-pw', stored) == (True, False)
+    assert verify_password('wrong-pw', stored) == (False, False)
+
+
+def test_pbkdf2_with_fewer_iterations_needs_rehash(monkeypatch):
+    monkeypatch.setattr(app_module, 'password_hasher', None)
+    stored = make_pbkdf2_hash('secret-pw', 1000)
+    assert verify_password('secret-pw', stored) == (True, True)
+    assert verify_password('wrong-pw', stored) == (False, False)
+
+
+@requires_argon2
+def test_pbkdf2_upgraded_to_argon2_when_available():
+    stored = make_pbkdf2_hash('secret-pw', PBKDF2_ITERATIONS)
+    assert verify_password('secret-pw', stored) == (True, True)
+
+
+def test_malformed_pbkdf2_hash_rejected():
+    assert verify_password('secret-pw', PBKDF2_PREFIX + 'not-a-number$zz$00') == (False, False)
+
+
+def test_legacy_sha256_hash_matches_and_needs_rehash():
+    stored = hashlib.sha256(b'secret-pw').hexdigest()
+    assert verify_password('secret-pw', stored) == (True, True)
+    assert verify_password('wrong-pw', stored) == (False, False)
+
+
+def test_empty_hash_rejected():
+    assert verify_password('secret-pw', None) == (False, False)
+    assert verify_password('secret-pw', '') == (False, False)
@@ -0,0 +1,133 @@
+"""运动会话：批量提交帧数据与历史记录的游标分页"""
+from datetime import datetime, timedelta
+
+import orjson
+
+from database import db, Session, SessionScore
+from db_adapter import get_user_session_history
+
+
+def post_frames(client, session_id, frames):
+    return client.post(f'/api/session/{session_id}/data/batch', data=orjson.dumps({"frames": frames}),
+                       content_type='application/json')
+
+
+def score_rows(session_id):
+    return db.session.execute(
+        db.select(SessionScore).where(SessionScore.session_id == session_id).order_by(SessionScore.id)
+    ).scalars().all()
+
+
+def test_batch_inserts_every_frame_and_updates_counters(make_session, client):
+    make_session('s1')
+    frames = [
+        {"is_correct": True, "score": 90, "feedback": "好"},
+        {"is_correct": False, "score": 40, "feedback": "膝盖内扣"},
+        {"is_correct": True, "score": 85},
+    ]
+
+    response = post_frames(client, 's1', frames)
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body["frames_received"] == 3
+    assert body["session_stats"] == {"total_count": 3, "correct_count": 2, "accuracy": 66.67}
+
+    rows = score_rows('s1')
+    assert [(row.score, row.is_correct, row.feedback) for row in rows] == [
+        (90, True, "好"), (40, False, "膝盖内扣"), (85, True, ""),
+    ]
+
+    # 计数在数据库中累加，第二批在第一批的基础上增加
+    response = post_frames(client, 's1', [{"is_correct": True, "score": 100}])
+    assert response.get_json()["session_stats"] == {"total_count": 4, "correct_count": 3, "accuracy": 75.0}
+    db.session.expire_all()
+    session_obj = db.session.get(Session, 's1')
+    assert (session_obj.total_count, session_obj.correct_count) == (4, 3)
+    assert len(score_rows('s1')) == 4
+
+
+def test_batch_correct_count_never_exceeds_total(make_session, client):
+    make_session('s1', total_count=2, correct_count=5)
+    body = post_frames(client, 's1', [{"is_correct": True}]).get_json()
+    assert body["session_stats"]["total_count"] == 3
+    assert body["session_stats"]["correct_count"] == 3
+
+
+def test_batch_plank_does_not_touch_counters(make_session, client):
+    make_session('p1', datetime.now() - timedelta(seconds=30), exercise_type='plank')
+    body = post_frames(client, 'p1', [{"is_correct": True}, {"is_correct": True}]).get_json()
+    assert body["session_stats"]["duration"] >= 30
+    db.session.expire_all()
+    session_obj = db.session.get(Session, 'p1')
+    assert (session_obj.total_count, session_obj.correct_count) == (0, 0)
+    assert len(score_rows('p1')) == 2
+
+
+def test_batch_rejects_invalid_requests(make_session, client):
+    make_session('s1')
+    assert post_frames(client, 'missing', [{"is_correct": True}]).status_code == 404
+    assert post_frames(client, 's1', []).status_code == 400
+    assert post_frames(client, 's1', [1, 2]).status_code == 400
+    response = client.post('/api/session/s1/data/batch', data=b'{', content_type='application/json')
+    assert response.status_code == 400
+    assert score_rows('s1') == []
+
+
+def walk_history(user_id, limit, **filters):
+    """按 next_cursor 逐页读取历史记录，返回会话ID列表"""
+    seen = []
+    cursor = None
+    while True:
+        before = None
+        if cursor:
+            start_time, _, session_id = cursor.partition(',')
+            before = (datetime.fromisoformat(start_time), session_id)
+        page, cursor = get_user_session_history(user_id, limit, before=before, **filters)
+        seen.extend(session['session_id'] for session in page)
+        if cursor is None:
+            return seen
+
+
+def test_history_cursor_walks_every_session_once(make_session):
+    start = datetime(2024, 5, 1, 8, 0)
+    for i in range(7):
+        make_session(f's{i}', start + timedelta(hours=i))
+    make_session('other-user', start + timedelta(hours=3), user_id='u2')
+
+    assert walk_history('u1', 3) == [f's{i}' for i in reversed(range(7))]
+
+
+def test_history_cursor_keeps_sessions_with_same_start_time(make_session):
+    # 同一时刻开始的会话跨越页边界时，按会话ID区分，不会被跳过或重复
+    start = datetime(2024, 5, 1, 8, 0)
+    for session_id in ['a', 'b', 'c', 'd', 'e']:
+        make_session(session_id, start)
+    make_session('earlier', start - timedelta(minutes=1))
+
+    assert walk_history('u1', 2) == ['e', 'd', 'c', 'b', 'a', 'earlier']
+
+
+def test_history_cursor_filters_by_exercise_type(make_session):
+    start = datetime(2024, 5, 1, 8, 0)
+    make_session('squat-1', start, exercise_type='squat')
+    make_session('pushup-1', start + timedelta(hours=1), exercise_type='pushup')
+    make_session('squat-2', start + timedelta(hours=2), exercise_type='squat')
+
+    assert walk_history('u1', 1, exercise_type='squat') == ['squat-2', 'squat-1']
+
+
+def test_history_endpoint_pages_with_next_cursor(make_session, client):
+    start = datetime(2024, 5, 1, 8, 0)
+    for session_id in ['a', 'b', 'c']:
+        make_session(session_id, start)
+
+    body = client.get('/api/user/u1/history?limit=2').get_json()
+    assert [session['session_id'] for session in body["sessions"]] == ['c', 'b']
+    assert body["next_cursor"] == f"{start.isoformat()},b"
+
+    body = client.get('/api/user/u1/history', query_string={"limit": 2, "before": body["next_cursor"]}).get_json()
+    assert [session['session_id'] for session in body["sessions"]] == ['a']
+    assert body["next_cursor"] is None
+
+    for bad in ['yesterday,b', start.isoformat()]:
+        assert client.get('/api/user/u1/history', query_string={"before": bad}).status_code == 400
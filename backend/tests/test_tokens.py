@@ -0,0 +1,59 @@
+"""token只以 SHA-256 摘要保存：查找、删除与过期清理"""
+import hashlib
+import secrets
+from datetime import datetime, timedelta
+
+from database import db, Token, hash_token, TOKEN_BYTES
+from db_adapter import parse_token, save_token, get_token, delete_token, purge_expired_tokens
+
+
+def new_token():
+    return secrets.token_bytes(TOKEN_BYTES).hex()
+
+
+def test_hash_token_is_sha256_digest():
+    raw = secrets.token_bytes(TOKEN_BYTES)
+    assert hash_token(raw) == hashlib.sha256(raw).digest()
+    assert parse_token(raw.hex()) == hashlib.sha256(raw).digest()
+
+
+def test_parse_token_rejects_malformed_tokens():
+    assert parse_token('not-hex') is None
+    assert parse_token(None) is None
+    assert parse_token(secrets.token_bytes(TOKEN_BYTES - 1).hex()) is None
+
+
+def test_token_stored_and_found_by_hash(make_user):
+    make_user()
+    token = new_token()
+    save_token(token, 'u1', datetime.now() + timedelta(days=1))
+
+    row = db.session.execute(db.select(Token)).scalar_one()
+    # 数据库中只有摘要，不出现原始token
+    assert row.token_hash == hashlib.sha256(bytes.fromhex(token)).digest()
+    assert row.token_hash != bytes.fromhex(token)
+
+    found = get_token(token)
+    assert found is not None and found.user_id == 'u1'
+    assert get_token(new_token()) is None
+    assert get_token('zz') is None
+
+
+def test_delete_token(make_user):
+    make_user()
+    token = new_token()
+    save_token(token, 'u1', datetime.now() + timedelta(days=1))
+    delete_token(token)
+    assert get_token(token) is None
+
+
+def test_purge_expired_tokens_only_removes_expired(make_user):
+    make_user()
+    live, expired = new_token(), new_token()
+    save_token(live, 'u1', datetime.now() + timedelta(hours=1))
+    save_token(expired, 'u1', datetime.now() - timedelta(seconds=1))
+
+    assert purge_expired_tokens() == 1
+    assert get_token(live) is not None
+    assert get_token(expired) is None
+    assert purge_expired_tokens() == 0
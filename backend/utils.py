@@ -3,9 +3,14 @@
 提供输入验证、错误处理等工具
 """
 import re
+import decimal
 import logging
+from datetime import date
 from functools import wraps
+import orjson
 from flask import jsonify
+from flask.json.provider import JSONProvider
+from werkzeug.http import http_date
 from database import db
 
 # 配置日志
@@ -16,21 +21,27 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+# 校验用的正则在模块加载时编译一次
+EMAIL_PATTERN = re.compile(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$')
+# 用户名：3-20个字符，只能包含字母、数字、下划线
+USERNAME_PATTERN = re.compile(r'^[a-zA-Z0-9_]{3,20}$')
+
+# 支持的运动类型
+VALID_EXERCISE_TYPES = frozenset(('squat', 'pushup', 'plank', 'jumping_jack'))
+
+
 def validate_email(email):
     """验证邮箱格式"""
     if not email:
         return False
-    pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-    return bool(re.match(pattern, email))
+    return bool(EMAIL_PATTERN.match(email))
 
 
 def validate_username(username):
     """验证用户名格式"""
     if not username:
         return False
-    # 用户名：3-20个字符，只能包含字母、数字、下划线
-    pattern = r'^[a-zA-Z0-9_]{3,20}$'
-    return bool(re.match(pattern, username))
+    return bool(USERNAME_PATTERN.match(username))
 
 
 def validate_password(password):
@@ -115,8 +126,11 @@ def sanitize_input(text, max_length=None):
 
 def validate_exercise_type(exercise_type):
     """验证运动类型"""
-    valid_types = ['squat', 'pushup', 'plank', 'jumping_jack']
-    return exercise_type in valid_types
+    try:
+        return exercise_type in VALID_EXERCISE_TYPES
+    except TypeError:
+        # 不可哈希的输入（如列表）不可能是合法的运动类型
+        return False
 
 
 def validate_session_data(data):
@@ -131,3 +145,39 @@ def validate_session_data(data):
     
     return True, None
 
+
+
+# ==================== JSON序列化 ====================
+
+# 日期时间交给 json_default 处理，与 Flask 默认的 HTTP 日期格式保持一致
+# numpy 数组和标量（规则引擎、姿态分析的计算结果）由 orjson 直接序列化
+# 与标准库 json 一样允许非字符串的字典键（如整数键），序列化时转为字符串
+ORJSON_OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+
+def json_default(obj):
+    """orjson 无法直接序列化的类型，转换规则与 Flask 默认 JSON Provider 一致"""
+    if isinstance(obj, date):
+        return http_date(obj)
+    if isinstance(obj, decimal.Decimal):
+        return str(obj)
+    if hasattr(obj, '__html__'):
+        return str(obj.__html__())
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class OrjsonProvider(JSONProvider):
+    """使用 orjson 的 Flask JSON Provider，jsonify 和 request.get_json 都会经过这里"""
+    mimetype = 'application/json'
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=json_default, option=ORJSON_OPTIONS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        # 直接输出 bytes，省去一次 decode/encode
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(obj, default=json_default, option=ORJSON_OPTIONS)
+        return self._app.response_class(body, mimetype=self.mimetype)
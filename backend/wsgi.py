@@ -0,0 +1,9 @@
+"""
+WSGI 入口
+生产环境使用 gunicorn 启动（配置见 gunicorn.conf.py）：
+    gunicorn -c gunicorn.conf.py wsgi:app
+"""
+from app import app
+
+if __name__ == '__main__':
+    app.run(host='0.0.0.0', port=8000)
@@ -292,6 +292,18 @@ const Profile: React.FC = () => {
 
   // AI生成健身计划建议
   
+  // 轮询AI计划生成任务，直到生成完成
+  const waitForAIPlan = async (jobId: string) => {
+    for (let attempt = 0; attempt < 60; attempt++) {
+      await new Promise(resolve => setTimeout(resolve, 1500));
+      const result = await api.get(`/api/user/plan/job/${jobId}`, token || undefined);
+      if (result.status !== 'pending') {
+        return result;
+      }
+    }
+    throw new Error('AI生成建议超时，请稍后重试');
+  };
+
   const handleGenerateAIPlan = async () => {
     setError('');
     setSuccess('');
@@ -300,7 +312,7 @@ const Profile: React.FC = () => {
     setAiResponse(null);
 
     try {
-      const response = await api.post(
+      const job = await api.post(
         '/api/ai/generate-plan',
         {
           height: height ? parseFloat(height) : undefined,
@@ -312,6 +324,7 @@ const Profile: React.FC = () => {
         },
         token || undefined
       );
+      const response = job.job_id ? await waitForAIPlan(job.job_id) : job;
 
       // 保存完整响应
       setAiResponse(response);
@@ -9,6 +9,25 @@ import { Activity, User, LogOut, Calendar, Target, Trophy } from 'lucide-react';
 import { useAuth } from '../contexts/AuthContext';
 import { api } from '../services/api';
 
+// AI简评长时间未生成时显示的默认简评
+const DEFAULT_AI_COMMENT = '训练不错！注意保持动作节奏，期待您下次的表现。';
+
+// 运动数据先在本地缓冲，攒够一批或每隔一段时间一次性提交到批量接口
+const FRAME_FLUSH_SIZE = 10;
+const FRAME_FLUSH_INTERVAL_MS = 2000;
+
+// 提交缓冲中的运动数据（一次请求写入多帧）
+const flushFrames = async (pendingFrames: React.MutableRefObject<any[]>, sessionId: string, token: string) => {
+  const frames = pendingFrames.current;
+  if (frames.length === 0) return;
+  pendingFrames.current = [];
+  try {
+    await api.post(`/api/session/${sessionId}/data/batch`, { frames }, token);
+  } catch (err) {
+    console.error('提交运动数据失败:', err);
+  }
+};
+
 function Home() {
   const [selectedExercise, setSelectedExercise] = useState('squat');
   const [duration, setDuration] = useState(0);
@@ -19,6 +38,7 @@ function Home() {
   const { user, token, logout } = useAuth();
   const navigate = useNavigate();
   const previousCountRef = useRef(0);
+  const pendingFramesRef = useRef<any[]>([]);
   
   // 打卡相关
   const [checkinStreak, setCheckinStreak] = useState(0);
@@ -102,8 +122,30 @@ function Home() {
      // 仅停止摄像头检测和计时器，不结束会话
      stopDetection();
      setIsTimerActive(false); 
+     if (sessionId && token) {
+       flushFrames(pendingFramesRef, sessionId, token);
+     }
   };
   
+  // AI简评在后台生成，结束会话后轮询获取
+  const pollAiComment = async (endedSessionId: string, authToken: string) => {
+    for (let attempt = 0; attempt < 20; attempt++) {
+      await new Promise(resolve => setTimeout(resolve, 1500));
+      try {
+        const result = await api.get(`/api/session/${endedSessionId}/ai_comment`, authToken);
+        if (result.ai_status !== 'pending') {
+          setSessionSummary((prev: any) => prev ? { ...prev, ai_comment: result.ai_comment } : prev);
+          return;
+        }
+      } catch (err) {
+        console.error('获取AI简评失败:', err);
+        break;
+      }
+    }
+    // 超时或出错时不再显示"正在生成"，改为默认简评
+    setSessionSummary((prev: any) => prev && !prev.ai_comment ? { ...prev, ai_comment: DEFAULT_AI_COMMENT } : prev);
+  };
+
   // 新增：结束本次运动
   const handleEndSession = async () => {
     if (isFinishing) return;
@@ -121,6 +163,9 @@ function Home() {
            ? Math.round((exerciseStats.correctCount || 0) / exerciseStats.totalCount * 100) 
            : 0;
 
+        // 结束前先提交尚未发送的运动数据
+        await flushFrames(pendingFramesRef, sessionId, token);
+
         const response = await api.post(
           `/api/session/${sessionId}/end`,
           {
@@ -136,6 +181,9 @@ function Home() {
         if (response.summary) {
           setSessionSummary(response.summary);
           setShowSummaryModal(true);
+          if (response.summary.ai_status === 'pending') {
+            pollAiComment(sessionId, token);
+          }
         }
 
         setSessionId(null);
@@ -168,28 +216,29 @@ function Home() {
     }
   };
 
-  // 当运动计数增加时，更新会话数据
+  // 当运动计数增加时，记录一帧会话数据，攒够一批后提交
   useEffect(() => {
     if (sessionId && token && isActive && exerciseStats.count > previousCountRef.current) {
-      const countDiff = exerciseStats.count - previousCountRef.current;
       previousCountRef.current = exerciseStats.count;
       
-      // 提交每次计数增加的数据
-      api.post(
-        `/api/session/${sessionId}/data`,
-        {
-          is_correct: exerciseStats.isCorrect,
-          score: exerciseStats.score,
-          feedback: exerciseStats.feedback,
-          pose_data: null // 实际项目中可以包含姿态数据
-        },
-        token
-      ).catch(err => {
-        console.error('提交运动数据失败:', err);
+      pendingFramesRef.current.push({
+        is_correct: exerciseStats.isCorrect,
+        score: exerciseStats.score,
+        feedback: exerciseStats.feedback
       });
+      if (pendingFramesRef.current.length >= FRAME_FLUSH_SIZE) {
+        flushFrames(pendingFramesRef, sessionId, token);
+      }
     }
   }, [exerciseStats.count, sessionId, token, isActive, exerciseStats.isCorrect, exerciseStats.score, exerciseStats.feedback]);
 
+  // 计数较慢时定期提交缓冲中的数据，避免长时间不落库
+  useEffect(() => {
+    if (!sessionId || !token) return;
+    const interval = setInterval(() => flushFrames(pendingFramesRef, sessionId, token), FRAME_FLUSH_INTERVAL_MS);
+    return () => clearInterval(interval);
+  }, [sessionId, token]);
+
   // 计时器效果
   useEffect(() => {
     let interval: NodeJS.Timeout | null = null;